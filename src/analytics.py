@@ -0,0 +1,212 @@
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+from normalization import normalize_text
+
+# --- Configuration (path)---
+database_path = "src/data/conversations.sqlite"
+
+# --- Configuration (rollups)---
+satisfaction_levels = ["Positive", "Neutral", "Negative"]
+# Coarse service buckets, the first matching keyword wins (service_rendered is free text)
+service_categories = [
+    ("disconnected", "Disconnected/No answer"), ("no answer", "Disconnected/No answer"),
+    ("refund", "Refund"), ("return", "Return"), ("cancel", "Cancellation"),
+    ("deliver", "Delivery"), ("order status", "Delivery"), ("assembl", "Assembly"),
+    ("availab", "Product availability"), ("stock", "Product availability"),
+    ("payment", "Payment"), ("warranty", "Warranty"), ("spare part", "Spare parts"),
+]
+unknown_bucket = "unknown"
+
+rollup_schema = """
+    CREATE TABLE IF NOT EXISTS satisfaction_rollups (
+        dimension TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        satisfaction TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (dimension, bucket, satisfaction)
+    );
+    CREATE TABLE IF NOT EXISTS rollup_contributions (
+        conversation_id TEXT NOT NULL,
+        dimension TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        satisfaction TEXT NOT NULL,
+        PRIMARY KEY (conversation_id, dimension)
+    );
+"""
+
+
+# --- Functions ---
+def parse_start_time(start_time: Optional[str]) -> Optional[datetime]:
+    if not start_time:
+        return None
+    try:
+        return datetime.fromisoformat(str(start_time).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def day_bucket(row: dict) -> str:
+    start = parse_start_time(row["start_time"])
+    return start.date().isoformat() if start else unknown_bucket
+
+
+def week_bucket(row: dict) -> str:
+    start = parse_start_time(row["start_time"])
+    if start is None:
+        return unknown_bucket
+    year, week, _ = start.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def service_bucket(row: dict) -> str:
+    service = normalize_text(row["service_rendered"])
+    if not service:
+        return unknown_bucket
+    for keyword, category in service_categories:
+        if keyword in service:
+            return category
+    return "Other"
+
+
+def text_bucket(column: str) -> Callable[[dict], str]:
+    return lambda row: normalize_text(row[column]) or unknown_bucket
+
+
+# Rollup dimension -> bucket of a joined (conversations + metadata) row
+dimensions: Dict[str, Callable[[dict], str]] = {
+    "day": day_bucket,
+    "week": week_bucket,
+    "country": text_bucket("country"),
+    "channel": text_bucket("channel"),
+    "store": text_bucket("store_normalized"),
+    "product_category": text_bucket("category_normalized"),
+    "service": service_bucket,
+    "week_country": lambda row: f"{week_bucket(row)}|{text_bucket('country')(row)}",
+    "week_channel": lambda row: f"{week_bucket(row)}|{text_bucket('channel')(row)}",
+}
+
+joined_columns = ["conversation_id", "store_normalized", "category_normalized", "service_rendered",
+                  "customer_satisfaction", "start_time", "country", "channel"]
+
+
+def ensure_rollup_tables(conn: sqlite3.Connection) -> None:
+    conn.executescript(rollup_schema)
+
+
+def _joined_rows(conn: sqlite3.Connection, conversation_ids: List[str]) -> Iterable[dict]:
+    for start in range(0, len(conversation_ids), 500):
+        ids = conversation_ids[start:start + 500]
+        rows = conn.execute(
+            "SELECT c.conversation_id, c.store_normalized, c.category_normalized, c.service_rendered, "
+            "c.customer_satisfaction, m.start_time, m.country, m.channel FROM conversations c "
+            f"LEFT JOIN metadata m ON m.conversation_id = c.conversation_id WHERE c.conversation_id IN ({','.join('?' * len(ids))})",
+            ids)
+        for row in rows:
+            yield dict(zip(joined_columns, row))
+
+
+def update_rollups(conn: sqlite3.Connection, conversation_ids: Iterable[str]) -> int:
+    """
+    Brings the rollups up to date for `conversation_ids` (new, re-extracted or with new metadata):
+    their previous contributions are subtracted and the current ones added, so only the affected buckets
+    change and reloading the same conversations never double counts. Runs in the caller's transaction.
+
+    Returns:
+        int: number of conversations counted
+    """
+    conversation_ids = list(dict.fromkeys(str(conversation_id) for conversation_id in conversation_ids))
+    if not conversation_ids:
+        return 0
+    deltas = {}
+    for start in range(0, len(conversation_ids), 500):
+        ids = conversation_ids[start:start + 500]
+        placeholders = ",".join("?" * len(ids))
+        for dimension, bucket, satisfaction in conn.execute(
+                f"SELECT dimension, bucket, satisfaction FROM rollup_contributions WHERE conversation_id IN ({placeholders})", ids):
+            deltas[(dimension, bucket, satisfaction)] = deltas.get((dimension, bucket, satisfaction), 0) - 1
+        conn.execute(f"DELETE FROM rollup_contributions WHERE conversation_id IN ({placeholders})", ids)
+
+    contributions, counted = [], 0
+    for row in _joined_rows(conn, conversation_ids):
+        satisfaction = row["customer_satisfaction"] or unknown_bucket
+        counted += 1
+        for dimension, bucket_fn in dimensions.items():
+            bucket = bucket_fn(row)
+            contributions.append((row["conversation_id"], dimension, bucket, satisfaction))
+            deltas[(dimension, bucket, satisfaction)] = deltas.get((dimension, bucket, satisfaction), 0) + 1
+    conn.executemany("INSERT INTO rollup_contributions VALUES (?, ?, ?, ?)", contributions)
+
+    changed = [(dimension, bucket, satisfaction, delta) for (dimension, bucket, satisfaction), delta in deltas.items() if delta]
+    conn.executemany(
+        "INSERT INTO satisfaction_rollups VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(dimension, bucket, satisfaction) DO UPDATE SET count = count + excluded.count", changed)
+    conn.execute("DELETE FROM satisfaction_rollups WHERE count <= 0")
+    return counted
+
+
+def rebuild_rollups(conn: sqlite3.Connection) -> int:
+    """Recomputes every rollup from scratch (after changing `dimensions` or `service_categories`)."""
+    ensure_rollup_tables(conn)
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DELETE FROM satisfaction_rollups")
+        conn.execute("DELETE FROM rollup_contributions")
+        conversation_ids = [row[0] for row in conn.execute("SELECT conversation_id FROM conversations")]
+        counted = update_rollups(conn, conversation_ids)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return counted
+
+
+def satisfaction_counts(conn: sqlite3.Connection, dimension: str, first_bucket: Optional[str] = None,
+                        last_bucket: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+    """
+    {bucket: {satisfaction: count}} for one dimension, optionally only buckets in [first_bucket, last_bucket]
+    (e.g. days '2024-01-01'..'2024-01-31'). Reads the precomputed rollups only.
+    """
+    if dimension not in dimensions:
+        raise ValueError(f"Unknown rollup dimension: {dimension}. Known dimensions: {', '.join(dimensions)}")
+    sql = "SELECT bucket, satisfaction, count FROM satisfaction_rollups WHERE dimension = ?"
+    parameters = [dimension]
+    if first_bucket is not None:
+        sql += " AND bucket >= ?"
+        parameters.append(first_bucket)
+    if last_bucket is not None:
+        sql += " AND bucket <= ?"
+        parameters.append(last_bucket)
+    counts = {}
+    for bucket, satisfaction, count in conn.execute(sql + " ORDER BY bucket", parameters):
+        counts.setdefault(bucket, {})[satisfaction] = count
+    return counts
+
+
+def satisfaction_shares(counts: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, float]]:
+    """Turns satisfaction_counts into shares per bucket (plus the bucket total)."""
+    shares = {}
+    for bucket, by_satisfaction in counts.items():
+        total = sum(by_satisfaction.values())
+        shares[bucket] = {level: round(by_satisfaction.get(level, 0) / total, 4) for level in satisfaction_levels}
+        shares[bucket]["total"] = total
+    return shares
+
+
+def print_dashboard(database_path: str = database_path, dimension_names: Iterable[str] = ("week", "store", "service")) -> None:
+    conn = sqlite3.connect(database_path)
+    try:
+        ensure_rollup_tables(conn)
+        for dimension in dimension_names:
+            start = time.perf_counter()
+            shares = satisfaction_shares(satisfaction_counts(conn, dimension))
+            print(f"\nCustomer satisfaction per {dimension} ({round((time.perf_counter() - start) * 1000, 2)} ms):")
+            for bucket, share in shares.items():
+                print(f"  {bucket:<30} {share}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    print_dashboard()
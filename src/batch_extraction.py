@@ -0,0 +1,183 @@
+import json
+from typing import Callable, Iterable, Iterator, List, Optional
+from llm_models import generate, json_output_settings
+from main import (ConversationInfo, iter_json_records, save_json_file, extract_conversation,
+                  json_file_path, output_path, failed_validation_output_path, extraction_model,
+                  get_extraction_response)
+from json_repair import parse_llm_json
+import main
+from rate_limiter import estimate_tokens
+import telemetry
+
+# --- Configuration (batching)---
+# Max estimated tokens per request (prompt + expected answer) and max conversations packed into one request
+batch_token_budget = 8000
+max_batch_size = 20
+output_tokens_per_conversation = 150
+
+
+# --- Functions ---
+def schema_description() -> str:
+    """JSON schema text for the prompt, built from the ConversationInfo field descriptions."""
+    return json.dumps({name: field.description for name, field in ConversationInfo.model_fields.items()}, indent=4)
+
+
+def batch_prompt(messages: List[dict]) -> str:
+    """Prompt asking for one ConversationInfo object per conversation, returned as a JSON array."""
+    conversations = "\n".join(
+        f"""
+        === Conversation {message.get("metadata", {}).get("conversation_id")} ===
+        Conversation Transcript:
+        ---
+        {message.get("transcript")}
+        ---
+        {message.get("metadata")}
+        ---"""
+        for message in messages)
+
+    query = f"""
+        You are an expert data analyst. Your task is to carefully read each of the following {len(messages)} customer support
+        conversations and extract specific pieces of information from each of them separately.
+        {conversations}
+
+        Based on the conversations, provide the requested information as a valid JSON array with exactly one object per
+        conversation, in the same order, each adhering to the following schema and carrying the conversation_id shown in its header.
+        Do not include any extra text or explanations outside of the JSON array.
+        Never lie or make up information, always base your answers on the information from the documents.
+        If you are certain a mentioned product is not a product of the company (e.g. 'a customers own mobile phone'), do not add it to products.
+        customer_satisfaction must be one of: 'Positive', 'Negative', 'Neutral'.
+
+        JSON Schema (for each array element):
+        {schema_description()}
+    """
+    return query
+
+
+def conversation_tokens(message: dict) -> int:
+    """Estimated tokens a conversation adds to a batch (its transcript and metadata plus its share of the answer)."""
+    return estimate_tokens(str(message.get("transcript"))) + estimate_tokens(str(message.get("metadata"))) + output_tokens_per_conversation
+
+
+def pack_batches(messages: Iterable[dict], token_budget: int = batch_token_budget,
+                 batch_size: int = max_batch_size) -> Iterator[List[dict]]:
+    """
+    Greedily packs conversations, in input order, into batches that fit `token_budget`
+    (including the shared instructions) and hold at most `batch_size` conversations.
+    A conversation that is too big on its own gets a batch of one.
+    """
+    overhead = estimate_tokens(batch_prompt([]))
+    batch, batch_tokens = [], overhead
+    for message in messages:
+        tokens = conversation_tokens(message)
+        if batch and (batch_tokens + tokens > token_budget or len(batch) >= batch_size):
+            yield batch
+            batch, batch_tokens = [], overhead
+        batch.append(message)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def parse_batch_response(batch: List[dict], response_text: str) -> tuple[List[dict], List[dict]]:
+    """
+    Validates each element of a batched answer on its own.
+
+    Returns:
+        tuple: (validated extractions, conversations of the batch that need a single-conversation retry)
+    """
+    try:
+        json_response = parse_llm_json(response_text)
+        if not isinstance(json_response, list):
+            raise TypeError("Batched response is not a JSON array.")
+    except (json.JSONDecodeError, TypeError, AttributeError) as e:
+        print(f"Could not parse batched LLM response ({len(batch)} conversations), falling back to single requests: {e}")
+        return [], list(batch)
+
+    elements_by_id = {}
+    for element in json_response:
+        if isinstance(element, dict):
+            elements_by_id.setdefault(str(element.get("conversation_id")), element)
+
+    extracted, retry = [], []
+    for message in batch:
+        conversation_id = str(message.get("metadata", {}).get("conversation_id"))
+        element = elements_by_id.get(conversation_id)
+        try:
+            if element is None:
+                raise ValueError("Missing from batched response.")
+            ConversationInfo(**element)
+            extracted.append(element)
+            print(f"Successfully processed conversation: {conversation_id}")
+        except Exception as e:
+            print(f"Batched element for conversation {conversation_id} failed ({e}), retrying on its own.")
+            retry.append(message)
+    return extracted, retry
+
+
+def get_batch_response(prompt: str) -> str:
+    """Sends a batch prompt to the extraction model (constrained to a list of ConversationInfo with structured output)."""
+    return generate(prompt, extraction_model,
+                    settings=json_output_settings(List[ConversationInfo]) if main.use_structured_output else None)
+
+
+def format_conversation_batched(json_file_path: str, llm_fn: Callable[[str], str] = get_batch_response,
+                                token_budget: int = batch_token_budget,
+                                batch_size: int = max_batch_size,
+                                single_llm_fn: Optional[Callable[[str], str]] = None) -> tuple[List[dict], List[dict]]:
+    """Batched version of main.format_conversation.
+
+    Sends several conversations per request, packed up to `token_budget`. Conversations whose element
+    is missing or fails ConversationInfo validation fall back to single-conversation requests
+    (sent with `single_llm_fn`, by default main.get_extraction_response for the default `llm_fn`, else `llm_fn`).
+    Results keep the input order.
+
+    Returns:
+        tuple: (successful_extractions, failed_extractions)
+    """
+    all_extracted_info = []
+    failed_extractions = []
+    requests, fallbacks = 0, 0
+    if single_llm_fn is None:
+        single_llm_fn = get_extraction_response if llm_fn is get_batch_response else llm_fn
+
+    for batch in pack_batches(iter_json_records(json_file_path), token_budget, batch_size):
+        requests += 1
+        try:
+            response_text = llm_fn(batch_prompt(batch))
+            extracted, retry = parse_batch_response(batch, response_text)
+        except Exception as e:
+            print(f"Batched request failed ({e}), falling back to single requests.")
+            extracted, retry = [], list(batch)
+
+        extracted_by_id = {str(info.get("conversation_id")): info for info in extracted}
+        retry_ids = {id(message) for message in retry}
+        for message in batch:
+            if id(message) in retry_ids:
+                requests += 1
+                fallbacks += 1
+                succeeded, record = extract_conversation(message, single_llm_fn)
+                (all_extracted_info if succeeded else failed_extractions).append(record)
+            else:
+                all_extracted_info.append(extracted_by_id[str(message.get("metadata", {}).get("conversation_id"))])
+
+    total = len(all_extracted_info) + len(failed_extractions)
+    telemetry.record_retry("extract", fallbacks)
+    print(f"Batched extraction: {total} conversations in {requests} requests ({fallbacks} single-conversation fallbacks).")
+    return all_extracted_info, failed_extractions
+
+
+if __name__ == "__main__":
+    extracted_data, failed_data = format_conversation_batched(json_file_path)
+
+    if extracted_data:
+        save_json_file(extracted_data, output_path)
+        print(f"Extracted and saved information for {len(extracted_data)} conversations.")
+    else:
+        print("No data was extracted.")
+
+    if failed_data:
+        save_json_file(failed_data, failed_validation_output_path)
+        print(f"Saved {len(failed_data)} failed conversations to {failed_validation_output_path}")
+    else:
+        print("No failed conversations were found.")
+    telemetry.report()
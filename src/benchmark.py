@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import data_processing
+import evaluation_rag
+import json_repair
+import llm_models
+from fake_llm import FakeLLM
+from generate_raw_conversations import write_dataset
+from json_io import iter_json_records
+from main import extract_to_jsonl_async
+from rate_limiter import estimate_tokens
+
+# --- Configuration ---
+# Sizes can also be given on the command line: python src/benchmark.py 1000 100000
+dataset_sizes = [1_000, 100_000, 1_000_000]
+results_dir = "src/data/benchmarks"
+seed = 42
+# Simulated LLM: median latency (s), lognormal spread, share of failing calls and of truncated JSON answers
+fake_llm_settings = {"latency": 0.02, "distribution": "lognormal", "sigma": 0.5,
+                     "error_rate": 0.01, "malformed_rate": 0.02}
+# Share of fields the simulated extraction gets different from the answer sheet (many become judge work)
+extraction_perturb_rate = 0.1
+extraction_concurrency = 256
+preprocess_workers = 1
+judge_batch_size = 10
+
+
+class CallRecorder:
+    """Wraps a (fake) LLM and records latency and estimated tokens of every call."""
+
+    def __init__(self, llm: FakeLLM):
+        self.llm = llm
+        self.latencies: List[float] = []
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.errors = 0
+
+    def _record(self, prompt: str, response: Optional[str], start: float) -> None:
+        self.latencies.append(time.perf_counter() - start)
+        self.input_tokens += estimate_tokens(prompt)
+        if response is None:
+            self.errors += 1
+        else:
+            self.output_tokens += estimate_tokens(response)
+
+    def __call__(self, prompt: str) -> str:
+        start, response = time.perf_counter(), None
+        try:
+            response = self.llm(prompt)
+            return response
+        finally:
+            self._record(prompt, response, start)
+
+    async def acall(self, prompt: str) -> str:
+        start, response = time.perf_counter(), None
+        try:
+            response = await self.llm.acall(prompt)
+            return response
+        finally:
+            self._record(prompt, response, start)
+
+    def report(self) -> dict:
+        return {
+            "llm_calls": len(self.latencies),
+            "llm_errors": self.errors,
+            "latency_p50_ms": round(percentile(self.latencies, 50) * 1000, 2),
+            "latency_p99_ms": round(percentile(self.latencies, 99) * 1000, 2),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
+
+
+# --- Functions ---
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile, 0 for no values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far (MB), None where the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def run_stage(name: str, conversations_fn, stage_fn) -> dict:
+    """Runs one stage with its prints silenced, returns wall time, throughput and peak RSS."""
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        stage_fn()
+    wall = time.perf_counter() - start
+    conversations = conversations_fn()
+    result = {
+        "wall_seconds": round(wall, 3),
+        "conversations": conversations,
+        "conversations_per_second": round(conversations / wall, 1) if wall else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"  {name}: {result}")
+    return result
+
+
+def benchmark_size(size: int, workdir: str) -> dict:
+    """Runs preprocessing, extraction and evaluation on `size` generated conversations."""
+    raw_path = os.path.join(workdir, "raw.jsonl")
+    facit_path = os.path.join(workdir, "facit.jsonl")
+    transformed_path = os.path.join(workdir, "transformed.jsonl")
+    extracted_path = os.path.join(workdir, "extracted.jsonl")
+    failed_path = os.path.join(workdir, "failed.jsonl")
+    evaluation_path = os.path.join(workdir, "evaluation.jsonl")
+    stages = {}
+
+    print(f"Benchmarking {size} conversations")
+    stages["generate"] = run_stage("generate", lambda: size, lambda: write_dataset(raw_path, facit_path, size, seed))
+
+    stages["preprocess"] = run_stage(
+        "preprocess", lambda: count_lines(transformed_path),
+        lambda: data_processing.stream_to_jsonl(raw_path, transformed_path, workers=preprocess_workers))
+
+    # Answers derived from the answer sheet, so evaluation finds ambiguous pairs for the judge like with a real model
+    answers = {str(record["conversation_id"]): record for record in iter_json_records(facit_path)}
+    extraction_llm = CallRecorder(FakeLLM(seed=seed, answers=answers, perturb_rate=extraction_perturb_rate, **fake_llm_settings))
+    json_repair.reset_repair_stats()
+    stages["extract"] = run_stage(
+        "extract", lambda: count_lines(extracted_path) + count_lines(failed_path),
+        lambda: asyncio.run(extract_to_jsonl_async(transformed_path, extracted_path, failed_path,
+                                                   llm_fn=extraction_llm.acall, resume=False,
+                                                   max_concurrency=extraction_concurrency)))
+    stages["extract"].update(extraction_llm.report())
+    stages["extract"]["failed_conversations"] = count_lines(failed_path)
+    # Answers that were only usable after the local JSON repair (each one a saved retry)
+    stages["extract"]["json_repaired"] = json_repair.repair_stats["repaired"]
+
+    # The judge goes through llm_models, route it to the simulated LLM without rate limit or cache
+    judge_llm = CallRecorder(FakeLLM(seed=seed, **fake_llm_settings))
+    llm_models.register_backend("benchmark", llm_models.StubBackend(judge_llm))
+    llm_models.set_backend_override("benchmark")
+    llm_models.set_cache_bypass(True)
+    judge_requests_per_minute = evaluation_rag.judge_requests_per_minute
+    evaluation_rag.judge_requests_per_minute = None
+    try:
+        stages["evaluate"] = run_stage(
+            "evaluate", lambda: count_lines(evaluation_path),
+            lambda: evaluation_rag.eval_main(facit_path, extracted_path, batch_size=judge_batch_size,
+                                             output_path=evaluation_path))
+    finally:
+        evaluation_rag.judge_requests_per_minute = judge_requests_per_minute
+        llm_models.set_backend_override(None)
+        llm_models.set_cache_bypass(False)
+    stages["evaluate"].update(judge_llm.report())
+
+    return {"size": size, "stages": stages}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes: List[int] = dataset_sizes, results_dir: str = results_dir) -> str:
+    """Benchmarks every dataset size and saves the results as JSON. Returns the results file path."""
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "fake_llm": fake_llm_settings,
+            "extraction_perturb_rate": extraction_perturb_rate,
+            "extraction_concurrency": extraction_concurrency,
+            "preprocess_workers": preprocess_workers,
+            "judge_batch_size": judge_batch_size,
+            "seed": seed,
+        },
+        "results": [],
+    }
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            results["results"].append(benchmark_size(size, workdir))
+
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print(f"Saved benchmark results to {results_path}")
+    return results_path
+
+
+def compare_results(baseline_path: str, new_path: str) -> None:
+    """Prints the throughput change per size and stage between two benchmark result files."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {result["size"]: result["stages"] for result in json.load(f)["results"]}
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = {result["size"]: result["stages"] for result in json.load(f)["results"]}
+
+    for size in sorted(set(baseline) & set(new)):
+        for stage in new[size]:
+            before = baseline[size].get(stage, {}).get("conversations_per_second")
+            after = new[size][stage].get("conversations_per_second")
+            if before and after:
+                print(f"{size:>9} {stage:<10} {before:>10} -> {after:>10} conv/s ({round((after / before - 1) * 100, 1):+}%)")
+
+
+if __name__ == "__main__":
+    run_benchmarks([int(size) for size in sys.argv[1:]] or dataset_sizes)
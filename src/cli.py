@@ -0,0 +1,240 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+# Only the standard library is imported here: every subcommand imports its own modules when it runs,
+# so preprocess and score-only evaluation never load pydantic or the google-genai SDK.
+
+# --- Configuration (path)---
+# Outputs of a run go to <runs_dir>/<run>/<kind>_<model>.jsonl, <run> defaults to a timestamp
+runs_dir = "src/data/runs"
+facit_path = "src/data/evaluation/facit.json"
+
+
+# --- Functions ---
+def new_run_name() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+
+def latest_run() -> Optional[str]:
+    runs = [name for name in os.listdir(runs_dir) if os.path.isdir(os.path.join(runs_dir, name))] if os.path.isdir(runs_dir) else []
+    return max(runs, key=lambda name: os.path.getmtime(os.path.join(runs_dir, name))) if runs else None
+
+
+def default_run(args: argparse.Namespace) -> Optional[str]:
+    """The run a command continues when --run is not given: preprocess -> extract -> evaluate share one run."""
+    if args.command == "evaluate":
+        return latest_run()
+    if args.command == "extract" and not args.input:
+        run = latest_run()
+        if run and os.path.exists(os.path.join(runs_dir, run, "transformed.jsonl")):
+            return run
+    return None
+
+
+def run_path(run: str, kind: str, model: Optional[str] = None, extension: str = "jsonl") -> str:
+    """Output file of a run, e.g. run_path('20250101-120000', 'extractions', 'gemini-2.5-flash')."""
+    name = f"{kind}_{model}" if model else kind
+    path = os.path.join(runs_dir, run, f"{name}.{extension}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def find_run_file(run: str, kind: str) -> str:
+    """The single <kind>_*.jsonl file of a run (e.g. its extractions when only one model was run)."""
+    matches = sorted(glob.glob(os.path.join(runs_dir, run, f"{kind}_*.jsonl")))
+    if len(matches) != 1:
+        found = ", ".join(matches) if matches else "none"
+        raise SystemExit(f"Expected one {kind} file in run {run} (found: {found}), pass it explicitly.")
+    return matches[0]
+
+
+def record_command(run: str, command: str, arguments: dict) -> None:
+    """Appends the resolved arguments of a command to the run's commands.jsonl, so every output can be traced."""
+    with open(run_path(run, "commands"), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"time": datetime.now().isoformat(timespec="seconds"), "command": command,
+                            "arguments": arguments}, ensure_ascii=False) + "\n")
+
+
+def preprocess(args: argparse.Namespace) -> None:
+    import data_processing
+    input_path = args.input or data_processing.json_file_path
+    output_path = args.output or run_path(args.run, "transformed")
+    record_command(args.run, "preprocess", {"input": input_path, "output": output_path, "workers": args.workers})
+    data_processing.stream_to_jsonl(input_path, output_path, workers=args.workers, chunk_size=args.chunk_size)
+    print(f"Run {args.run}: transformed conversations in {output_path}")
+
+
+def extract(args: argparse.Namespace) -> None:
+    import asyncio
+    import main
+    if args.model:
+        main.extraction_model = args.model
+    main.use_few_shot = args.few_shot or main.use_few_shot
+    main.use_long_conversation_mode = args.long_conversations or main.use_long_conversation_mode
+    if args.cascade and main.use_long_conversation_mode:
+        # The cascade sends whole transcripts to every tier, it has no chunked mode
+        raise SystemExit("--cascade cannot be combined with long conversation mode (--long-conversations or "
+                         "main.use_long_conversation_mode), run them separately.")
+    transformed_path = os.path.join(runs_dir, args.run, "transformed.jsonl")
+    if not args.input and not os.path.exists(transformed_path):
+        raise SystemExit(f"Run {args.run} has no transformed.jsonl, run preprocess first or pass --input "
+                         f"(e.g. --input {main.json_file_path}).")
+    input_path = args.input or transformed_path
+    model_label = "cascade" if args.cascade else main.extraction_model
+    output_path = args.output or run_path(args.run, "extractions", model_label)
+    failed_output_path = args.failed_output or run_path(args.run, "failed", model_label)
+    resume = not args.no_resume
+    record_command(args.run, "extract", {"input": input_path, "output": output_path, "model": model_label,
+                                         "async": args.use_async, "few_shot": main.use_few_shot,
+                                         "long_conversations": main.use_long_conversation_mode})
+
+    if args.cascade:
+        import model_cascade
+        report = model_cascade.cascade_to_jsonl(input_path, output_path, failed_output_path,
+                                                run_path(args.run, "cascade_tiers"), resume=resume)
+        model_cascade.print_report(report)
+        model_cascade.save_report(report, run_path(args.run, "cascade_report", extension="json"))
+        return
+    if args.use_async:
+        succeeded_count, failed_count = asyncio.run(main.extract_to_jsonl_async(
+            input_path, output_path, failed_output_path, resume=resume,
+            max_concurrency=args.concurrency or main.max_concurrency,
+            requests_per_minute=args.requests_per_minute or main.requests_per_minute,
+            tokens_per_minute=main.tokens_per_minute))
+    else:
+        succeeded_count, failed_count = main.extract_to_jsonl(input_path, output_path, failed_output_path, resume=resume)
+    print(f"Run {args.run}: extracted {succeeded_count} conversations to {output_path}, "
+          f"{failed_count} failed (see {failed_output_path}).")
+
+
+def evaluate(args: argparse.Namespace) -> None:
+    import evaluation_rag
+    if args.judge_model:
+        evaluation_rag.judge_model = args.judge_model
+    extractions_path = args.extractions or find_run_file(args.run, "extractions")
+    # A sampled evaluation never overwrites the full one
+    kind = "sampled_evaluation" if args.sample or args.compare else "evaluation"
+    output_path = args.output or os.path.join(
+        os.path.dirname(extractions_path), os.path.basename(extractions_path).replace("extractions", kind, 1))
+    if output_path == extractions_path:
+        output_path = run_path(args.run, kind)
+    record_command(args.run, "evaluate", {"facit": args.facit, "extractions": extractions_path, "output": output_path,
+                                          "score_only": args.score_only, "sample": args.sample, "compare": args.compare})
+    if args.sample or args.compare:
+        import sampled_evaluation
+        outputs = {os.path.basename(extractions_path): extractions_path}
+        if args.compare:
+            # Outputs of different runs may share a file name
+            outputs[args.compare if os.path.basename(args.compare) in outputs else os.path.basename(args.compare)] = args.compare
+        report = sampled_evaluation.sampled_eval(args.facit, outputs, results_path=output_path, use_judge=not args.score_only)
+        sampled_evaluation.print_report(report)
+        sampled_evaluation.save_report(report, output_path.rsplit(".", 1)[0] + "_report.json")
+        return
+    evaluation_rag.eval_main(args.facit, extractions_path, batch_size=args.batch_size or evaluation_rag.judge_batch_size,
+                             output_path=output_path, use_judge=not args.score_only)
+    evaluation_rag.sum_conversation_scores(output_path)
+
+
+def generate(args: argparse.Namespace) -> None:
+    import asyncio
+    import generate_synthetic_data
+    if args.model:
+        generate_synthetic_data.generation_model = args.model
+    output_path = args.output or run_path(args.run, "synthetic", generate_synthetic_data.generation_model)
+    count = args.count or generate_synthetic_data.target_count
+    record_command(args.run, "generate", {"output": output_path, "model": generate_synthetic_data.generation_model,
+                                          "count": count})
+    asyncio.run(generate_synthetic_data.generate_to_jsonl(
+        output_path, count, max_concurrency=args.concurrency or generate_synthetic_data.max_concurrency))
+
+
+def build_parser() -> tuple[argparse.ArgumentParser, dict]:
+    """The CLI parser and its subcommand parsers by name."""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", help="JSON file with option defaults: {\"common\": {...}, \"<command>\": {...}}, "
+                                         "keys are the option names with '_' (flags still win)")
+    common.add_argument("--run", help="run name, outputs go to <runs_dir>/<run>/ (default: new timestamp; extract: "
+                                      "latest run with a transformed.jsonl unless --input is given; evaluate: latest run)")
+    common.add_argument("--telemetry", action="store_true", help="record telemetry (as TELEMETRY=1)")
+
+    parser = argparse.ArgumentParser(prog="cli.py", description="Conversation extraction pipeline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    command = subparsers.add_parser("preprocess", parents=[common], help="raw export -> transformed JSONL")
+    command.add_argument("--input", help="raw conversations (JSON array or JSONL)")
+    command.add_argument("--output")
+    command.add_argument("--workers", type=int, default=1)
+    command.add_argument("--chunk-size", type=int, default=256)
+    command.set_defaults(handler=preprocess)
+
+    command = subparsers.add_parser("extract", parents=[common], help="transformed conversations -> extractions")
+    command.add_argument("--input", help="transformed conversations (default: the run's transformed.jsonl)")
+    command.add_argument("--model", help="model name in llm_models.MODEL_REGISTRY")
+    command.add_argument("--output")
+    command.add_argument("--failed-output")
+    command.add_argument("--async", dest="use_async", action="store_true", help="concurrent extraction")
+    command.add_argument("--concurrency", type=int)
+    command.add_argument("--requests-per-minute", type=float)
+    command.add_argument("--cascade", action="store_true",
+                         help="cheap-first model cascade (model_cascade.py), not with --long-conversations")
+    command.add_argument("--few-shot", action="store_true", help="add similar labelled examples (example_index.py)")
+    command.add_argument("--long-conversations", action="store_true",
+                         help="extract long transcripts in parallel chunks (long_conversations.py)")
+    command.add_argument("--no-resume", action="store_true", help="start over instead of skipping done conversations")
+    command.set_defaults(handler=extract)
+
+    command = subparsers.add_parser("evaluate", parents=[common], help="score extractions against the answer sheet")
+    command.add_argument("--extractions", help="default: the run's only extractions file")
+    command.add_argument("--facit", default=facit_path)
+    command.add_argument("--output")
+    command.add_argument("--score-only", action="store_true", help="local field scoring only, no LLM judge")
+    command.add_argument("--sample", action="store_true",
+                         help="stratified sample with bootstrap intervals, stops early once precise (sampled_evaluation.py)")
+    command.add_argument("--compare", help="second extractions file, scored on the same sample (paired difference)")
+    command.add_argument("--judge-model")
+    command.add_argument("--batch-size", type=int)
+    command.set_defaults(handler=evaluate)
+
+    command = subparsers.add_parser("generate", parents=[common], help="generate synthetic labelled examples")
+    command.add_argument("--output")
+    command.add_argument("--model")
+    command.add_argument("--count", type=int)
+    command.add_argument("--concurrency", type=int)
+    command.set_defaults(handler=generate)
+    return parser, subparsers.choices
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    """Parses the command line, with the defaults of the --config file (when given) under the explicit flags."""
+    parser, commands = build_parser()
+    args = parser.parse_args(argv)
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        defaults = {**config.get("common", {}), **config.get(args.command, {})}
+        unknown = [key for key in defaults if not hasattr(args, key) or key in ("handler", "command", "config")]
+        if unknown:
+            parser.error(f"Unknown options in {args.config} for {args.command}: {', '.join(unknown)}")
+        commands[args.command].set_defaults(**defaults)
+        args = parser.parse_args(argv)
+    if args.run is None:
+        args.run = default_run(args) or new_run_name()
+    return args
+
+
+def run(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    import telemetry
+    if args.telemetry:
+        telemetry.enable()
+    args.handler(args)
+    telemetry.report()
+
+
+if __name__ == "__main__":
+    run()
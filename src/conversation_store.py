@@ -0,0 +1,286 @@
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+import analytics
+from json_io import iter_json_records
+from normalization import normalize_text, split_numbers
+
+# --- Configuration (path)---
+database_path = "src/data/conversations.sqlite"
+extractions_path = "src/data/test_data_gemini_2.5_flash.jsonl"
+transformed_path = "src/data/transformed_oscar_data.jsonl"
+parquet_output_dir = "src/data/parquet"
+# Records written per transaction
+write_batch_size = 5000
+# Keep the satisfaction rollups of analytics.py up to date on every write
+maintain_rollups = True
+
+schema = """
+    CREATE TABLE IF NOT EXISTS conversations (
+        conversation_id TEXT PRIMARY KEY,
+        store_location TEXT,
+        store_normalized TEXT,
+        product_category TEXT,
+        category_normalized TEXT,
+        service_rendered TEXT,
+        customer_satisfaction TEXT,
+        case_or_order_number TEXT,
+        extracted_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS products (
+        conversation_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        name_normalized TEXT NOT NULL,
+        family TEXT NOT NULL,
+        PRIMARY KEY (conversation_id, position)
+    );
+    CREATE TABLE IF NOT EXISTS case_order_numbers (
+        conversation_id TEXT NOT NULL,
+        number TEXT NOT NULL,
+        PRIMARY KEY (conversation_id, number)
+    );
+    CREATE TABLE IF NOT EXISTS metadata (
+        conversation_id TEXT PRIMARY KEY,
+        country TEXT,
+        channel TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        published INTEGER,
+        translator TEXT,
+        wait_message_duplicates INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_conversations_store ON conversations(store_normalized);
+    CREATE INDEX IF NOT EXISTS idx_conversations_category ON conversations(category_normalized);
+    CREATE INDEX IF NOT EXISTS idx_conversations_satisfaction ON conversations(customer_satisfaction);
+    CREATE INDEX IF NOT EXISTS idx_products_name ON products(name_normalized);
+    CREATE INDEX IF NOT EXISTS idx_products_family ON products(family);
+    CREATE INDEX IF NOT EXISTS idx_case_order_numbers_number ON case_order_numbers(number);
+    CREATE INDEX IF NOT EXISTS idx_metadata_start_time ON metadata(start_time);
+    CREATE INDEX IF NOT EXISTS idx_metadata_country_channel ON metadata(country, channel);
+"""
+tables = ["conversations", "products", "case_order_numbers", "metadata"]
+metadata_fields = ["country", "channel", "start_time", "end_time", "published", "translator", "wait_message_duplicates"]
+
+
+# --- Functions ---
+def chunks(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class ConversationStore:
+    """
+    SQLite sink for extracted conversations, normalized into conversations, products,
+    case_order_numbers and metadata tables with indexes on the columns that are queried
+    (store, category, satisfaction, product name/family, order/case number, start time, country/channel).
+
+    Records are written in bulk, one transaction per `batch_size` records. Writing a conversation_id
+    again replaces its rows, so reloading a rerun's output is safe. With `rollups`, the analytics
+    rollups of the written conversations are updated in the same transaction.
+    """
+
+    def __init__(self, path: str = database_path, batch_size: int = write_batch_size, rollups: bool = maintain_rollups):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.rollups = rollups
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(schema)
+        if rollups:
+            analytics.ensure_rollup_tables(self._conn)
+
+    def _write_batch(self, statements: List[tuple[str, list]], conversation_ids: List[str]) -> None:
+        self._conn.execute("BEGIN")
+        try:
+            for sql, rows in statements:
+                if rows:
+                    self._conn.executemany(sql, rows)
+            if self.rollups:
+                analytics.update_rollups(self._conn, conversation_ids)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def write_extractions(self, records: Iterable[dict]) -> int:
+        """Writes ConversationInfo-shaped records. Returns the number of records written."""
+        count = 0
+        for batch in chunks(records, self.batch_size):
+            now = time.time()
+            ids = [(str(record.get("conversation_id")),) for record in batch]
+            conversations, products, numbers = [], [], []
+            for record in batch:
+                conversation_id = str(record.get("conversation_id"))
+                conversations.append((
+                    conversation_id, record.get("store_location"), normalize_text(record.get("store_location")),
+                    record.get("product_category"), normalize_text(record.get("product_category")),
+                    record.get("service_rendered"), record.get("customer_satisfaction"),
+                    record.get("case_or_order_number"), now))
+                for position, name in enumerate(record.get("products") or []):
+                    normalized = normalize_text(name)
+                    products.append((conversation_id, position, str(name), normalized, normalized.split(" ")[0]))
+                numbers += [(conversation_id, number) for number in split_numbers(record.get("case_or_order_number"))]
+
+            self._write_batch([
+                ("DELETE FROM products WHERE conversation_id = ?", ids),
+                ("DELETE FROM case_order_numbers WHERE conversation_id = ?", ids),
+                ("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", conversations),
+                ("INSERT INTO products VALUES (?, ?, ?, ?, ?)", products),
+                ("INSERT OR IGNORE INTO case_order_numbers VALUES (?, ?)", numbers),
+            ], [conversation_id for conversation_id, in ids])
+            count += len(batch)
+        return count
+
+    def write_metadata(self, conversations: Iterable[dict]) -> int:
+        """Writes the metadata of transformed conversations (data_processing output). Returns the number written."""
+        count = 0
+        for batch in chunks(conversations, self.batch_size):
+            rows = []
+            for conversation in batch:
+                metadata = conversation.get("metadata") or {}
+                conversation_id = str(metadata.get("conversation_id", conversation.get("conversation_id")))
+                rows.append((conversation_id, *(metadata.get(field) for field in metadata_fields)))
+            self._write_batch([("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)],
+                              [row[0] for row in rows])
+            count += len(batch)
+        return count
+
+    def _products(self, conversation_ids: List[str]) -> dict:
+        products = {}
+        for start in range(0, len(conversation_ids), 500):
+            ids = conversation_ids[start:start + 500]
+            rows = self._conn.execute(
+                f"SELECT conversation_id, name FROM products WHERE conversation_id IN ({','.join('?' * len(ids))}) "
+                "ORDER BY conversation_id, position", ids)
+            for conversation_id, name in rows:
+                products.setdefault(conversation_id, []).append(name)
+        return products
+
+    def _records(self, rows: list) -> List[dict]:
+        products = self._products([row[0] for row in rows])
+        return [{
+            "conversation_id": conversation_id,
+            "products": products.get(conversation_id, []),
+            "store_location": store_location,
+            "product_category": product_category,
+            "service_rendered": service_rendered,
+            "customer_satisfaction": customer_satisfaction,
+            "case_or_order_number": case_or_order_number,
+        } for conversation_id, store_location, product_category, service_rendered, customer_satisfaction, case_or_order_number in rows]
+
+    def get(self, conversation_id: str) -> Optional[dict]:
+        """The ConversationInfo-shaped record of one conversation, None if it is not stored."""
+        rows = self._conn.execute(
+            "SELECT conversation_id, store_location, product_category, service_rendered, customer_satisfaction, "
+            "case_or_order_number FROM conversations WHERE conversation_id = ?", (str(conversation_id),)).fetchall()
+        records = self._records(rows)
+        return records[0] if records else None
+
+    def find_by_product(self, product: str, store: Optional[str] = None) -> List[dict]:
+        """
+        Conversations mentioning `product` (full normalized name or product family, e.g. 'SOCKERBIT'),
+        optionally only at `store`. Both lookups go through indexes.
+        """
+        normalized = normalize_text(product)
+        sql = ("SELECT DISTINCT c.conversation_id, c.store_location, c.product_category, c.service_rendered, "
+               "c.customer_satisfaction, c.case_or_order_number FROM products p "
+               "JOIN conversations c ON c.conversation_id = p.conversation_id "
+               "WHERE (p.family = ? OR p.name_normalized = ?)")
+        parameters = [normalized, normalized]
+        if store is not None:
+            sql += " AND c.store_normalized = ?"
+            parameters.append(normalize_text(store))
+        return self._records(self._conn.execute(sql, parameters).fetchall())
+
+    def find_by_number(self, number: str) -> List[dict]:
+        """Conversations mentioning an order/case number, written any way ('471. 515. 124' == '471515124')."""
+        numbers = split_numbers(number)
+        if not numbers:
+            return []
+        rows = self._conn.execute(
+            "SELECT DISTINCT c.conversation_id, c.store_location, c.product_category, c.service_rendered, "
+            "c.customer_satisfaction, c.case_or_order_number FROM case_order_numbers n "
+            "JOIN conversations c ON c.conversation_id = n.conversation_id "
+            f"WHERE n.number IN ({','.join('?' * len(numbers))})", sorted(numbers)).fetchall()
+        return self._records(rows)
+
+    def satisfaction_counts(self, dimension: str, first_bucket: Optional[str] = None,
+                            last_bucket: Optional[str] = None) -> Dict[str, Dict[str, int]]:
+        """Precomputed satisfaction counts per bucket of `dimension` (see analytics.dimensions)."""
+        return analytics.satisfaction_counts(self._conn, dimension, first_bucket, last_bucket)
+
+    def count(self, table: str = "conversations") -> int:
+        if table not in tables:
+            raise ValueError(f"Unknown table: {table}")
+        return self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def export_parquet(self, output_dir: str = parquet_output_dir, rows_per_group: int = 100_000) -> List[str]:
+        """
+        Exports every table to <output_dir>/<table>.parquet (needs the optional pyarrow package).
+        Tables are streamed in row groups, never loaded whole. Returns the written file paths.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("The Parquet export needs pyarrow: pip install pyarrow")
+
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for table in tables:
+            cursor = self._conn.execute(f"SELECT * FROM {table}")
+            columns = [description[0] for description in cursor.description]
+            path = os.path.join(output_dir, f"{table}.parquet")
+            writer = None
+            try:
+                while True:
+                    rows = cursor.fetchmany(rows_per_group)
+                    if not rows and writer is not None:
+                        break
+                    batch = pa.Table.from_pydict({column: [row[index] for row in rows] for index, column in enumerate(columns)})
+                    if writer is None:
+                        writer = pq.ParquetWriter(path, batch.schema)
+                    writer.write_table(batch)
+                    if not rows:
+                        break
+            finally:
+                if writer is not None:
+                    writer.close()
+            paths.append(path)
+        return paths
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_into_store(extractions_path: str, transformed_path: Optional[str] = None,
+                    database_path: str = database_path) -> dict:
+    """Bulk loads an extraction output file (JSON/JSONL) and optionally the transformed conversations' metadata."""
+    start = time.perf_counter()
+    with ConversationStore(database_path) as store:
+        extractions = store.write_extractions(iter_json_records(extractions_path))
+        metadata = store.write_metadata(iter_json_records(transformed_path)) if transformed_path else 0
+    elapsed = time.perf_counter() - start
+    print(f"Stored {extractions} extractions and {metadata} metadata records in {database_path} in {round(elapsed, 2)}s")
+    return {"extractions": extractions, "metadata": metadata, "seconds": round(elapsed, 3)}
+
+
+if __name__ == "__main__":
+    load_into_store(extractions_path, transformed_path)
@@ -1,12 +1,90 @@
 import json
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from multiprocessing import Pool
+from typing import Iterable, Iterator, Optional
 from ordered_set import OrderedSet
-from main import load_json_data
+from json_io import load_json_data, iter_json_records
+import telemetry
 
 # --- Configuration (path)---
 json_file_path = "src/data/raw_oscar_data.json"
+# Streaming mode reads the raw export (JSON array or .jsonl) incrementally and writes JSONL for main.py
+stream_jsonl = True
+output_jsonl_path = "src/data/transformed_oscar_data.jsonl"
+# Number of worker processes for the streaming mode (1 = sequential) and conversations sent per worker task
+num_workers = 1
+worker_chunk_size = 256
+# Chunks submitted to the pool but not yet written, per worker (bounds memory when the writer is slower)
+chunks_in_flight_per_worker = 2
 
 
 # --- Functions ---
+specific_wait_message = "We are currently busier than usual at the moment and are experiencing extended wait times."
+
+
+def build_transcript(messages: list) -> tuple[str, int]:
+    """
+    Combines the messages of one conversation into a single transcript, skipping duplicate system messages.
+
+    Returns:
+        tuple: (transcript formatted as "user_type: message" lines, number of skipped duplicate wait messages)
+    """
+    lines = []
+    seen_system_messages = OrderedSet()
+    wait_message_duplicates_count = 0
+
+    for msg in messages:
+        user_type = msg.get("user_type", "unknown").lower()
+        text = msg.get("text_raw", "")
+
+        # Counting duplicate system messages in regards to 'specific_wait_message', metadata
+        if 'system' in user_type:
+            if text in seen_system_messages:
+                if text == specific_wait_message:
+                    wait_message_duplicates_count += 1
+                continue  # Skip duplicate system message
+            seen_system_messages.add(text)
+
+        if text:
+            lines.append(f"{user_type}: {text}\n")
+
+    # One join instead of repeated += keeps long chats linear
+    return "".join(lines).strip(), wait_message_duplicates_count
+
+
+def process_conversation(conv: dict) -> Optional[dict]:
+    """Turns one raw conversation into {conversation_id, transcript, metadata}, or None if it has no text."""
+    transcript, wait_message_duplicates_count = build_transcript(conv.get("messages", []))
+    if not transcript:
+        return None
+
+    # Store the full transcript and top-level metadata
+    return {
+        "conversation_id": conv.get("conversation_id"),
+        "transcript": transcript,
+        "metadata": {
+            "conversation_id": conv.get("conversation_id"),
+            "country": conv.get("country"),
+            "channel": conv.get("channel"),
+            "start_time": conv.get("start_time"),
+            "end_time": conv.get("end_time"),
+            "published": conv.get("published"),
+            "translator": conv.get("translator"),
+            "wait_message_duplicates": wait_message_duplicates_count
+        }
+    }
+
+
+def iter_parsed_conversations(raw_conversations: Iterable[dict]) -> Iterator[dict]:
+    """Generator version of parse_json_data, processes one conversation at a time."""
+    for conv in raw_conversations:
+        processed = process_conversation(conv)
+        if processed is not None:
+            yield processed
+
+
 def parse_json_data(raw_json_data: str) -> json:
     """
     Processes raw conversation data by combining all the different messages of the same conversation_id (every msg also has its own metadata) 
@@ -28,55 +106,157 @@ def parse_json_data(raw_json_data: str) -> json:
               - transcript: Combined text of all messages formatted as "user_type: message"
               - metadata: Dictionary with conversation details and duplicate message counts
     """
-    processed_conversations = []
-    for conv in raw_json_data:
-        # Combine messages into a single transcript and remove system msg duplicates, sorry - this should be its own func for better readability
-        transcript = ""
-        seen_system_messages = OrderedSet()
-        wait_message_duplicates_count = 0
-        specific_wait_message = "We are currently busier than usual at the moment and are experiencing extended wait times."
-
-        for msg in conv.get("messages", []):
-            user_type = msg.get("user_type", "unknown").lower()
-            text = msg.get("text_raw", "")
-
-            # Counting duplicate system messages in regards to 'specific_wait_message', metadata
-            if 'system' in user_type:
-                if text in seen_system_messages:
-                    if text == specific_wait_message:
-                        wait_message_duplicates_count += 1
-                    continue  # Skip duplicate system message
-                seen_system_messages.add(text)
-
-            if text:
-                transcript += f"{user_type}: {text}\n"
-
-        # Store the full transcript and top-level metadata
-        if transcript:
-            processed_conversations.append({
-                "conversation_id": conv.get("conversation_id"),
-                "transcript": transcript.strip(),
-                "metadata": {
-                    "conversation_id": conv.get("conversation_id"),
-                    "country": conv.get("country"),
-                    "channel": conv.get("channel"),
-                    "start_time": conv.get("start_time"),
-                    "end_time": conv.get("end_time"),
-                    "published": conv.get("published"),
-                    "translator": conv.get("translator"),
-                    "wait_message_duplicates": wait_message_duplicates_count
-                }
-            })
-
+    processed_conversations = list(iter_parsed_conversations(raw_json_data))
     print(f"Successfully processed {len(processed_conversations)} conversations.")
     return processed_conversations
+
+
+class StageTimer:
+    """Accumulates wall time per pipeline stage."""
+
+    def __init__(self):
+        self.totals = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] = self.totals.get(name, 0.0) + time.perf_counter() - start
+
+    def timed_iter(self, name: str, iterable: Iterable) -> Iterator:
+        """Yields from `iterable`, counting the time spent producing items as stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def report(self) -> dict:
+        return {name: round(seconds, 4) for name, seconds in self.totals.items()}
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """Groups an iterable into lists of `size` items (the last one may be shorter)."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def serialize_processed(processed: dict) -> str:
+    return json.dumps(processed, ensure_ascii=False) + "\n"
+
+
+def process_chunk(raw_conversations: list) -> list[str]:
+    """
+    Worker task: processes a chunk of raw conversations and returns the serialized JSONL lines.
+    Items can be conversation dicts or raw JSONL lines (decoded here, which keeps IPC to plain strings).
+    """
+    conversations = (json.loads(conv) if isinstance(conv, str) else conv for conv in raw_conversations)
+    return [serialize_processed(processed) for processed in iter_parsed_conversations(conversations)]
+
+
+def iter_raw_records(file_path: str) -> Iterator:
+    """Raw JSONL lines for .jsonl input (decoded by the workers), conversation dicts otherwise."""
+    if not file_path.endswith(".jsonl"):
+        yield from iter_json_records(file_path)
+        return
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def _process_sequential(raw_chunks: Iterable[list], timer: StageTimer) -> Iterator[list[str]]:
+    for chunk in raw_chunks:
+        with timer.stage("process"):
+            lines = process_chunk(chunk)
+        yield lines
+
+
+def _process_parallel(pool: Pool, raw_chunks: Iterable[list], timer: StageTimer, max_in_flight: int) -> Iterator[list[str]]:
+    """
+    Submits the chunks to the pool with at most `max_in_flight` of them not yet consumed, and yields
+    the results in input order. The input is only read when a slot frees up (unlike Pool.imap, whose
+    feeder thread reads the whole input ahead).
+    """
+    pending = deque()
+    for chunk in raw_chunks:
+        pending.append(pool.apply_async(process_chunk, (chunk,)))
+        if len(pending) >= max_in_flight:
+            with timer.stage("process"):
+                lines = pending.popleft().get()
+            yield lines
+    while pending:
+        with timer.stage("process"):
+            lines = pending.popleft().get()
+        yield lines
+
+
+def stream_to_jsonl(file_path: str, output_path: str, workers: int = 1, chunk_size: int = 256) -> int:
+    """
+    Streaming ingest: reads raw conversations one at a time (JSON array or JSONL), processes them and
+    writes each result as one JSONL line. Peak memory is bounded by the largest single conversation
+    (times `chunk_size` and the `workers * chunks_in_flight_per_worker` in-flight chunks when `workers` > 1).
+
+    With `workers` > 1 the conversations are sent in chunks of `chunk_size` to a process pool.
+    Chunks come back in input order, so the output is byte-identical to the sequential run.
+    Prints the time spent per stage (read, process, write) at the end.
+
+    Returns:
+        int: number of processed conversations written
+    """
+    timer = StageTimer()
+    count = 0
+    start = time.perf_counter()
+    raw_chunks = chunked(timer.timed_iter("read", iter_raw_records(file_path)), chunk_size)
+
+    with open(output_path, 'w', encoding='utf-8') as f, ExitStack() as stack:
+        if workers > 1:
+            pool = stack.enter_context(Pool(workers))
+            # "process" is the time the writer waits for workers, reading stays in this thread
+            processed_chunks = _process_parallel(pool, raw_chunks, timer, workers * chunks_in_flight_per_worker)
+        else:
+            processed_chunks = _process_sequential(raw_chunks, timer)
+
+        for lines in processed_chunks:
+            with timer.stage("write"):
+                if count == 0 and lines:
+                    # let's inspect the first processed conversation, making sure its OK
+                    print("\n--- Test: first processed conversation ---")
+                    print(json.dumps(json.loads(lines[0]), indent=2))
+                f.writelines(lines)
+                count += len(lines)
+
+    elapsed = time.perf_counter() - start
+    for name, seconds in timer.totals.items():
+        telemetry.record_stage(f"preprocess.{name}", seconds, count)
+    telemetry.record_stage("preprocess", elapsed, count)
+    print(f"Successfully processed {count} conversations.")
+    print(f"Stage timings (s) with {workers} worker(s): {timer.report()}, total: {round(elapsed, 4)}, "
+          f"{round(count / elapsed, 1) if elapsed else 0} conversations/s")
+    return count
     
 
 def main(file_path: str):
     """Main function to run the data processing, indexing and dump the json."""
+
+    if stream_jsonl:
+        if stream_to_jsonl(file_path, output_jsonl_path, workers=num_workers, chunk_size=worker_chunk_size) == 0:
+            print("No conversations to process. Exiting.")
+        return
     
     # --- Processing ---
-    raw_json_data = load_json_data(json_file_path)
+    raw_json_data = load_json_data(file_path)
     conversations = parse_json_data(raw_json_data)
     
     if not conversations:
@@ -95,4 +275,5 @@ def main(file_path: str):
         
 
 if __name__ == "__main__":
-    main(json_file_path) 
\ No newline at end of file
+    main(json_file_path)
+    telemetry.report()
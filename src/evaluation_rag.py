@@ -1,13 +1,25 @@
-from typing import List
-from llm_models import get_gemini_response
-from main import load_json_data, save_json_file
+import os
+from typing import Iterator, List, Optional
+from json_io import load_json_data, append_jsonl
+from field_scorers import score_dataset, max_possible_score
+from rate_limiter import RateLimiter, estimate_tokens
+from json_repair import parse_llm_json, strip_fences
+import telemetry
 import json
-import time
 
 # --- Configuration (path)---
 facit_data_json = "src/data/evaluation/facit.json"
 new_data_json = "src/data/llm_output_data/test_data_gemini_1.5_flash.json"
-output_path = "src/data/evaluation/test_data_gemini_1.5_flashv2.json"
+output_path = "src/data/evaluation/test_data_gemini_1.5_flashv2.jsonl"
+# Score deterministic fields locally and only send pairs with ambiguous fields to the LLM judge
+use_local_scoring = True
+# Pairs per judge request and judge quota (replaces the fixed 2 second sleep)
+judge_batch_size = 10
+judge_requests_per_minute = 30
+judge_tokens_per_minute = None
+judge_model = "gemini-2.5-flash"
+# Ask the judge for JSON only (Gemini JSON mode)
+use_json_mode = True
 
 
 # --- Functions ---
@@ -55,82 +67,249 @@ def evaluate(test_conv: dict, facit_conv: dict) -> str:
     return query
 
 
-def eval_main(facit_data_json: str, new_data_json: str) -> None:
+def evaluate_batch(pairs: List[tuple[int, dict, dict]]) -> str:
+    """Judge prompt for several (conversation_index, test_conv, facit_conv) pairs, answered as a JSON array."""
+    pairs_text = "\n".join(
+        f"""
+        === Pair {index} ===
+        Correct Answer (Answer sheet/Grounded truth):
+        {facit_conv}
+        ---
+        LLM response (output):
+        {test_conv}
+        ---"""
+        for index, test_conv, facit_conv in pairs)
+
+    query = f"""
+        You are an expert data analyst. Your task is to carefully read and compare the answers from the new data set (response from LLM)
+        with the answers in the Answer sheet, for each of the {len(pairs)} pairs below separately. The correct answers are found in the 'Answer sheet'.
+        **IMPORTANT** The llm response doesnt have to match 100 %, word for word with the Answer sheet, the semantic meaning is the most important.
+        (e.g 'Order cancellation request, inquiry about order status/shipping, and discussion of refund process for delayed order.' and
+        'Order cancellation inquiry, Order status inquiry, Refund process explanation' are very similar therefore both answers are correct.
+
+        **Partial Matching for Slashed Answers:** If a field in the 'Answer sheet' contains multiple answers separated by a slash ('/'), 
+        the LLM's response is considered CORRECT if it matches at least ONE of those answers.
+        {pairs_text}
+
+        For each pair, keep score and give one point for each correct answer. Write 'CORRECT' or 'WRONG' after each key-value pair as in the template below.
+        Sum up the points and type it in the field "total_score", MUST BE an INT (INTEGER).
+        Put the pair number in the field "conversation_index".
+        Return ONLY a valid JSON array with one object per pair, each in the following format (no extra text or comments):
+
+        Template:
+        {{
+            "conversation_index": 0,
+            "conversation_id": "0",
+            "conversation_id_status": "CORRECT",
+            "products": ["Chair", "Lamp"],
+            "products_status": "WRONG", 
+            "store_location": "Silicon Valley",
+            "store_location_status": "WRONG",
+            "product_category": "Home goods",
+            "product_category_status": "CORRECT",
+            "service_rendered": "Refunding",
+            "service_rendered_status": "CORRECT",
+            "customer_satisfaction": "Positive",
+            "customer_satisfaction_status": "CORRECT",
+            "case_or_order_number": "24156722",
+            "case_or_order_number_status": "WRONG",
+            "total_score": 4
+        }}
+    """
+    return query
+
+
+def judge_response(llm_eval: str) -> str:
+    # Imported on first judge request, scoring locally never loads the model SDK
+    from llm_models import generate, json_output_settings
+    return generate(llm_eval, judge_model, settings=json_output_settings() if use_json_mode else None)
+
+
+def judge_single(index: int, test_conv: dict, facit_conv: dict, rate_limiter: RateLimiter) -> dict:
+    """Judges one pair with the LLM, returns its score record (or an error record for a failed request or unparseable answer)."""
+    llm_eval = evaluate(test_conv, facit_conv)
+    rate_limiter.acquire_sync(estimate_tokens(llm_eval))
+    try:
+        llm_output = judge_response(llm_eval)
+    except Exception as e:
+        # A failed request (quota, network) is recorded like an unparseable answer, the other pairs go on
+        print(f"Judge request failed for conversation {index}: {e}")
+        telemetry.record_failure("evaluate", "LLM_ERROR", index)
+        return {
+            "error": "LLM_ERROR",
+            "conversation_index": index,
+            "error_message": str(e)
+        }
+    print(f"Evaluated conversation {index}: {llm_output}")
+
+    try:
+        # Parse the json output of the llm (repairing small syntax errors)
+        json_response = parse_llm_json(llm_output)
+        print(f"Successfully parsed JSON for conversation {index}")
+        return json_response
+
+    except json.JSONDecodeError as e:
+        cleaned_json_response = strip_fences(llm_output)
+        print(f"Failed to parse JSON for conversation {index}: {e}")
+        print(f"Raw response: {cleaned_json_response}")
+        telemetry.record_failure("evaluate", "JSON_PARSE_ERROR", index)
+        # Save the failed case as a string for debugging
+        return {
+            "error": "JSON_PARSE_ERROR",
+            "conversation_index": index,
+            "raw_response": cleaned_json_response,
+            "error_message": str(e)
+        }
+
+
+def judge_pairs(pairs: List[tuple[int, dict, dict]], rate_limiter: RateLimiter) -> List[dict]:
+    """
+    Judges several pairs in one LLM request. Pairs missing from (or unusable in) the answer,
+    or all of them when the request fails, are judged again one by one.
+    """
+    if len(pairs) == 1:
+        return [judge_single(*pairs[0], rate_limiter)]
+
+    llm_eval = evaluate_batch(pairs)
+    rate_limiter.acquire_sync(estimate_tokens(llm_eval))
+
+    scores_by_index = {}
+    try:
+        llm_output = judge_response(llm_eval)
+    except Exception as e:
+        print(f"Batched judge request failed for {len(pairs)} conversations: {e}")
+        telemetry.record_failure("evaluate", "BATCH_LLM_ERROR")
+        llm_output = None
+    try:
+        json_response = parse_llm_json(llm_output) if llm_output is not None else []
+        for element in json_response if isinstance(json_response, list) else []:
+            if isinstance(element, dict) and isinstance(element.get("total_score"), int):
+                scores_by_index.setdefault(str(element.get("conversation_index")), element)
+    except json.JSONDecodeError as e:
+        print(f"Failed to parse batched judge response for {len(pairs)} conversations: {e}")
+        telemetry.record_failure("evaluate", "BATCH_JSON_PARSE_ERROR")
+
+    results = []
+    for index, test_conv, facit_conv in pairs:
+        score = scores_by_index.get(str(index))
+        if score is None:
+            print(f"Conversation {index} missing from batched judge response, judging it on its own.")
+            telemetry.record_retry("evaluate")
+            score = judge_single(index, test_conv, facit_conv, rate_limiter)
+        else:
+            print(f"Evaluated conversation {index} (batched): {score.get('total_score')}")
+        results.append(score)
+    return results
+
+
+def align_by_conversation_id(facit_data: List[dict], new_data: List[dict]) -> List[dict]:
+    """
+    Reorders the LLM output to follow the answer sheet by conversation_id (streamed/concurrent extraction
+    writes results in completion order). Conversations without an output get an empty record.
+    Falls back to the original order when no conversation_id matches.
+    """
+    outputs_by_id = {str(output.get("conversation_id")): output for output in new_data if isinstance(output, dict)}
+    if not any(str(facit_conv.get("conversation_id")) in outputs_by_id for facit_conv in facit_data):
+        return new_data
+    return [outputs_by_id.get(str(facit_conv.get("conversation_id")), {}) for facit_conv in facit_data]
+
+
+def iter_evaluation_results(facit_data: List[dict], new_data: List[dict], use_local_scoring: bool = use_local_scoring,
+                            batch_size: int = judge_batch_size, use_judge: bool = True,
+                            rate_limiter: Optional[RateLimiter] = None) -> Iterator[tuple[int, dict, bool]]:
+    """
+    Scores aligned (facit, output) pairs and yields (pair index, evaluation result, judged by the LLM) as soon as
+    each result is ready: locally scored pairs right away, the others after their judge batch (see eval_main).
+    """
+    local_scores = []
+    if use_local_scoring or not use_judge:
+        with telemetry.stage("evaluate.local_scoring") as stage:
+            local_scores = score_dataset(facit_data, new_data)
+            stage["items"] = len(local_scores)
+    rate_limiter = rate_limiter or RateLimiter(judge_requests_per_minute, judge_tokens_per_minute)
+    to_judge = []
+
+    for i, (facit_conv, test_conv) in enumerate(zip(facit_data, new_data)):
+        if local_scores and (not use_judge or not local_scores[i]["ambiguous_fields"]):
+            print(f"Scored conversation {i} locally: {local_scores[i]['total_score']}")
+            yield i, local_scores[i], False
+            continue
+
+        to_judge.append((i, test_conv, facit_conv))
+        if len(to_judge) >= batch_size:
+            for (index, _, _), result in zip(to_judge, judge_pairs(to_judge, rate_limiter)):
+                yield index, result, True
+            to_judge = []
+
+    if to_judge:
+        for (index, _, _), result in zip(to_judge, judge_pairs(to_judge, rate_limiter)):
+            yield index, result, True
+
+
+def eval_main(facit_data_json: str, new_data_json: str, use_local_scoring: bool = use_local_scoring,
+              batch_size: int = judge_batch_size, output_path: str = output_path, use_judge: bool = True) -> None:
     """
     Main evaluation function that compares LLM responses against facit/answer sheet.
     
     Loads reference (facit) and test data, evaluates each conversation pair using
-    an LLM evaluator, and saves results incrementally. Handles JSON parsing errors
-    gracefully by saving error information for debugging.
+    an LLM evaluator, and appends every result to a JSONL file as soon as it is available.
+    Handles JSON parsing errors gracefully by saving error information for debugging.
+    With `use_local_scoring`, all pairs are first scored by the deterministic field scorers
+    and only the pairs with an ambiguous field are sent to the LLM judge, `batch_size` pairs per request.
+    Judge requests are paced by a requests/tokens-per-minute rate limiter.
     
     Args:
         facit_data_json (str): Path to JSON file containing reference/ground truth data.
         new_data_json (str): Path to JSON file containing LLM-generated data.
+        use_local_scoring (bool): Score unambiguous pairs locally instead of with the LLM judge.
+        batch_size (int): Number of pairs judged per LLM request.
+        output_path (str): JSONL file the evaluation results are appended to.
+        use_judge (bool): Send ambiguous pairs to the LLM judge. Without it every pair is scored locally
+                          and ambiguous fields count as not correct (no model call at all).
     """
     facit_data = load_json_data(facit_data_json)
-    new_data = load_json_data(new_data_json)
+    new_data = align_by_conversation_id(facit_data, load_json_data(new_data_json))
+    judged_count, saved_count = 0, 0
 
-    all_extracted_conv_score = []
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f, telemetry.stage("evaluate") as stage:
+        # Comparing facit with the new data (new data is the output of the llm)
+        for _, result, judged in iter_evaluation_results(facit_data, new_data, use_local_scoring, batch_size, use_judge):
+            append_jsonl(result, f)
+            saved_count += 1
+            judged_count += judged
+        stage["items"] = saved_count
 
-    # Comparing facit with the new data (new data is the output of the llm)
-    for i, (facit_conv, test_conv) in enumerate(zip(facit_data, new_data)):
-        llm_eval = evaluate(test_conv, facit_conv)
-        print('Adding slight delay to manage the llm_quota (RPM)')
-        time.sleep(2)
-
-        llm_output = get_gemini_response(llm_eval)
-        print(f"Evaluated conversation {i}: {llm_output}")
-
-        try:
-            # Cleaning the json output of the llm and parse it
-            cleaned_json_response = llm_output.strip().replace("```json", "").replace("```", "").strip()
-            json_response = json.loads(cleaned_json_response)
-
-            all_extracted_conv_score.append(json_response)
-            print(f"Successfully parsed JSON for conversation {i}")
-
-        except json.JSONDecodeError as e:
-            print(f"Failed to parse JSON for conversation {i}: {e}")
-            print(f"Raw response: {cleaned_json_response}")
-            # Save the failed case as a string for debugging
-            all_extracted_conv_score.append({
-                "error": "JSON_PARSE_ERROR",
-                "conversation_index": i,
-                "raw_response": cleaned_json_response,
-                "error_message": str(e)
-            })
-
-        # Save results for each iteration in case of unexpected error, so I can have a quick peek at what the data looks like
-        if all_extracted_conv_score:
-            save_json_file(all_extracted_conv_score, output_path)
-            print(f"Saved evaluation results")
-        else:
-            print("No evaluation results to save.")
+    print(f"Saved {saved_count} evaluation results to {output_path}, LLM judge was used for {judged_count} of them.")
 
 
 def sum_conversation_scores(output_path: str) -> None:
     """
     Calculates and prints the total score and accuracy from evaluation results.
-    Loads evaluation data from a JSON file, sums up all conversation scores,
-    and calculates the accuracy as a percentage of the maximum possible score (84).
+    Loads evaluation data from a JSON/JSONL file, sums up all conversation scores,
+    and calculates the accuracy as a percentage of the maximum possible score
+    (one point per scored field of every evaluated conversation).
     
     Args:
-        output_path (str): Path to the JSON file containing evaluation results.
+        output_path (str): Path to the JSON/JSONL file containing evaluation results.
                           Each conversation should have a 'total_score' field.
     """
     final_score = 0
     evaluation_data = load_json_data(output_path)
 
     for conversation in evaluation_data:
-        conv_score = conversation.get('total_score')
+        # Unparseable judge answers have no score and count as 0
+        conv_score = conversation.get('total_score') or 0
         final_score += conv_score
     
-    max_possible_score = 84
-    accuracy = final_score / max_possible_score
-    print(f'Final score: {final_score}/84\nAccuracy: {round(accuracy, 4)}')
+    max_score = max_possible_score(evaluation_data)
+    accuracy = final_score / max_score if max_score else 0.0
+    print(f'Final score: {final_score}/{max_score}\nAccuracy: {round(accuracy, 4)}')
         
 
 if __name__ == "__main__":
     eval_main(facit_data_json, new_data_json)
     sum_conversation_scores(output_path)
+    telemetry.report()
 
@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import re
+import time
+import zlib
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional
+import numpy as np
+from json_io import iter_json_records
+from transcript_compaction import remove_boilerplate, compact_transcript
+
+# --- Configuration (path)---
+index_dir = "src/data/index"
+facit_path = "src/data/evaluation/facit.json"
+transformed_path = "src/data/transformed_oscar_data.jsonl"
+synthetic_path = "src/data/llm_output_data/synthetic_data.jsonl"
+
+# --- Configuration (index)---
+# Hashed feature space (power of two), 4 bytes per dimension per vector on disk
+vector_dimensions = 256
+# Below this many vectors every query is an exact scan, above it vectors are partitioned by k-means centroids (IVF)
+ivf_min_vectors = 20_000
+# Centroids probed per query, and growth since the last training that triggers a retraining
+ivf_probes = 8
+ivf_retrain_growth = 2.0
+kmeans_iterations = 8
+kmeans_sample_per_list = 32
+seed = 42
+
+token_regex = re.compile(r"[a-zåäöéü0-9]+")
+
+
+# --- Functions ---
+@lru_cache(maxsize=1 << 20)
+def feature_hash(feature: str) -> int:
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+def features(transcript: str) -> List[str]:
+    """Word unigrams and bigrams of the transcript without the template lines every chat shares."""
+    text = "\n".join(remove_boilerplate(transcript.splitlines()))
+    words = token_regex.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def embed(transcript: str, dimensions: int = vector_dimensions) -> np.ndarray:
+    """
+    Signed hashing vectorizer (no vocabulary, so adding examples never changes earlier vectors):
+    sublinear term counts, L2-normalized float32.
+    """
+    hashes = np.fromiter((feature_hash(feature) for feature in features(transcript)), dtype=np.uint32)
+    vector = np.zeros(dimensions, dtype=np.float32)
+    if len(hashes):
+        signs = np.where(hashes & 0x80000000, 1.0, -1.0)
+        counts = np.bincount(hashes % dimensions, weights=signs, minlength=dimensions)
+        vector = (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def example_key(transcript: str) -> str:
+    return hashlib.sha1(transcript.encode("utf-8")).hexdigest()
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k highest scores, best first."""
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def spherical_kmeans(vectors: np.ndarray, clusters: int, iterations: int = kmeans_iterations,
+                     rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Cosine k-means on (a sample of) unit vectors, returns unit centroids."""
+    rng = rng or np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Empty clusters are restarted on random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms[empty] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """Nearest centroid of every vector, computed in chunks to bound memory."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        assignments[start:start + chunk_size] = np.argmax(np.asarray(vectors[start:start + chunk_size]) @ centroids.T, axis=1)
+    return assignments
+
+
+class ExampleIndex:
+    """
+    On-disk index of labelled examples ({transcript, structured_output}) for few-shot retrieval.
+
+    Vectors live in a float32 file that is memory-mapped, never loaded whole. Examples are appended
+    (already indexed transcripts are skipped), so building is incremental. Search is an exact, vectorized
+    cosine scan for small indexes; above `ivf_min_vectors` only the vectors of the `ivf_probes` nearest
+    k-means partitions are scored, which keeps queries in the low milliseconds at a million vectors.
+    """
+
+    def __init__(self, path: str = index_dir, dimensions: int = vector_dimensions):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.meta_path = os.path.join(path, "meta.json")
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.examples_path = os.path.join(path, "examples.jsonl")
+        self.offsets_path = os.path.join(path, "offsets.i64")
+        self.assignments_path = os.path.join(path, "assignments.i32")
+        self.centroids_path = os.path.join(path, "centroids.npy")
+        self.meta = {"dimensions": dimensions, "count": 0, "trained_count": 0, "examples_bytes": 0}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+        self.dimensions = self.meta["dimensions"]
+        self._keys = None
+        self._load()
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    def _load(self) -> None:
+        """Maps the files (only the first meta['count'] rows, a crashed append is ignored)."""
+        count = self.meta["count"]
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dimensions)) if count else \
+            np.zeros((0, self.dimensions), dtype=np.float32)
+        self.offsets = np.fromfile(self.offsets_path, dtype=np.int64, count=count) if count else np.zeros(0, dtype=np.int64)
+        self.centroids, self.partition_rows, self.partition_starts = None, None, None
+        if self.meta["trained_count"] and os.path.exists(self.centroids_path):
+            self.centroids = np.load(self.centroids_path)
+            assignments = np.fromfile(self.assignments_path, dtype=np.int32, count=count)
+            # Row ids grouped by partition: rows of partition p are partition_rows[starts[p]:starts[p + 1]]
+            self.partition_rows = np.argsort(assignments, kind="stable").astype(np.int64)
+            self.partition_starts = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids)))))
+
+    def _save_meta(self) -> None:
+        temporary_path = self.meta_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(temporary_path, self.meta_path)
+
+    def keys(self) -> set:
+        if self._keys is None:
+            self._keys = set()
+            for example in self.iter_examples():
+                self._keys.add(example["key"])
+        return self._keys
+
+    def iter_examples(self) -> Iterator[dict]:
+        if not self.meta["count"]:
+            return
+        with open(self.examples_path, "r", encoding="utf-8") as f:
+            for _ in range(self.meta["count"]):
+                yield json.loads(f.readline())
+
+    def add(self, examples: Iterable[dict], batch_size: int = 10_000) -> int:
+        """
+        Embeds and appends examples (dicts with 'transcript' and 'structured_output', optionally 'source'
+        and 'conversation_id'). Transcripts already in the index are skipped. Returns the number added.
+        """
+        keys, added = self.keys(), 0
+        batch = []
+        for example in examples:
+            transcript = example.get("transcript")
+            if not transcript or example.get("structured_output") is None:
+                continue
+            key = example_key(transcript)
+            if key in keys:
+                continue
+            keys.add(key)
+            batch.append({"key": key, **example})
+            if len(batch) >= batch_size:
+                added += self._append(batch)
+                batch = []
+        if batch:
+            added += self._append(batch)
+
+        count, trained = self.meta["count"], self.meta["trained_count"]
+        if count >= ivf_min_vectors and (not trained or count >= trained * ivf_retrain_growth):
+            self.train()
+        else:
+            self._load()
+        return added
+
+    def _truncate_to_count(self) -> None:
+        """Drops whatever a crashed append left past meta['count'], so new rows line up again."""
+        count = self.meta["count"]
+        sizes = [(self.examples_path, self.meta["examples_bytes"]), (self.vectors_path, count * self.dimensions * 4),
+                 (self.offsets_path, count * 8)]
+        if self.centroids is not None:
+            sizes.append((self.assignments_path, count * 4))
+        for path, size in sizes:
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _append(self, batch: List[dict]) -> int:
+        self._truncate_to_count()
+        vectors = np.stack([embed(example["transcript"], self.dimensions) for example in batch])
+        offsets = []
+        with open(self.examples_path, "ab") as f:
+            for example in batch:
+                offsets.append(f.tell())
+                f.write((json.dumps(example, ensure_ascii=False) + "\n").encode("utf-8"))
+            examples_bytes = f.tell()
+        with open(self.vectors_path, "ab") as f:
+            vectors.tofile(f)
+        with open(self.offsets_path, "ab") as f:
+            np.asarray(offsets, dtype=np.int64).tofile(f)
+        if self.centroids is not None:
+            with open(self.assignments_path, "ab") as f:
+                assign(vectors, self.centroids).tofile(f)
+        # The count is written last, rows past it (a crash in the middle of an append) are never read
+        self.meta["count"] += len(batch)
+        self.meta["examples_bytes"] = examples_bytes
+        self._save_meta()
+        return len(batch)
+
+    def train(self) -> None:
+        """(Re)computes the k-means partitions over all vectors."""
+        start = time.perf_counter()
+        self._load()
+        count = self.meta["count"]
+        clusters = max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(count, min(count, clusters * kmeans_sample_per_list), replace=False))
+        centroids = spherical_kmeans(np.asarray(self.vectors[sample]), clusters, rng=rng)
+        np.save(self.centroids_path, centroids)
+        assign(self.vectors, centroids).tofile(self.assignments_path)
+        self.meta["trained_count"] = count
+        self._save_meta()
+        self._load()
+        print(f"Trained {clusters} partitions over {count} vectors in {round(time.perf_counter() - start, 2)}s")
+
+    def _candidate_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows of the probed partitions, None for an exact scan."""
+        if self.centroids is None:
+            return None
+        probes = top_k(self.centroids @ query, ivf_probes)
+        rows = np.concatenate([self.partition_rows[self.partition_starts[p]:self.partition_starts[p + 1]] for p in probes])
+        rows.sort()
+        return rows
+
+    def search(self, transcript: str, k: int = 3, exclude_keys: Iterable[str] = ()) -> List[tuple[float, dict]]:
+        """The k most similar examples as (cosine similarity, example), best first."""
+        if not self.meta["count"]:
+            return []
+        query = embed(transcript, self.dimensions)
+        exclude = set(exclude_keys)
+        rows = self._candidate_rows(query)
+        candidates = self.vectors if rows is None else self.vectors[rows]
+        scores = np.asarray(candidates) @ query
+        best = top_k(scores, k + len(exclude))
+
+        results = []
+        with open(self.examples_path, "rb") as f:
+            for index in best:
+                row = int(index if rows is None else rows[index])
+                f.seek(int(self.offsets[row]))
+                example = json.loads(f.readline())
+                if example["key"] in exclude:
+                    continue
+                results.append((float(scores[index]), example))
+                if len(results) == k:
+                    break
+        return results
+
+
+def format_examples(examples: List[dict], token_budget: Optional[int] = None) -> str:
+    """Prompt section with the examples' (compacted) transcripts and their correct JSON."""
+    if not examples:
+        return ""
+    parts = ["Here are examples of similar conversations and their correct extraction:"]
+    for number, example in enumerate(examples, 1):
+        transcript, _ = compact_transcript(example["transcript"], token_budget)
+        parts.append(f"--- EXAMPLE {number} TRANSCRIPT ---\n{transcript}\n"
+                     f"--- EXAMPLE {number} JSON ---\n{json.dumps(example['structured_output'], ensure_ascii=False)}")
+    return "\n".join(parts)
+
+
+def iter_facit_examples(facit_path: str = facit_path, transformed_path: str = transformed_path) -> Iterator[dict]:
+    """Answer sheet records joined by conversation_id with their transcripts from the transformed data."""
+    if not os.path.exists(facit_path) or not os.path.exists(transformed_path):
+        return
+    labels = {str(record.get("conversation_id")): record for record in iter_json_records(facit_path)}
+    for conversation in iter_json_records(transformed_path):
+        conversation_id = str(conversation.get("conversation_id"))
+        if conversation_id in labels:
+            yield {"source": "facit", "conversation_id": conversation_id,
+                   "transcript": conversation.get("transcript"), "structured_output": labels[conversation_id]}
+
+
+def iter_synthetic_examples(synthetic_path: str = synthetic_path) -> Iterator[dict]:
+    """Examples of generate_synthetic_data.py (JSONL of {transcript, structured_output})."""
+    if not os.path.exists(synthetic_path):
+        return
+    with open(synthetic_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                example = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(example, dict):
+                yield {"source": "synthetic", "conversation_id": (example.get("structured_output") or {}).get("conversation_id"),
+                       "transcript": example.get("transcript"), "structured_output": example.get("structured_output")}
+
+
+def build_index(path: str = index_dir) -> ExampleIndex:
+    """Adds the answer sheet and synthetic examples not indexed yet."""
+    start = time.perf_counter()
+    index = ExampleIndex(path)
+    added = index.add(iter_facit_examples())
+    added += index.add(iter_synthetic_examples())
+    print(f"Added {added} examples to {path} ({len(index)} in total) in {round(time.perf_counter() - start, 2)}s")
+    return index
+
+
+if __name__ == "__main__":
+    build_index()
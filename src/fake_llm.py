@@ -0,0 +1,133 @@
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Dict, Optional
+
+
+# Picks the conversation_id out of the metadata dict that main.prompt inlines
+conversation_id_pattern = re.compile(r"""['"]conversation_id['"]:\s*['"]([^'"]*)['"]""")
+# Pair headers of evaluation_rag.evaluate_batch
+judge_pair_pattern = re.compile(r"=== Pair (\d+) ===")
+# Ways a malformed answer is broken: cut in half, trailing comma, text around the JSON, unquoted keys, single quotes
+malformed_kinds = ("truncate", "trailing_comma", "prose", "unquoted_keys", "single_quotes")
+# Product added to a perturbed answer, and satisfaction levels a perturbed answer switches between
+extra_product = "SKUBB storage case"
+satisfaction_levels = ["Positive", "Neutral", "Negative"]
+
+
+class FakeLLM:
+    """
+    Offline stand-in for the Gemini models, used to test throughput without spending quota.
+
+    Sleeps per call and returns a ConversationInfo-shaped JSON answer for the conversation_id found
+    in the prompt (or a judge answer for evaluation prompts). With `answers` (answer sheet records by
+    conversation_id) the answer is the answer sheet's, each field changed with probability `perturb_rate`
+    (see perturb) so local scoring finds wrong and ambiguous fields as with a real model; else fields are empty. The delay is `latency` plus up to `jitter`
+    seconds ("uniform"), or lognormal around a median of `latency` ("lognormal"). A share of the calls
+    can fail (`error_rate`, raises RuntimeError) or return broken JSON (`malformed_rate`, see malformed_kinds).
+    Use the instance itself as a sync llm function, or `acall` as an async one.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, seed: Optional[int] = None,
+                 distribution: str = "uniform", sigma: float = 0.5,
+                 error_rate: float = 0.0, malformed_rate: float = 0.0,
+                 answers: Optional[Dict[str, dict]] = None, perturb_rate: float = 0.0):
+        if distribution not in ("uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.answers = answers or {}
+        self.perturb_rate = perturb_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self) -> float:
+        if self.distribution == "lognormal":
+            return self.random.lognormvariate(0, self.sigma) * self.latency
+        return self.latency + self.random.uniform(0, self.jitter)
+
+    def response(self, prompt: str) -> str:
+        """Builds the fake model answer for a prompt (a JSON array when the prompt asks for one)."""
+        self.calls += 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise RuntimeError("Simulated LLM error")
+
+        if "Answer sheet" in prompt:
+            pair_indexes = judge_pair_pattern.findall(prompt)
+            if pair_indexes:
+                text = json.dumps([self.judgement(int(index)) for index in pair_indexes])
+            else:
+                text = json.dumps(self.judgement(0))
+        else:
+            conversation_ids = conversation_id_pattern.findall(prompt) or [str(self.calls)]
+            if "JSON array" in prompt:
+                text = json.dumps([self.extraction(conversation_id) for conversation_id in conversation_ids])
+            else:
+                text = json.dumps(self.extraction(conversation_ids[0]))
+
+        if self.malformed_rate and self.random.random() < self.malformed_rate:
+            return self.malformed(text)
+        return f"```json\n{text}\n```"
+
+    def malformed(self, text: str) -> str:
+        kind = self.random.choice(malformed_kinds)
+        if kind == "truncate":
+            text = text[:len(text) // 2]
+        elif kind == "trailing_comma":
+            text = text[:-1] + "," + text[-1]
+        elif kind == "unquoted_keys":
+            text = re.sub(r'"(\w+)":', r"\1:", text)
+        elif kind == "single_quotes":
+            text = text.replace('"', "'")
+        else:
+            return f"Sure! Here is the extracted information:\n```json\n{text}\n```\nLet me know if you need anything else."
+        return f"```json\n{text}\n```"
+
+    def extraction(self, conversation_id: str) -> dict:
+        if conversation_id in self.answers:
+            return self.perturb({**self.answers[conversation_id], "conversation_id": conversation_id})
+        return {
+            "conversation_id": conversation_id,
+            "products": [],
+            "store_location": None,
+            "product_category": None,
+            "service_rendered": None,
+            "customer_satisfaction": "Neutral",
+            "case_or_order_number": None,
+        }
+
+    def perturb(self, record: dict) -> dict:
+        """Changes each field with probability `perturb_rate`, mostly into values local scoring finds ambiguous."""
+        def hit() -> bool:
+            return self.perturb_rate and self.random.random() < self.perturb_rate
+
+        if hit():
+            record["products"] = list(record.get("products") or []) + [extra_product]
+        for field in ("store_location", "service_rendered", "product_category"):
+            if record.get(field) and hit():
+                # First alternative, last word dropped and a word added ("Delivery status inquiry" -> "Delivery status request")
+                words = str(record[field]).split("/")[0].split()
+                record[field] = " ".join(words[:max(1, len(words) - 1)] + ["request"])
+        if record.get("case_or_order_number") and hit():
+            record["case_or_order_number"] = f"{record['case_or_order_number'].split('/')[0]} or {self.random.randint(10 ** 8, 10 ** 9 - 1)}"
+        if hit():
+            record["customer_satisfaction"] = self.random.choice(
+                [level for level in satisfaction_levels if level != record.get("customer_satisfaction")])
+        return record
+
+    def judgement(self, conversation_index: int) -> dict:
+        return {"conversation_index": conversation_index, "total_score": self.random.randint(3, 7)}
+
+    def __call__(self, prompt: str) -> str:
+        time.sleep(self._delay())
+        return self.response(prompt)
+
+    async def acall(self, prompt: str) -> str:
+        await asyncio.sleep(self._delay())
+        return self.response(prompt)
@@ -0,0 +1,147 @@
+from difflib import SequenceMatcher
+from typing import Callable, Dict, List
+from normalization import normalize_text, split_alternatives, split_numbers
+
+# --- Configuration (scoring)---
+CORRECT, WRONG, AMBIGUOUS = "CORRECT", "WRONG", "AMBIGUOUS"
+# (correct_at_or_above, wrong_at_or_below) similarity thresholds for free-text fields, in between is AMBIGUOUS
+similarity_thresholds = {
+    "store_location": (0.8, 0.3),
+    "product_category": (0.8, 0.3),
+    "service_rendered": (0.75, 0.2),
+}
+# F1 thresholds for the products list
+products_thresholds = (0.8, 0.3)
+# Two product names are the same item at or above this similarity (or when one contains the other)
+product_match_threshold = 0.8
+
+scored_fields = ["conversation_id", "products", "store_location", "product_category",
+                 "service_rendered", "customer_satisfaction", "case_or_order_number"]
+
+
+# --- Functions ---
+def text_similarity(a: str, b: str) -> float:
+    """Max of character similarity and word overlap (Jaccard) on normalized text."""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    words_a, words_b = set(a.split()), set(b.split())
+    jaccard = len(words_a & words_b) / len(words_a | words_b)
+    return max(SequenceMatcher(None, a, b).ratio(), jaccard)
+
+
+def threshold_status(score: float, thresholds: tuple[float, float]) -> str:
+    correct_at, wrong_at = thresholds
+    if score >= correct_at:
+        return CORRECT
+    if score <= wrong_at:
+        return WRONG
+    return AMBIGUOUS
+
+
+def score_exact(facit_values: List, output_values: List) -> List[str]:
+    """Normalized exact match, any slash alternative of the answer sheet is accepted."""
+    return [
+        CORRECT if normalize_text(output) in {normalize_text(alternative) for alternative in split_alternatives(facit)}
+        or (facit is None and output is None) else WRONG
+        for facit, output in zip(facit_values, output_values)
+    ]
+
+
+def score_numbers(facit_values: List, output_values: List) -> List[str]:
+    """
+    Order/case numbers compared as sets of normalized numbers ('471. 515. 124' == '471515124').
+    CORRECT when the output numbers are all in the answer (for some slash alternative), WRONG when none are,
+    AMBIGUOUS when only some are.
+    """
+    statuses = []
+    for facit, output in zip(facit_values, output_values):
+        output_numbers = split_numbers(output)
+        status = WRONG
+        for alternative in split_alternatives(facit):
+            facit_numbers = split_numbers(alternative or None)
+            if output_numbers == facit_numbers or (output_numbers and output_numbers <= facit_numbers):
+                status = CORRECT
+                break
+            if output_numbers & facit_numbers:
+                status = AMBIGUOUS
+        statuses.append(status)
+    return statuses
+
+
+def score_similarity(facit_values: List, output_values: List, thresholds: tuple[float, float]) -> List[str]:
+    """Best similarity against the slash alternatives of the answer sheet, bucketed by `thresholds`."""
+    statuses = []
+    for facit, output in zip(facit_values, output_values):
+        if facit is None or output is None:
+            statuses.append(CORRECT if facit is None and output is None else WRONG)
+            continue
+        normalized_output = normalize_text(output)
+        best = max(text_similarity(normalize_text(alternative), normalized_output) for alternative in split_alternatives(facit))
+        statuses.append(threshold_status(best, thresholds))
+    return statuses
+
+
+def products_match(a: str, b: str) -> bool:
+    return a in b or b in a or SequenceMatcher(None, a, b).ratio() >= product_match_threshold
+
+
+def products_f1(facit_products: List[str], output_products: List[str]) -> float:
+    """F1 of set precision/recall, with fuzzy matching of product names."""
+    facit_set = {normalize_text(product) for product in facit_products or [] if normalize_text(product)}
+    output_set = {normalize_text(product) for product in output_products or [] if normalize_text(product)}
+    if not facit_set and not output_set:
+        return 1.0
+    if not facit_set or not output_set:
+        return 0.0
+    precision = sum(any(products_match(o, f) for f in facit_set) for o in output_set) / len(output_set)
+    recall = sum(any(products_match(f, o) for o in output_set) for f in facit_set) / len(facit_set)
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+
+def score_products(facit_values: List, output_values: List) -> List[str]:
+    return [threshold_status(products_f1(facit, output), products_thresholds)
+            for facit, output in zip(facit_values, output_values)]
+
+
+field_scorers: Dict[str, Callable[[List, List], List[str]]] = {
+    "conversation_id": score_exact,
+    "customer_satisfaction": score_exact,
+    "case_or_order_number": score_numbers,
+    "products": score_products,
+    "store_location": lambda f, o: score_similarity(f, o, similarity_thresholds["store_location"]),
+    "product_category": lambda f, o: score_similarity(f, o, similarity_thresholds["product_category"]),
+    "service_rendered": lambda f, o: score_similarity(f, o, similarity_thresholds["service_rendered"]),
+}
+
+
+def score_dataset(facit_data: List[dict], new_data: List[dict]) -> List[dict]:
+    """
+    Scores every (facit, output) pair at once, one field column at a time.
+
+    Returns one record per pair in the LLM-judge template format (value + '<field>_status' per field,
+    'total_score'), plus 'ambiguous_fields' listing the fields that need the LLM judge.
+    """
+    pairs = list(zip(facit_data, new_data))
+    statuses_by_field = {
+        field: field_scorers[field]([facit.get(field) for facit, _ in pairs], [output.get(field) for _, output in pairs])
+        for field in scored_fields
+    }
+
+    results = []
+    for index, (_, output) in enumerate(pairs):
+        result = {}
+        for field in scored_fields:
+            result[field] = output.get(field)
+            result[f"{field}_status"] = statuses_by_field[field][index]
+        result["total_score"] = sum(statuses_by_field[field][index] == CORRECT for field in scored_fields)
+        result["ambiguous_fields"] = [field for field in scored_fields if statuses_by_field[field][index] == AMBIGUOUS]
+        results.append(result)
+    return results
+
+
+def max_possible_score(evaluation_data: List[dict]) -> int:
+    """One point per scored field of every evaluated conversation (7 per conversation with the default template)."""
+    return sum(sum(key.endswith("_status") for key in conversation) or len(scored_fields)
+               for conversation in evaluation_data)
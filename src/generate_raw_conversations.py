@@ -0,0 +1,234 @@
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+# --- Configuration (path)---
+raw_output_path = "src/data/generated/raw_conversations.json"
+facit_output_path = "src/data/generated/facit.json"
+num_conversations = 1000
+seed = 42
+
+# Must match data_processing.specific_wait_message, its duplicates are counted during preprocessing
+specific_wait_message = "We are currently busier than usual at the moment and are experiencing extended wait times."
+
+# --- Templates ---
+products = [
+    ("SOCKERBIT", "Storage box with Lid", "Storage"), ("BILLY", "bookcase", "Furniture"),
+    ("KALLAX", "shelving unit", "Storage"), ("HEMNES", "8-drawer dresser", "Furniture"),
+    ("MALM", "bed frame", "Furniture"), ("POÄNG", "armchair", "Furniture"), ("LACK", "side table", "Furniture"),
+    ("EKTORP", "sofa", "Furniture"), ("PAX", "wardrobe", "Storage"), ("SKUBB", "storage case", "Storage"),
+    ("HEKTAR", "floor lamp", "Lighting"), ("RANARP", "work lamp", "Lighting"), ("VARIERA", "pot lid organizer", "Kitchen"),
+    ("KUNGSFORS", "suspension rail", "Kitchen"), ("GODMORGON", "wash-stand", "Bathroom"), ("FEJKA", "artificial potted plant", "Home Goods"),
+]
+stores = [("menlo", "Menlo"), ("Schaumburg", "Schaumburg"), ("Brooklyn", "IKEA Brooklyn"), ("Burbank", "Burbank"),
+          ("Emeryville", "Emeryville"), ("Costa Mesa", "Costa Mesa"), ("Tempe", "Tempe"), ("Round Rock", "Round Rock")]
+agent_names = ["Bobba", "Alex", "Maria", "Sam", "Priya", "Jonas", "Lena", "Omar"]
+countries = ["US", "US", "US", "CA"]
+channels = ["chat", "chat", "messenger", "web"]
+wait_notices = ["Your estimated wait time is more than 30 minutes", "Your estimated wait time is less than 5 minutes",
+                "Your estimated wait time is 10 minutes"]
+closing_positive = ["Not today, thank you for your help!", "That's all, thanks a lot!", "Great, thank you so much!"]
+closing_negative = ["This is really disappointing.", "I am not happy with this at all.", "Fine. I expected better."]
+closing_neutral = ["Ok.", "Alright, thanks.", "I will wait then."]
+
+
+# --- Functions ---
+def format_number(rng: random.Random, digits: int) -> str:
+    """Random order/case number, written the different ways customers write them."""
+    number = "".join(rng.choice("0123456789") for _ in range(digits))
+    style = rng.random()
+    if style < 0.6 or digits != 9:
+        return number
+    if style < 0.8:
+        return f"{number[:3]}. {number[3:6]}. {number[6:]}"
+    return f"{number[:3]}-{number[3:6]}-{number[6:]}"
+
+
+def scenario_damaged_refund(rng: random.Random, agent: str) -> tuple[list, dict]:
+    family, description, category = rng.choice(products)
+    store_alias, store = rng.choice(stores)
+    order_number, case_number = format_number(rng, 9), format_number(rng, 8)
+    satisfied = rng.random() < 0.7
+    lines = [
+        ("customer", f"Hi {agent}, an item I bought arrived damaged. I am seeking a refund for the item."),
+        ("agent", "I am sorry to know that items in your order are damaged. I'd be glad to assist!"),
+        ("agent", "Could you please help me with your order number and which store you bought the items from ?"),
+        ("customer", f"Order number: {order_number}"),
+        ("customer", f"the store is the one in {store_alias}, the broken item is the {family} {description}"),
+        ("agent", "Welcome"),
+        ("agent", f"I have successfully created your case, your case id is {case_number} . The refund process typically takes approximately 10-14 business days."),
+        ("customer", rng.choice(closing_positive if satisfied else closing_negative)),
+    ]
+    truth = {
+        "products": [f"{family} {description}"], "store_location": store, "product_category": category,
+        "service_rendered": "Refund for damaged item", "customer_satisfaction": "Positive" if satisfied else "Negative",
+        "case_or_order_number": f"{case_number} or {order_number}",
+    }
+    return lines, truth
+
+
+def scenario_delivery_status(rng: random.Random, agent: str) -> tuple[list, dict]:
+    order_number = format_number(rng, 9)
+    late = rng.random() < 0.5
+    lines = [
+        ("customer", "Hi, I want to know when my order will be delivered."),
+        ("agent", "I'd be happy to check that for you. May I have your order number please?"),
+        ("customer", f"Sure, my order number is {order_number}"),
+        ("agent", "Thank you, one moment please."),
+        ("agent", "Your order is delayed at the distribution center, the new delivery date is in 3 days." if late
+         else "Your order is on its way and will be delivered tomorrow."),
+        ("customer", rng.choice(closing_negative if late else closing_neutral)),
+    ]
+    truth = {
+        "products": [], "store_location": None, "product_category": None,
+        "service_rendered": "Delivery status inquiry/Order status inquiry",
+        "customer_satisfaction": "Negative" if late else "Neutral", "case_or_order_number": order_number,
+    }
+    return lines, truth
+
+
+def scenario_assembly(rng: random.Random, agent: str) -> tuple[list, dict]:
+    family, description, category = rng.choice(products)
+    lines = [
+        ("customer", f"Hello, can I book assembly for the {family} {description} I just bought?"),
+        ("agent", "Of course! Assembly can be booked for the day of delivery or any day after."),
+        ("customer", "The day after delivery works for me."),
+        ("agent", "Welcome"),
+        ("agent", "Your assembly service is booked, you will get a confirmation email shortly."),
+        ("customer", rng.choice(closing_positive)),
+    ]
+    truth = {
+        "products": [f"{family} {description}"], "store_location": None, "product_category": category,
+        "service_rendered": "Assembly service booking", "customer_satisfaction": "Positive", "case_or_order_number": None,
+    }
+    return lines, truth
+
+
+def scenario_availability(rng: random.Random, agent: str) -> tuple[list, dict]:
+    family, description, category = rng.choice(products)
+    store_alias, store = rng.choice(stores)
+    in_stock = rng.random() < 0.5
+    lines = [
+        ("customer", f"Is the {family} {description} in stock at the {store_alias} store?"),
+        ("agent", "Let me check the stock for you."),
+        ("agent", "Yes, it is in stock and can be picked up today." if in_stock
+         else "Unfortunately it is out of stock, we expect new stock in two weeks."),
+        ("customer", rng.choice(closing_positive if in_stock else closing_neutral)),
+    ]
+    truth = {
+        "products": [f"{family} {description}"], "store_location": store, "product_category": category,
+        "service_rendered": "Product availability inquiry", "customer_satisfaction": "Positive" if in_stock else "Neutral",
+        "case_or_order_number": None,
+    }
+    return lines, truth
+
+
+def scenario_disconnected(rng: random.Random, agent: str) -> tuple[list, dict]:
+    truth = {
+        "products": [], "store_location": None, "product_category": None,
+        "service_rendered": "Customer disconnected during que/No answer", "customer_satisfaction": "Neutral",
+        "case_or_order_number": None,
+    }
+    return [], truth
+
+
+scenarios = [
+    (scenario_damaged_refund, 0.3), (scenario_delivery_status, 0.25), (scenario_assembly, 0.15),
+    (scenario_availability, 0.15), (scenario_disconnected, 0.15),
+]
+
+
+def generate_conversation(rng: random.Random, conversation_id: str, start: datetime) -> tuple[dict, dict]:
+    """One raw conversation (in the shape parse_json_data expects) and its answer sheet record."""
+    scenario = rng.choices([s for s, _ in scenarios], weights=[w for _, w in scenarios])[0]
+    agent = rng.choice(agent_names)
+    body, truth = scenario(rng, agent)
+
+    lines = [
+        ("customer", "Customer connected from Live Chat"),
+        ("system", "Please hold, we're connecting you to IKEA live chat"),
+        ("system", rng.choice(wait_notices)),
+    ]
+    # The wait notice is repeated while the customer is in the queue, preprocessing counts the duplicates
+    lines += [("system", specific_wait_message)] * (1 + rng.randint(0, 6) if body else rng.randint(2, 12))
+    if body:
+        lines.append(("agent", f"Thank you for contacting IKEA Customer Support Center! My name is {agent} . How may I assist you?"))
+        lines += body
+        lines.append(("agent", "It was my pleasure chatting with you. Thank you for selecting IKEA. Have a lovely day ahead."))
+
+    timestamp = start
+    messages = []
+    for user_type, text in lines:
+        timestamp += timedelta(seconds=rng.randint(5, 90))
+        messages.append({"user_type": user_type, "text_raw": text, "timestamp": timestamp.isoformat()})
+
+    raw = {
+        "conversation_id": conversation_id,
+        "country": rng.choice(countries),
+        "channel": rng.choice(channels),
+        "start_time": start.isoformat(),
+        "end_time": timestamp.isoformat(),
+        "published": True,
+        "translator": None,
+        "messages": messages,
+    }
+    return raw, {"conversation_id": conversation_id, **truth}
+
+
+def generate_conversations(count: int, seed: Optional[int] = seed) -> Iterator[tuple[dict, dict]]:
+    """Yields `count` (raw conversation, answer sheet record) pairs, the same ones for the same seed."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    for index in range(count):
+        start += timedelta(seconds=rng.randint(10, 600))
+        yield generate_conversation(rng, str(index), start)
+
+
+class JsonRecordWriter:
+    """Writes records one at a time as a JSON array (or JSONL when the path ends with .jsonl)."""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.jsonl = path.endswith(".jsonl")
+        self.file = open(path, "w", encoding="utf-8")
+        self.count = 0
+        if not self.jsonl:
+            self.file.write("[\n")
+
+    def write(self, record: dict) -> None:
+        if self.jsonl:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            self.file.write((",\n" if self.count else "") + json.dumps(record, ensure_ascii=False))
+        self.count += 1
+
+    def close(self) -> None:
+        if not self.jsonl:
+            self.file.write("\n]\n")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_dataset(raw_output_path: str, facit_output_path: str, count: int, seed: Optional[int] = seed) -> int:
+    """Streams `count` generated conversations and their answer sheet to disk. Returns the number written."""
+    start = time.perf_counter()
+    with JsonRecordWriter(raw_output_path) as raw_writer, JsonRecordWriter(facit_output_path) as facit_writer:
+        for raw, truth in generate_conversations(count, seed):
+            raw_writer.write(raw)
+            facit_writer.write(truth)
+    elapsed = time.perf_counter() - start
+    print(f"Generated {count} conversations in {round(elapsed, 2)}s to {raw_output_path} (answer sheet: {facit_output_path})")
+    return count
+
+
+if __name__ == "__main__":
+    write_dataset(raw_output_path, facit_output_path, num_conversations, seed)
@@ -1,14 +1,32 @@
 import os
 import json
+import asyncio
+import hashlib
+from typing import List, Optional
 from dotenv import load_dotenv
 import logging
-from llm_models import gemini_2_5_flash_lite_preview_reponse
+from pydantic import BaseModel
+from llm_models import generate, agenerate, json_output_settings
+from main import ConversationInfo
+from json_repair import parse_llm_json
+from json_io import open_for_append
+from rate_limiter import RateLimiter, estimate_tokens
 
 # --- Configuration ---
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 output_file = "src/data/synthetic_data.jsonl"
+generation_model = "gemini-2.5-flash-lite"
+# Gemini structured output: the answer is constrained to the SyntheticExample schema
+use_structured_output = True
+# Total examples wanted in output_file, a rerun only generates what is missing
+target_count = 3
+max_concurrency = 4
+requests_per_minute = 30
+tokens_per_minute = None
+# Earlier generated examples used as extra seeds (rotated with the hard-coded example below)
+seed_examples_file = "src/data/llm_output_data/synthetic_data.jsonl"
 
 
 # --- Example (Based on provided data) ---
@@ -55,9 +73,51 @@ example_json_output = {
 }
 
 
+# Rotated per example so the model does not keep returning the same conversation
+scenario_hints = [
+    "a delivery that arrived with a damaged or missing item",
+    "booking or rescheduling an assembly service",
+    "returning an item without the receipt",
+    "a question about the availability of a product in a specific store",
+    "cancelling an order and asking about the refund",
+    "a payment problem while placing an online order",
+    "a customer who disconnects while waiting in the queue",
+    "a complaint about a late delivery that ends with an unhappy customer",
+    "asking for spare parts or missing screws for a piece of furniture",
+    "changing the delivery address of an existing order",
+    "a question about the warranty of a kitchen or mattress",
+    "a price adjustment request after a product went on sale",
+]
+
+
+def load_seed_examples(seed_file: str = seed_examples_file) -> List[tuple[str, dict]]:
+    """The hard-coded example plus previously generated (transcript, structured_output) pairs, if any."""
+    seeds = [(example_transcript, example_json_output)]
+    if os.path.exists(seed_file):
+        with open(seed_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    example = json.loads(line)
+                    seeds.append((example["transcript"], example["structured_output"]))
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+    return seeds
+
+
+class SyntheticExample(BaseModel):
+    """Schema of one generated example."""
+
+    transcript: str
+    structured_output: ConversationInfo
+
+
+def generation_settings() -> Optional[dict]:
+    return json_output_settings(SyntheticExample) if use_structured_output else None
+
+
 # --- Prompt Engineering ---
 
-def llm_prompt(transcript: str, json_output: dict) -> str:
+def llm_prompt(transcript: str, json_output: dict, scenario_hint: Optional[str] = None) -> str:
     """Creates the prompt for the synthetic data generation of a LLM."""
     
     # Convert the JSON output to a formatted string
@@ -86,71 +146,156 @@ def llm_prompt(transcript: str, json_output: dict) -> str:
     The `conversation_id` should be a unique identifier string.
     Please provide your response as a single JSON object with the keys "transcript" and "structured_output".
     """
+    if scenario_hint:
+        prompt += f"""
+    The new conversation should be about: {scenario_hint}.
+    """
 
     return prompt
 
 
-def generate_synthetic_data() -> json:
-    """Generates a single synthetic example of (transcript, structured_output) using LLM."""
-    
-    prompt = llm_prompt(example_transcript, example_json_output)
-    
+def parse_synthetic_example(llm_output: str) -> Optional[dict]:
+    """Parses and checks one generated example, None if it is unusable."""
     try:
-        llm_output = gemini_2_5_flash_lite_preview_reponse(prompt)
-        
-        cleaned_llm_output = llm_output.strip().replace("```json", "").replace("```", "").strip()
-        json_llm_output = json.loads(cleaned_llm_output)
-        
+        json_llm_output = parse_llm_json(llm_output)
+
         # Basic validation
-        if "transcript" in json_llm_output and "structured_output" in json_llm_output:
+        if isinstance(json_llm_output, dict) and "transcript" in json_llm_output and "structured_output" in json_llm_output:
             logging.info("Successfully generated synthetic example")
             return json_llm_output
         else:
             logging.warning("Generated data is missing required keys ('transcript', 'structured_output').")
             return None
-            
+
     except json.JSONDecodeError as e:
         logging.error(f"Failed to decode JSON from the model's response: {e}")
-        logging.error(f"Response was: {json_llm_output[:500]}...")
+        logging.error(f"Response was: {llm_output[:500]}...")
         return None
+
+
+def example_prompt(index: int, seeds: List[tuple[str, dict]]) -> str:
+    """Prompt for the example number `index`, rotating the seed example and the scenario hint."""
+    transcript, json_output = seeds[index % len(seeds)]
+    return llm_prompt(transcript, json_output, scenario_hints[index % len(scenario_hints)])
+
+
+def generate_synthetic_data(prompt: Optional[str] = None) -> json:
+    """Generates a single synthetic example of (transcript, structured_output) using LLM."""
+    
+    if prompt is None:
+        prompt = llm_prompt(example_transcript, example_json_output)
+    
+    try:
+        # Never served from the response cache, the same prompt must give a new example every time
+        llm_output = generate(prompt, generation_model, use_cache=False, settings=generation_settings())
+        return parse_synthetic_example(llm_output)
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
         return None
 
 
-def main(output_file: str):
-    """Main function to generate a dataset of synthetic examples using LLM."""
-    
-    num_synthetic_data_generate = 3 
-    
-    logging.info(f"Starting synthetic data generation for {num_synthetic_data_generate} examples using LLM")
-    
-    successful_examples = []
-    
-    # Generate examples sequentially
-    for i in range(num_synthetic_data_generate):
-        logging.info(f"Generating example {i+1}/{num_synthetic_data_generate}...")
-        example = generate_synthetic_data()
+async def agenerate_synthetic_data(prompt: str, semaphore: asyncio.Semaphore, rate_limiter: RateLimiter) -> Optional[dict]:
+    """Async version of generate_synthetic_data, waits for a concurrency slot and the rate limiter."""
+    async with semaphore:
+        await rate_limiter.acquire(estimate_tokens(prompt))
+        try:
+            llm_output = await agenerate(prompt, generation_model, use_cache=False, settings=generation_settings())
+        except Exception as e:
+            logging.error(f"An unexpected error occurred: {e}")
+            return None
+    return parse_synthetic_example(llm_output)
+
+
+def transcript_hash(example: dict) -> str:
+    return hashlib.sha256(str(example.get("transcript")).encode("utf-8")).hexdigest()
 
-        if example:
-            successful_examples.append(example)
-        else:
-            logging.warning(f"Failed to generate example {i+1}")
-    
-    logging.info(f"Successfully generated {len(successful_examples)} examples.")
 
-    # Save the generated data to a JSONL file
+def parse_synthetic_example_line(line: str) -> Optional[dict]:
     try:
+        example = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return example if isinstance(example, dict) and "transcript" in example else None
+
+
+def scan_existing_examples(output_file: str) -> set:
+    """Transcript hashes of the valid examples already in output_file (used to resume and to drop duplicates)."""
+    hashes = set()
+    if not os.path.exists(output_file):
+        return hashes
+    with open(output_file, "r", encoding="utf-8") as f:
+        for line in f:
+            example = parse_synthetic_example_line(line)
+            if example is not None:
+                hashes.add(transcript_hash(example))
+    return hashes
+
+
+async def generate_to_jsonl(output_file: str, target_count: int, max_concurrency: int = max_concurrency,
+                            requests_per_minute: Optional[float] = requests_per_minute,
+                            tokens_per_minute: Optional[float] = tokens_per_minute) -> int:
+    """
+    Generates examples concurrently until output_file holds `target_count` distinct examples.
+
+    Every example is appended to the JSONL file as soon as it arrives, so an interrupted run
+    resumes toward the target. Duplicate transcripts are dropped. Gives up after twice as many
+    attempts as examples missing, in case the model keeps failing.
+
+    Returns:
+        int: number of examples in output_file
+    """
+    if os.path.dirname(output_file):
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
-        with open(output_file, "w", encoding="utf-8") as f:
+    seen_hashes = scan_existing_examples(output_file)
+    written = len(seen_hashes)
+    missing = target_count - written
+    if missing <= 0:
+        logging.info(f"{output_file} already holds {written} examples, nothing to generate.")
+        return written
+    logging.info(f"Resuming with {written} existing examples, generating {missing} more." if written
+                 else f"Generating {missing} examples.")
 
-            for example in successful_examples:
+    seeds = load_seed_examples()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    start_index, attempts, max_attempts = written, 0, missing * 2
+    pending = set()
+
+    with open_for_append(output_file) as f:
+        while written < target_count and (pending or attempts < max_attempts):
+            while len(pending) < max_concurrency and written + len(pending) < target_count and attempts < max_attempts:
+                # Rotation continues from the existing count, so a resumed run does not restart at the same seeds
+                prompt = example_prompt(start_index + attempts, seeds)
+                pending.add(asyncio.create_task(agenerate_synthetic_data(prompt, semaphore, rate_limiter)))
+                attempts += 1
+
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                example = task.result()
+                if example is None or written >= target_count:
+                    continue
+                example_hash = transcript_hash(example)
+                if example_hash in seen_hashes:
+                    logging.warning("Generated a duplicate transcript, dropping it.")
+                    continue
+                seen_hashes.add(example_hash)
                 f.write(json.dumps(example) + "\n")
+                f.flush()
+                written += 1
+                logging.info(f"Saved example {written}/{target_count}")
+
+    for task in pending:
+        task.cancel()
+    logging.info(f"{output_file} holds {written} examples after {attempts} generation requests.")
+    return written
 
-        logging.info(f"Data successfully saved to {output_file}")
 
-    except IOError as e:
-        logging.error(f"Failed to write to file {output_file}: {e}")
+def main(output_file: str, target_count: int = target_count):
+    """Main function to generate a dataset of synthetic examples using LLM."""
+    
+    logging.info(f"Starting synthetic data generation for {target_count} examples using LLM")
+    asyncio.run(generate_to_jsonl(output_file, target_count))
+
 
 if __name__ == "__main__":
-    main(output_file) 
\ No newline at end of file
+    main(output_file) 
@@ -0,0 +1,137 @@
+import json
+import os
+import re
+from typing import Iterator, List, TextIO
+
+
+# --- Functions ---
+def load_json_data(file_path: str):
+    """
+    Loads data from the JSON file (or all records of a JSONL file).
+    """
+    print("Loading data...")
+    if file_path.endswith(".jsonl"):
+        return list(iter_json_records(file_path))
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            raw_data = json.load(f)
+            return raw_data
+
+    except FileNotFoundError:
+        # Raise a proper Exception object, not a string
+        raise Exception(f"Error: The file at {file_path} was not found.")
+        
+    except json.JSONDecodeError:
+        # Raise a proper Exception object, not a string
+        raise Exception(f"Error: The file at {file_path} is not a valid JSON file.")
+
+
+def iter_json_array(file_path: str, chunk_size: int = 1 << 20) -> Iterator:
+    """
+    Yields the elements of a top-level JSON array one at a time, reading the file in chunks.
+    Memory is bounded by the chunk size plus the largest single element, not the file size.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r"[\s,]*")
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            buffer = f.read(chunk_size).lstrip()
+            if not buffer.startswith("["):
+                raise Exception(f"Error: The file at {file_path} is not a JSON array.")
+            position, eof = 1, False
+            while True:
+                position = whitespace.match(buffer, position).end()
+                if position == len(buffer):
+                    if eof:
+                        raise Exception(f"Error: The file at {file_path} is not a valid JSON file.")
+                    chunk = f.read(chunk_size)
+                    buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+                    continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    element, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # Element continues in the next chunk (or the file is broken)
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        raise Exception(f"Error: The file at {file_path} is not a valid JSON file.")
+                    buffer, position = buffer[position:] + chunk, 0
+                    continue
+                yield element
+    except FileNotFoundError:
+        raise Exception(f"Error: The file at {file_path} was not found.")
+
+
+def iter_json_records(file_path: str) -> Iterator[dict]:
+    """
+    Yields records one at a time from a JSONL file (one JSON object per line)
+    or from a JSON array file, without loading the whole file.
+    """
+    if not file_path.endswith(".jsonl"):
+        yield from iter_json_array(file_path)
+        return
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    except FileNotFoundError:
+        raise Exception(f"Error: The file at {file_path} was not found.")
+
+
+def load_completed_ids(file_path: str) -> set:
+    """Scans an existing JSONL output file and returns the conversation_ids already in it.
+
+    A truncated last line (crash in the middle of a write) is ignored, that conversation is simply redone
+    (open_for_append cuts the partial line off before new records are appended).
+    """
+    completed_ids = set()
+    if not os.path.exists(file_path):
+        return completed_ids
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                completed_ids.add(str(json.loads(line).get("conversation_id")))
+            except (json.JSONDecodeError, AttributeError):
+                continue
+    return completed_ids
+
+
+def open_for_append(file_path: str) -> TextIO:
+    """
+    Opens a JSONL file to append to, after truncating it back to its last newline: a line cut off by a crash
+    would otherwise be glued to the first new record and make the whole file unreadable.
+    """
+    if os.path.exists(file_path):
+        with open(file_path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(position - 65536, 0)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b"\n")
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position < end:
+                print(f"Removing a truncated last line from {file_path}.")
+                f.truncate(position)
+    return open(file_path, 'a', encoding='utf-8')
+
+
+def append_jsonl(record: dict, f: TextIO) -> None:
+    """Appends one record to an open JSONL file and flushes it, so it survives a crash."""
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f.flush()
+
+
+def save_json_file(extracted_info: List[dict], output_path: str) -> None:
+    """Saves json file"""
+    try:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(extracted_info, f, indent=4)
+        print(f"Successfully saved extracted info to {output_path}")
+    except IOError as e:
+        print(f"Error writing to {output_path}: {e}")
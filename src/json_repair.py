@@ -0,0 +1,234 @@
+import json
+import re
+import threading
+from typing import Any, Optional
+import telemetry
+
+# --- Configuration ---
+# Bare words that are read as JSON literals (the model sometimes answers with Python literals)
+literal_words = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+
+fence_regex = re.compile(r"```(?:json|JSON)?")
+number_regex = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+bare_key_regex = re.compile(r"[A-Za-z_$][\w$-]*")
+bare_value_regex = re.compile(r"[^,\]}\n]+")
+
+# How the LLM answers parsed so far: valid JSON as is, valid after repair, unusable
+repair_stats = {"clean": 0, "repaired": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+
+class _Truncated(Exception):
+    """The text ended inside a value."""
+
+
+# --- Functions ---
+def strip_fences(text: str) -> str:
+    return fence_regex.sub("", text).strip()
+
+
+class TolerantParser:
+    """
+    Recursive descent JSON parser that accepts the usual LLM mistakes: trailing commas, missing commas,
+    unquoted or single-quoted keys and strings, Python literals (None/True/False) and text after the value.
+    A top-level array cut off by the end of the text keeps its complete elements. A cut-off object is rejected,
+    since the fields it lost would silently become null.
+    """
+
+    def __init__(self, text: str, position: int = 0):
+        self.text = text
+        self.position = position
+        self.depth = 0
+
+    def error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self.text, min(self.position, len(self.text)))
+
+    def skip_whitespace(self) -> None:
+        while self.position < len(self.text) and self.text[self.position] in " \t\r\n":
+            self.position += 1
+
+    def peek(self) -> str:
+        self.skip_whitespace()
+        if self.position >= len(self.text):
+            raise _Truncated()
+        return self.text[self.position]
+
+    def parse_value(self) -> Any:
+        char = self.peek()
+        if char == "{":
+            return self.parse_object()
+        if char == "[":
+            return self.parse_array()
+        if char in "\"'":
+            return self.parse_string()
+        match = number_regex.match(self.text, self.position)
+        if match and (match.end() == len(self.text) or self.text[match.end()] in " \t\r\n,]}"):
+            if match.end() == len(self.text):
+                # A number at the very end may be missing digits
+                raise _Truncated()
+            self.position = match.end()
+            return json.loads(match.group())
+        match = bare_value_regex.match(self.text, self.position)
+        if not match:
+            raise self.error(f"Unexpected character {char!r}")
+        word = match.group().strip()
+        self.position = match.end()
+        if self.position >= len(self.text):
+            raise _Truncated()
+        return literal_words.get(word, word)
+
+    def parse_string(self) -> str:
+        quote = self.text[self.position]
+        self.position += 1
+        chars = []
+        while self.position < len(self.text):
+            char = self.text[self.position]
+            if char == "\\":
+                if self.position + 1 >= len(self.text):
+                    break
+                escaped = self.text[self.position:self.position + 2]
+                if escaped[1] == "u" and self.position + 6 <= len(self.text):
+                    escaped = self.text[self.position:self.position + 6]
+                try:
+                    chars.append(json.loads(f'"{escaped}"'))
+                except json.JSONDecodeError:
+                    # Invalid escape, keep the character as it is
+                    chars.append(escaped[1])
+                self.position += len(escaped)
+                continue
+            if char == quote:
+                self.position += 1
+                return "".join(chars)
+            chars.append(char)
+            self.position += 1
+        raise _Truncated()
+
+    def parse_key(self) -> str:
+        char = self.peek()
+        if char in "\"'":
+            return self.parse_string()
+        match = bare_key_regex.match(self.text, self.position)
+        if not match:
+            raise self.error(f"Expected an object key, got {char!r}")
+        self.position = match.end()
+        return match.group()
+
+    def parse_object(self) -> dict:
+        self.position += 1
+        result = {}
+        while True:
+            char = self.peek()
+            if char == "}":
+                self.position += 1
+                return result
+            if char == ",":
+                self.position += 1
+                continue
+            key = self.parse_key()
+            if self.peek() != ":":
+                raise self.error(f"Expected ':' after key {key!r}")
+            self.position += 1
+            result[key] = self.parse_value()
+
+    def parse_array(self) -> list:
+        self.position += 1
+        self.depth += 1
+        result = []
+        try:
+            while True:
+                try:
+                    char = self.peek()
+                    if char == "]":
+                        self.position += 1
+                        return result
+                    if char == ",":
+                        self.position += 1
+                        continue
+                    result.append(self.parse_value())
+                except _Truncated:
+                    if result and self.depth == 1:
+                        return result
+                    raise
+        finally:
+            # Also when a nested array was cut off, so the top-level array can keep its complete elements
+            self.depth -= 1
+
+
+def parse_llm_json(text: str) -> Any:
+    """
+    Parses a LLM answer as JSON: code fences and text around the JSON value are ignored, and common
+    mistakes are repaired locally (see TolerantParser) so the answer can be used without another request.
+
+    Raises:
+        json.JSONDecodeError: the answer holds no usable JSON value.
+    """
+    cleaned = strip_fences(text)
+    try:
+        value = json.loads(cleaned)
+        _count("clean")
+        return value
+    except json.JSONDecodeError as e:
+        error = e
+
+    # Start at the first object or array, when both parse the one covering more text wins ("see [1]: {...}").
+    # A value cut off by the end of the text stops the search, anything after its start is nested in it.
+    best, best_length = None, 0
+    for start in sorted(position for position in (cleaned.find("{"), cleaned.find("[")) if position >= 0):
+        parser = TolerantParser(cleaned, start)
+        try:
+            value = parser.parse_value()
+        except _Truncated:
+            break
+        except json.JSONDecodeError as e:
+            error = e
+            continue
+        if parser.position - start > best_length:
+            best, best_length = value, parser.position - start
+    if best_length:
+        _count("repaired")
+        return best
+    _count("failed")
+    raise error
+
+
+def _count(outcome: str) -> None:
+    with _stats_lock:
+        repair_stats[outcome] += 1
+    telemetry.record_json_parse(outcome)
+
+
+def reset_repair_stats() -> None:
+    with _stats_lock:
+        for outcome in repair_stats:
+            repair_stats[outcome] = 0
+
+
+def failure_rates(answers: list) -> dict:
+    """Share of answers that strict json.loads (after fence stripping) and parse_llm_json cannot read."""
+    strict_failures, repaired_failures = 0, 0
+    for answer in answers:
+        try:
+            json.loads(strip_fences(answer))
+        except json.JSONDecodeError:
+            strict_failures += 1
+        try:
+            parse_llm_json(answer)
+        except json.JSONDecodeError:
+            repaired_failures += 1
+    total = len(answers) or 1
+    return {"answers": len(answers), "strict_failure_rate": round(strict_failures / total, 4),
+            "repaired_failure_rate": round(repaired_failures / total, 4)}
+
+
+def measure(count: int = 10_000, malformed_rate: float = 0.2, seed: Optional[int] = 42) -> dict:
+    """Failure rates on simulated answers (fake_llm.FakeLLM) with `malformed_rate` broken JSON."""
+    from fake_llm import FakeLLM
+    llm = FakeLLM(latency=0, seed=seed, malformed_rate=malformed_rate)
+    answers = [llm.response(f"'conversation_id': '{index}'") for index in range(count)]
+    answers += [llm.response(f"JSON array 'conversation_id': '{index}' 'conversation_id': '{index + 1}'")
+                for index in range(count)]
+    return failure_rates(answers)
+
+
+if __name__ == "__main__":
+    print(f"JSON failure rates on simulated answers: {measure()}")
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+def _settings_default(value):
+    # Structured output settings can hold a pydantic model class, key on its JSON schema so a schema change is a miss
+    if hasattr(value, "model_json_schema"):
+        return value.model_json_schema()
+    return str(value)
+
+
+class ResponseCache:
+    """
+    Disk-backed (SQLite) cache of LLM responses, content-addressed on
+    backend + model + prompt + generation settings.
+
+    Entries older than `max_age_seconds` are treated as misses. When the cache holds more than
+    `max_entries` rows or `max_bytes` of response text, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_entries: Optional[int] = 100_000, max_bytes: Optional[int] = None,
+                 max_age_seconds: Optional[float] = None, evict_every: int = 100):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+
+    @staticmethod
+    def make_key(backend: str, model: str, prompt: str, settings: Optional[dict] = None) -> str:
+        """sha256 over everything that changes the model's answer."""
+        payload = json.dumps([backend, model, settings or {}, prompt], sort_keys=True, default=_settings_default)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode('utf-8')), now, now))
+            self._writes_since_evict += 1
+            if self._writes_since_evict >= self.evict_every:
+                self._evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            self._evict()
+
+    def _evict(self) -> None:
+        self._writes_since_evict = 0
+        if self.max_age_seconds is not None:
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+        if self.max_entries is not None:
+            self._conn.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # Walk from the oldest access and drop rows until we are under the limit
+                to_delete = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC"):
+                    if total <= self.max_bytes:
+                        break
+                    to_delete.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total_bytes = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,68 +1,269 @@
+import asyncio
+import json
 import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional
 from dotenv import load_dotenv
 from google import genai
+import telemetry
+from fake_llm import FakeLLM
+from llm_cache import ResponseCache
 
 
-def get_gemini_response(prompt: str) -> str:
+# --- Configuration (models)---
+# Short model name -> backend, provider model id, generation settings (passed as GenerateContentConfig)
+# and price in USD per 1M input/output tokens (used for the telemetry cost estimate).
+# Can be extended/overridden with a JSON file of the same shape through the LLM_MODELS_CONFIG env variable.
+MODEL_REGISTRY: Dict[str, dict] = {
+    "gemini-2.5-flash": {"backend": "gemini", "model": "gemini-2.5-flash", "settings": {},
+                         "prices": {"input": 0.30, "output": 2.50}},
+    "gemini-1.5-flash-8b": {"backend": "gemini", "model": "gemini-1.5-flash-8b", "settings": {},
+                            "prices": {"input": 0.0375, "output": 0.15}},
+    "gemini-2.5-flash-lite": {"backend": "gemini", "model": "gemini-2.5-flash-lite-preview-06-17", "settings": {},
+                              "prices": {"input": 0.10, "output": 0.40}},
+}
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+# --- Configuration (response cache)---
+# Set LLM_CACHE_BYPASS=1 (or call set_cache_bypass(True)) to always call the model and not store answers.
+cache_path = os.getenv("LLM_CACHE_PATH", "src/data/cache/llm_cache.sqlite")
+cache_max_entries = 100_000
+cache_max_bytes = 500 * 1024 * 1024
+cache_max_age_seconds = 30 * 24 * 3600
+cache_bypass = os.getenv("LLM_CACHE_BYPASS") == "1"
+
+
+# --- Backends ---
+class LLMBackend(ABC):
+    """Interface for a text generation backend. Subclasses implement `generate`, `agenerate` is optional."""
+
+    @abstractmethod
+    def generate(self, model: str, prompt: str, settings: dict) -> str:
+        ...
+
+    async def agenerate(self, model: str, prompt: str, settings: dict) -> str:
+        return await asyncio.to_thread(self.generate, model, prompt, settings)
+
+
+class GeminiBackend(LLMBackend):
     """
-    Sends a prompt to the Gemini model and returns the response.
+    Gemini backend with one process-wide client, created on first use and reused for every call
+    (sync calls through `client.models`, async calls through `client.aio.models`), so the
+    connection pool and TLS sessions are shared instead of rebuilt per prompt.
     """
-    load_dotenv()
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
 
-    client = genai.Client(api_key=api_key)
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
 
-    response = client.models.generate_content(
-    model='gemini-2.5-flash',
-    contents=prompt)
-    
-    if response.text is None:
-        return "Error: No response text generated"
-    
-    return response.text
+    @property
+    def client(self) -> genai.Client:
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    load_dotenv()
+                    api_key = os.getenv('GEMINI_API_KEY')
+                    if not api_key:
+                        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+                    self._client = genai.Client(api_key=api_key)
+        return self._client
 
+    @staticmethod
+    def _text(response) -> str:
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            # Thinking tokens are billed as output
+            telemetry.record_usage(usage.prompt_token_count,
+                                   (usage.candidates_token_count or 0) + (getattr(usage, "thoughts_token_count", None) or 0))
+        if response.text is None:
+            return "Error: No response text generated"
+        return response.text
 
-def gemini_1_5_flash_8b_reponse(prompt: str) -> str:
+    def generate(self, model: str, prompt: str, settings: dict) -> str:
+        response = self.client.models.generate_content(model=model, contents=prompt, config=settings or None)
+        return self._text(response)
+
+    async def agenerate(self, model: str, prompt: str, settings: dict) -> str:
+        response = await self.client.aio.models.generate_content(model=model, contents=prompt, config=settings or None)
+        return self._text(response)
+
+
+class StubBackend(LLMBackend):
+    """
+    Local backend for tests and benchmarks. Answers every prompt with `responder`
+    (a FakeLLM by default, its `acall` is used for async calls when available).
+    """
+
+    def __init__(self, responder: Optional[Callable[[str], str]] = None):
+        self.responder = responder if responder is not None else FakeLLM(latency=0)
+
+    def generate(self, model: str, prompt: str, settings: dict) -> str:
+        return self.responder(prompt)
+
+    async def agenerate(self, model: str, prompt: str, settings: dict) -> str:
+        acall = getattr(self.responder, "acall", None)
+        if acall is not None:
+            return await acall(prompt)
+        return await super().agenerate(model, prompt, settings)
+
+
+BACKENDS: Dict[str, LLMBackend] = {"gemini": GeminiBackend()}
+# When set, every model is routed to this backend (e.g. "stub" for offline runs)
+backend_override: Optional[str] = os.getenv("LLM_BACKEND_OVERRIDE")
+_response_cache: Optional[ResponseCache] = None
+
+
+# --- Functions ---
+def get_response_cache() -> ResponseCache:
+    """Returns the process-wide response cache, opening it on first use."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache(cache_path, max_entries=cache_max_entries, max_bytes=cache_max_bytes,
+                                        max_age_seconds=cache_max_age_seconds)
+    return _response_cache
+
+
+def set_cache_bypass(bypass: bool) -> None:
+    global cache_bypass
+    cache_bypass = bypass
+
+
+def cache_stats() -> dict:
+    return get_response_cache().stats() if _response_cache is not None else {"hits": 0, "misses": 0}
+
+
+def load_model_registry(config_path: str) -> None:
+    """Adds/overrides model entries from a JSON file shaped like MODEL_REGISTRY."""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        MODEL_REGISTRY.update(json.load(f))
+
+
+def register_backend(name: str, backend: LLMBackend) -> None:
+    BACKENDS[name] = backend
+
+
+def set_backend_override(name: Optional[str]) -> None:
+    """Routes every model to backend `name`, or back to each model's own backend with None."""
+    global backend_override
+    if name is not None and name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {name}")
+    backend_override = name
+
+
+def resolve_model(model_name: str) -> tuple[str, LLMBackend, dict]:
+    """Returns the backend name, backend and registry entry for a model name."""
+    config = MODEL_REGISTRY.get(model_name)
+    if config is None:
+        raise ValueError(f"Unknown model: {model_name}. Known models: {', '.join(MODEL_REGISTRY)}")
+    backend_name = backend_override or config.get("backend", "gemini")
+    if backend_name not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {backend_name}")
+    return backend_name, BACKENDS[backend_name], config
+
+
+def _cache_lookup(backend_name: str, model: str, prompt: str, settings: dict, use_cache: bool) -> tuple[Optional[str], Optional[str]]:
+    """Returns (cache_key, cached_response); the key is None when caching is off for this call."""
+    if not use_cache or cache_bypass:
+        return None, None
+    key = ResponseCache.make_key(backend_name, model, prompt, settings)
+    return key, get_response_cache().get(key)
+
+
+def _cache_store(key: Optional[str], model: str, response_text: str) -> None:
+    # Empty answers are not worth keeping, the next run should ask again
+    if key is not None and response_text != "Error: No response text generated":
+        get_response_cache().set(key, model, response_text)
+
+
+def json_output_settings(schema=None) -> dict:
+    """
+    Generation settings for structured output: the model answers with JSON only, constrained to `schema`
+    (a pydantic model class, or e.g. list[Model]) when given.
+    """
+    settings = {"response_mime_type": "application/json"}
+    if schema is not None:
+        settings["response_schema"] = schema
+    return settings
+
+
+def _call_settings(config: dict, settings: Optional[dict]) -> dict:
+    """The model's registry settings, updated with the per-call settings."""
+    if not settings:
+        return config.get("settings", {})
+    return {**config.get("settings", {}), **settings}
+
+
+def generate(prompt: str, model_name: str = DEFAULT_MODEL, use_cache: bool = True, settings: Optional[dict] = None) -> str:
+    """
+    Sends a prompt to a registered model and returns the response text (served from the cache when possible).
+    `settings` are added to the model's registry settings for this call (see json_output_settings).
+    """
+    backend_name, backend, config = resolve_model(model_name)
+    model, settings = config.get("model", model_name), _call_settings(config, settings)
+    key, cached = _cache_lookup(backend_name, model, prompt, settings, use_cache)
+    call = telemetry.start_llm_call(model_name, backend_name, prompt, config.get("prices"))
+    if cached is not None:
+        telemetry.end_llm_call(call, cached, cached=True)
+        return cached
+    try:
+        response_text = backend.generate(model, prompt, settings)
+    except Exception as e:
+        telemetry.end_llm_call(call, None, error=e)
+        raise
+    telemetry.end_llm_call(call, response_text)
+    _cache_store(key, model, response_text)
+    return response_text
+
+
+async def agenerate(prompt: str, model_name: str = DEFAULT_MODEL, use_cache: bool = True,
+                    settings: Optional[dict] = None) -> str:
+    """Async version of `generate`."""
+    backend_name, backend, config = resolve_model(model_name)
+    model, settings = config.get("model", model_name), _call_settings(config, settings)
+    key, cached = _cache_lookup(backend_name, model, prompt, settings, use_cache)
+    call = telemetry.start_llm_call(model_name, backend_name, prompt, config.get("prices"))
+    if cached is not None:
+        telemetry.end_llm_call(call, cached, cached=True)
+        return cached
+    try:
+        response_text = await backend.agenerate(model, prompt, settings)
+    except Exception as e:
+        telemetry.end_llm_call(call, None, error=e)
+        raise
+    telemetry.end_llm_call(call, response_text)
+    _cache_store(key, model, response_text)
+    return response_text
+
+
+def get_gemini_response(prompt: str) -> str:
     """
     Sends a prompt to the Gemini model and returns the response.
     """
-    load_dotenv()
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    return generate(prompt, "gemini-2.5-flash")
 
-    client = genai.Client(api_key=api_key)
 
-    response = client.models.generate_content(
-    model='gemini-1.5-flash-8b',
-    contents=prompt)
-    
-    if response.text is None:
-        return "Error: No response text generated"
-    
-    return response.text
+async def aget_gemini_response(prompt: str) -> str:
+    """
+    Async version of get_gemini_response.
+    """
+    return await agenerate(prompt, "gemini-2.5-flash")
 
 
-def gemini_2_5_flash_lite_preview_reponse(prompt:str ) -> str:
+def gemini_1_5_flash_8b_reponse(prompt: str) -> str:
     """
     Sends a prompt to the Gemini model and returns the response.
     """
-    load_dotenv()
-    api_key = os.getenv('GEMINI_API_KEY')
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    return generate(prompt, "gemini-1.5-flash-8b")
 
-    client = genai.Client(api_key=api_key)
 
-    response = client.models.generate_content(
-    model='gemini-2.5-flash-lite-preview-06-17',
-    contents=prompt)
-    
-    if response.text is None:
-        return "Error: No response text generated"
-    
-    return response.text
+def gemini_2_5_flash_lite_preview_reponse(prompt: str) -> str:
+    """
+    Sends a prompt to the Gemini model and returns the response.
+    """
+    return generate(prompt, "gemini-2.5-flash-lite")
 
 
+register_backend("stub", StubBackend())
+if os.getenv("LLM_MODELS_CONFIG"):
+    load_model_registry(os.environ["LLM_MODELS_CONFIG"])
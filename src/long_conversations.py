@@ -0,0 +1,150 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from main import ConversationInfo, extract_conversation, extract_conversation_async, failed_extraction
+from normalization import normalize_number, normalize_text, number_token_regex
+from rate_limiter import RateLimiter, estimate_tokens
+
+# --- Configuration (chunking)---
+# Transcripts above this many estimated tokens are extracted in chunks (main.use_long_conversation_mode)
+long_conversation_tokens = 3000
+# Max estimated tokens per chunk; chunks end on a turn (line) boundary, a single longer turn is a chunk of its own
+chunk_token_budget = 1500
+# Turns repeated at the start of the next chunk, so a question and its answer are seen together
+chunk_overlap_turns = 3
+# Chunks of one conversation extracted at the same time (sync mode, the async mode shares main's semaphore)
+chunk_concurrency = 8
+
+# --- Configuration (merge)---
+# Chunk i (0-based) votes for its Positive/Negative satisfaction with weight i + 1, so the end of the chat counts most.
+# A Neutral chunk mostly means "no sign of either" (e.g. a middle part) and does not vote.
+satisfaction_levels = {"Negative", "Positive"}
+
+
+# --- Functions ---
+def is_long(message: dict) -> bool:
+    """True for a whole (not already chunked) conversation above `long_conversation_tokens`."""
+    return "chunk" not in message and estimate_tokens(message.get("transcript") or "") > long_conversation_tokens
+
+
+def chunk_transcript(transcript: str, budget: int = chunk_token_budget, overlap: int = chunk_overlap_turns) -> List[str]:
+    """Splits a transcript into turn-aligned chunks of at most `budget` estimated tokens, overlapping by `overlap` turns."""
+    turns = [turn for turn in transcript.splitlines() if turn.strip()]
+    turn_tokens = [estimate_tokens(turn) for turn in turns]
+    chunks, start = [], 0
+    while start < len(turns):
+        end, used = start, 0
+        while end < len(turns) and (end == start or used + turn_tokens[end] <= budget):
+            used += turn_tokens[end]
+            end += 1
+        chunks.append("\n".join(turns[start:end]))
+        if end == len(turns):
+            break
+        # Step back for the overlap, but always move forward
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def chunk_messages(message: dict) -> List[dict]:
+    """The conversation as one message per chunk (same metadata), each marked with its position."""
+    chunks = chunk_transcript(message.get("transcript") or "")
+    return [{
+        **message,
+        "transcript": f"system: [Part {index + 1} of {len(chunks)} of a long conversation, the other parts are sent separately. "
+                      f"Extract what this part mentions.]\n{chunk}",
+        "chunk": {"index": index, "count": len(chunks)},
+    } for index, chunk in enumerate(chunks)]
+
+
+def _most_common_latest(values: List[Optional[str]]) -> Optional[str]:
+    """Most frequent non-empty value (compared normalized), ties go to the one seen last."""
+    counts, latest = {}, {}
+    for position, value in enumerate(values):
+        key = normalize_text(value)
+        if key:
+            counts[key] = counts.get(key, 0) + 1
+            latest[key] = (position, value)
+    if not counts:
+        return None
+    best = max(counts, key=lambda key: (counts[key], latest[key][0]))
+    return latest[best][1]
+
+
+def merge_satisfaction(labels: List[Optional[str]]) -> str:
+    """Later-weighted vote of the chunks' satisfaction (in chunk order), ties go to the later chunk. Neutral when no chunk votes."""
+    totals, latest = {}, {}
+    for index, label in enumerate(labels):
+        if label not in satisfaction_levels:
+            continue
+        totals[label] = totals.get(label, 0) + index + 1
+        latest[label] = index
+    if not totals:
+        return "Neutral"
+    return max(totals, key=lambda label: (totals[label], latest[label]))
+
+
+def merge_extractions(conversation_id: str, partials: List[dict]) -> dict:
+    """
+    Merges the chunk extractions (in chunk order) into one ConversationInfo record, deterministically:
+    union of products and of order/case numbers (first mention order, duplicates compared normalized),
+    most frequent store/category/service (ties: the later chunk) and the later-weighted satisfaction vote.
+    """
+    products, seen_products = [], set()
+    numbers, seen_numbers = [], set()
+    for partial in partials:
+        for product in partial.get("products") or []:
+            if normalize_text(product) and normalize_text(product) not in seen_products:
+                seen_products.add(normalize_text(product))
+                products.append(product)
+        # The number tokens of split_numbers, kept as written ("Order number: 471 212 321, 456" -> "471 212 321", "456")
+        for number in number_token_regex.findall(str(partial.get("case_or_order_number") or "")):
+            if normalize_number(number) not in seen_numbers:
+                seen_numbers.add(normalize_number(number))
+                numbers.append(number)
+    return {
+        "conversation_id": str(conversation_id),
+        "products": products,
+        "store_location": _most_common_latest([partial.get("store_location") for partial in partials]),
+        "product_category": _most_common_latest([partial.get("product_category") for partial in partials]),
+        "service_rendered": _most_common_latest([partial.get("service_rendered") for partial in partials]),
+        "customer_satisfaction": merge_satisfaction([partial.get("customer_satisfaction") for partial in partials]),
+        "case_or_order_number": " or ".join(numbers) or None,
+    }
+
+
+def reduce_chunks(message: dict, results: List[tuple[bool, dict]]) -> tuple[bool, dict]:
+    """
+    Merges the chunk results of a conversation. A failed chunk fails the whole conversation (its products or
+    numbers would be missing), so a resumed run redoes it; the chunks that succeeded come from the LLM cache.
+    """
+    conversation_id = message.get("metadata", {}).get("conversation_id")
+    for index, (succeeded, record) in enumerate(results):
+        if not succeeded:
+            record["error_message"] = f"Chunk {index + 1} of {len(results)}: {record.get('error_message')}"
+            record["original_transcript"] = message.get("transcript")
+            return False, record
+    merged = merge_extractions(conversation_id, [record for _, record in results])
+    try:
+        ConversationInfo(**merged)
+    except Exception as e:
+        return False, failed_extraction(message, str(merged), "VALIDATION_ERROR", e)
+    print(f"Merged {len(results)} chunks of conversation {conversation_id}")
+    return True, merged
+
+
+def extract_long_conversation(message: dict, llm_fn: Callable[[str], str]) -> tuple[bool, dict]:
+    """Map-reduce version of main.extract_conversation: the chunks are extracted in parallel threads, then merged."""
+    chunks = chunk_messages(message)
+    with ThreadPoolExecutor(max_workers=min(chunk_concurrency, len(chunks))) as pool:
+        results = list(pool.map(lambda chunk: extract_conversation(chunk, llm_fn), chunks))
+    return reduce_chunks(message, results)
+
+
+async def extract_long_conversation_async(message: dict, llm_fn: Callable, semaphore: asyncio.Semaphore,
+                                          rate_limiter: Optional[RateLimiter] = None) -> tuple[bool, dict]:
+    """Async version of extract_long_conversation, every chunk waits for main's concurrency slot and rate limiter."""
+    results = await asyncio.gather(*(
+        extract_conversation_async(chunk, llm_fn, semaphore, rate_limiter) for chunk in chunk_messages(message)
+    ))
+    return reduce_chunks(message, list(results))
+
@@ -1,35 +1,55 @@
+import asyncio
 import json
-from typing import List, Optional
+import os
+from typing import Callable, Iterator, List, Optional, TextIO
 from pydantic import BaseModel, Field
-from llm_models import get_gemini_response, gemini_1_5_flash_8b_reponse
+from llm_models import generate, agenerate, json_output_settings
+from json_repair import parse_llm_json
+# The JSON/JSONL helpers live in json_io (no pydantic/genai imports), re-exported here for the extraction scripts
+from json_io import (load_json_data, iter_json_array, iter_json_records, load_completed_ids, open_for_append, append_jsonl,
+                     save_json_file)
+from rate_limiter import RateLimiter, estimate_tokens
+import telemetry
 
 
 # --- Configuration (path)---
-json_file_path = "src/data/transformed_oscar_data.json"
+json_file_path = "src/data/transformed_oscar_data.jsonl"
 output_path = "src/data/test_data_gemini_2.5_flash.json"
 failed_validation_output_path = "src/data/llm_output_data/failed_conversations.json"
 
+# Streaming/checkpointed output, results are appended as they complete and a rerun resumes
+stream_output = True
+output_jsonl_path = "src/data/test_data_gemini_2.5_flash.jsonl"
+failed_validation_output_jsonl_path = "src/data/llm_output_data/failed_conversations.jsonl"
+resume = True
 
-# --- Functions ---
-def load_json_data(file_path: str):
-    """
-    Loads data from the JSON file.
-    """
-    print("Loading data...")
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            raw_data = json.load(f)
-            return raw_data
+# --- Configuration (async extraction)---
+use_async = False
+max_concurrency = 8
+requests_per_minute = 60
+tokens_per_minute = None
+
+# --- Configuration (model)---
+extraction_model = "gemini-2.5-flash"
+# Gemini structured output: the answer is constrained to the ConversationInfo schema (JSON only, no prose/fences)
+use_structured_output = True
 
-    except FileNotFoundError:
-        # Raise a proper Exception object, not a string
-        raise Exception(f"Error: The file at {file_path} was not found.")
-        
-    except json.JSONDecodeError:
-        # Raise a proper Exception object, not a string
-        raise Exception(f"Error: The file at {file_path} is not a valid JSON file.")
+# --- Configuration (few-shot retrieval)---
+# Add the most similar labelled examples of example_index.py (build it first) to every extraction prompt
+use_few_shot = False
+few_shot_k = 2
+few_shot_index_dir = "src/data/index"
+# Max estimated tokens per example transcript in the prompt
+few_shot_token_budget = 600
+_example_index = None
 
+# --- Configuration (long conversations)---
+# Split transcripts above long_conversations.long_conversation_tokens into overlapping chunks,
+# extract them in parallel and merge the results into one ConversationInfo
+use_long_conversation_mode = False
 
+
+# --- Functions ---
 class ConversationInfo(BaseModel):
     """Data model for extracted information from a conversation."""
 
@@ -42,10 +62,11 @@ class ConversationInfo(BaseModel):
     case_or_order_number: Optional[str] = Field(None, description="Any mentioned order or case numbers.")
     
 
-def prompt(transcript: str, metadata: dict) -> str:
+def prompt(transcript: str, metadata: dict, few_shot: str = "") -> str:
     query = f"""
         You are an expert data analyst. Your task is to carefully read the following customer support conversation
         and extract specific pieces of information. 
+        {few_shot}
 
         Conversation Transcript:
         ---
@@ -72,17 +93,98 @@ def prompt(transcript: str, metadata: dict) -> str:
     return query
 
 
-def save_json_file(extracted_info: List[dict], output_path: str) -> None:
-    """Saves json file"""
+def few_shot_block(transcript: Optional[str]) -> str:
+    """The `few_shot_k` most similar labelled examples formatted for the prompt, '' when few-shot is off."""
+    global _example_index
+    if not use_few_shot or not transcript:
+        return ""
+    # numpy and the index are only loaded when few-shot prompts are used
+    from example_index import ExampleIndex, example_key, format_examples
+    if _example_index is None:
+        _example_index = ExampleIndex(few_shot_index_dir)
+    # The conversation itself can be in the index (answer sheet), never show it its own answer
+    examples = _example_index.search(transcript, few_shot_k, exclude_keys={example_key(transcript)})
+    return format_examples([example for _, example in examples], few_shot_token_budget)
+
+
+def build_prompt(message: dict) -> str:
+    transcript = message.get("transcript")
+    return prompt(transcript, message.get("metadata"), few_shot_block(transcript))
+
+
+def extraction_settings() -> Optional[dict]:
+    return json_output_settings(ConversationInfo) if use_structured_output else None
+
+
+def get_extraction_response(prompt: str) -> str:
+    """Sends an extraction prompt to `extraction_model` (with structured output when enabled)."""
+    return generate(prompt, extraction_model, settings=extraction_settings())
+
+
+async def aget_extraction_response(prompt: str) -> str:
+    """Async version of get_extraction_response."""
+    return await agenerate(prompt, extraction_model, settings=extraction_settings())
+
+
+def failed_extraction(message: dict, response_text: str, error_type: str, error: Exception) -> dict:
+    """Builds the debug record saved to failed_conversations.json (and counts the failure in the telemetry)."""
+    conversation_id = message.get("metadata", {}).get("conversation_id")
+    telemetry.record_failure("extract", error_type, conversation_id)
+    return {
+        "conversation_id": conversation_id,
+        "original_transcript": message.get("transcript"),
+        "original_metadata": message.get("metadata"),
+        "llm_response": response_text,
+        "error_type": error_type,
+        "error_message": str(error)
+    }
+
+
+def parse_extraction(message: dict, response_text: str) -> tuple[bool, dict]:
+    """Cleans, parses and validates one LLM response.
+
+    Returns:
+        tuple: (succeeded, extracted_info or failed extraction record)
+    """
+    conversation_id = message.get("metadata", {}).get("conversation_id")
+    try:
+        # Parse the json output from llm, small syntax errors are repaired locally instead of asking again
+        json_response = parse_llm_json(response_text)
+
+        # Validate the data using the Pydantic model
+        extracted_info = ConversationInfo(**json_response)
+        print(f"Successfully processed conversation: {extracted_info.conversation_id}")
+        return True, json_response
+
+    except (json.JSONDecodeError, TypeError) as e:
+        print(f"Could not parse LLM response for conversation {conversation_id}. Raw response was: {response_text}")
+        return False, failed_extraction(message, response_text, "JSON_DECODE_ERROR", e)
+    except Exception as e:
+        print(f"An unexpected error occurred for conversation {conversation_id}: {e}")
+        return False, failed_extraction(message, response_text, "VALIDATION_ERROR", e)
+
+
+def extract_conversation(message: dict, llm_fn: Callable[[str], str] = get_extraction_response) -> tuple[bool, dict]:
+    """Sends one transformed conversation to the LLM and parses the answer.
+
+    Returns:
+        tuple: (succeeded, extracted_info or failed extraction record)
+    """
+    conversation_id = message.get("metadata", {}).get("conversation_id")
+    if use_long_conversation_mode:
+        import long_conversations
+        if long_conversations.is_long(message):
+            return long_conversations.extract_long_conversation(message, llm_fn)
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(extracted_info, f, indent=4)
-        print(f"Successfully saved extracted info to {output_path}")
-    except IOError as e:
-        print(f"Error writing to {output_path}: {e}")
+        response_text = llm_fn(build_prompt(message))
+    except Exception as e:
+        print(f"An unexpected error occurred for conversation {conversation_id}: {e}")
+        return False, failed_extraction(message, "N/A", "VALIDATION_ERROR", e)
 
+    return parse_extraction(message, response_text)
 
-def format_conversation(json_file_path: str) -> tuple[List[dict], List[dict]]:
+
+def format_conversation(json_file_path: str, llm_fn: Callable[[str], str] = get_extraction_response) -> tuple[List[dict], List[dict]]:
     """Processes all conversations and extracts information from each.
     
     Returns:
@@ -93,54 +195,190 @@ def format_conversation(json_file_path: str) -> tuple[List[dict], List[dict]]:
     all_extracted_info = []
     failed_extractions = []
 
-    for message in transformed_json_data:
-        transcript = message.get("transcript")
-        metadata = message.get("metadata")
-        conversation_id = message.get("metadata", {}).get("conversation_id")
+    with telemetry.stage("extract") as stage:
+        for message in transformed_json_data:
+            succeeded, record = extract_conversation(message, llm_fn)
+            if succeeded:
+                all_extracted_info.append(record)
+            else:
+                failed_extractions.append(record)
+        stage["items"] = len(transformed_json_data)
+    
+    return all_extracted_info, failed_extractions
+
 
+async def extract_conversation_async(message: dict, llm_fn: Callable, semaphore: asyncio.Semaphore,
+                                     rate_limiter: Optional[RateLimiter] = None) -> tuple[bool, dict]:
+    """Extracts one conversation, waiting for a concurrency slot and the rate limiter first.
+
+    `llm_fn` can be a coroutine function or a plain blocking function (run in a worker thread).
+    """
+    conversation_id = message.get("metadata", {}).get("conversation_id")
+    if use_long_conversation_mode:
+        import long_conversations
+        if long_conversations.is_long(message):
+            return await long_conversations.extract_long_conversation_async(message, llm_fn, semaphore, rate_limiter)
+    query = build_prompt(message)
+
+    async with semaphore:
+        if rate_limiter:
+            await rate_limiter.acquire(estimate_tokens(query))
         try:
-            response_text = get_gemini_response(prompt(transcript, metadata))
-            
-            # Cleaning the json output from llm and parse it.
-            cleaned_json_response = response_text.strip().replace("```json", "").replace("```", "").strip()
-            json_response = json.loads(cleaned_json_response)
-            
-            # Validate the data using the Pydantic model
-            extracted_info = ConversationInfo(**json_response)
-            all_extracted_info.append(json_response)
-            print(f"Successfully processed conversation: {extracted_info.conversation_id}")
-
-        except (json.JSONDecodeError, TypeError) as e:
-            error_info = {
-                "conversation_id": conversation_id,
-                "original_transcript": transcript,
-                "original_metadata": metadata,
-                "llm_response": response_text,
-                "error_type": "JSON_DECODE_ERROR",
-                "error_message": str(e)
-            }
-            failed_extractions.append(error_info)
-            print(f"Could not parse LLM response for conversation {conversation_id}. Raw response was: {response_text}")
-            continue
+            if asyncio.iscoroutinefunction(llm_fn):
+                response_text = await llm_fn(query)
+            else:
+                response_text = await asyncio.to_thread(llm_fn, query)
         except Exception as e:
-            error_info = {
-                "conversation_id": conversation_id,
-                "original_transcript": transcript,
-                "original_metadata": metadata,
-                "llm_response": response_text if 'response_text' in locals() else "N/A",
-                "error_type": "VALIDATION_ERROR",
-                "error_message": str(e)
-            }
-            failed_extractions.append(error_info)
             print(f"An unexpected error occurred for conversation {conversation_id}: {e}")
-            continue
-    
+            return False, failed_extraction(message, "N/A", "VALIDATION_ERROR", e)
+
+    return parse_extraction(message, response_text)
+
+
+async def format_conversation_async(json_file_path: str, llm_fn: Callable = aget_extraction_response,
+                                    max_concurrency: int = 8,
+                                    requests_per_minute: Optional[float] = None,
+                                    tokens_per_minute: Optional[float] = None) -> tuple[List[dict], List[dict]]:
+    """Concurrent version of format_conversation.
+
+    Runs up to `max_concurrency` LLM calls at a time, paced by a token-bucket limiter
+    on requests and (estimated prompt) tokens per minute. Results keep the input order.
+
+    Returns:
+        tuple: (successful_extractions, failed_extractions)
+    """
+    transformed_json_data = load_json_data(json_file_path)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    rate_limiter = None
+    if requests_per_minute or tokens_per_minute:
+        rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    with telemetry.stage("extract") as stage:
+        results = await asyncio.gather(*(
+            extract_conversation_async(message, llm_fn, semaphore, rate_limiter)
+            for message in transformed_json_data
+        ))
+        stage["items"] = len(results)
+
+    all_extracted_info = [record for succeeded, record in results if succeeded]
+    failed_extractions = [record for succeeded, record in results if not succeeded]
     return all_extracted_info, failed_extractions
 
 
-if __name__ == "__main__":
+def _pending_conversations(json_file_path: str, completed_ids: set) -> Iterator[dict]:
+    for message in iter_json_records(json_file_path):
+        conversation_id = message.get("metadata", {}).get("conversation_id")
+        if str(conversation_id) in completed_ids:
+            continue
+        yield message
+
+
+def _open_checkpoint_files(output_path: str, failed_output_path: str, resume: bool) -> tuple[set, TextIO, TextIO]:
+    for path in (output_path, failed_output_path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Only successful extractions count as done, failures are retried on resume
+    completed_ids = load_completed_ids(output_path) if resume else set()
+    if completed_ids:
+        print(f"Resuming: skipping {len(completed_ids)} already extracted conversations.")
+    output_file = open_for_append(output_path) if resume else open(output_path, 'w', encoding='utf-8')
+    # Every failure is retried, so the failed file is rewritten: it lists the failures of the latest run only
+    # (no duplicates, no stale entries for conversations that succeeded later)
+    return completed_ids, output_file, open(failed_output_path, 'w', encoding='utf-8')
+
+
+def extract_to_jsonl(json_file_path: str, output_path: str, failed_output_path: str,
+                     llm_fn: Callable[[str], str] = get_extraction_response, resume: bool = True) -> tuple[int, int]:
+    """Streaming, resumable version of format_conversation.
+
+    Every result is appended to `output_path` (successes) or `failed_output_path` (failures) as JSONL
+    as soon as it is done, nothing is kept in memory. With `resume`, conversation_ids already in
+    `output_path` are skipped, so a restarted run continues where the last one stopped.
+
+    Returns:
+        tuple: (number of successful extractions, number of failed extractions) in this run
+    """
+    completed_ids, output_file, failed_file = _open_checkpoint_files(output_path, failed_output_path, resume)
+    succeeded_count, failed_count = 0, 0
+    with output_file, failed_file, telemetry.stage("extract") as stage:
+        for message in _pending_conversations(json_file_path, completed_ids):
+            succeeded, record = extract_conversation(message, llm_fn)
+            if succeeded:
+                append_jsonl(record, output_file)
+                succeeded_count += 1
+            else:
+                append_jsonl(record, failed_file)
+                failed_count += 1
+        stage["items"] = succeeded_count + failed_count
+    return succeeded_count, failed_count
+
+
+async def extract_to_jsonl_async(json_file_path: str, output_path: str, failed_output_path: str,
+                                 llm_fn: Callable = aget_extraction_response, resume: bool = True,
+                                 max_concurrency: int = 8,
+                                 requests_per_minute: Optional[float] = None,
+                                 tokens_per_minute: Optional[float] = None) -> tuple[int, int]:
+    """Concurrent version of extract_to_jsonl.
+
+    Reads the input lazily and keeps at most `max_concurrency` conversations in flight, so memory stays
+    flat. Results are appended in completion order (not input order).
+
+    Returns:
+        tuple: (number of successful extractions, number of failed extractions) in this run
+    """
+    completed_ids, output_file, failed_file = _open_checkpoint_files(output_path, failed_output_path, resume)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    rate_limiter = None
+    if requests_per_minute or tokens_per_minute:
+        rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    counts = [0, 0]
+
+    def write_finished(finished: set) -> None:
+        for task in finished:
+            succeeded, record = task.result()
+            append_jsonl(record, output_file if succeeded else failed_file)
+            counts[0 if succeeded else 1] += 1
+
+    with output_file, failed_file, telemetry.stage("extract") as stage:
+        pending = set()
+        for message in _pending_conversations(json_file_path, completed_ids):
+            if len(pending) >= max_concurrency:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                write_finished(finished)
+            pending.add(asyncio.create_task(extract_conversation_async(message, llm_fn, semaphore, rate_limiter)))
+        if pending:
+            finished, _ = await asyncio.wait(pending)
+            write_finished(finished)
+        stage["items"] = counts[0] + counts[1]
+
+    return counts[0], counts[1]
+
+
+if __name__ == "__main__" and stream_output:
+    if use_async:
+        succeeded_count, failed_count = asyncio.run(extract_to_jsonl_async(
+            json_file_path, output_jsonl_path, failed_validation_output_jsonl_path,
+            resume=resume,
+            max_concurrency=max_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute))
+    else:
+        succeeded_count, failed_count = extract_to_jsonl(
+            json_file_path, output_jsonl_path, failed_validation_output_jsonl_path, resume=resume)
+    print(f"Extracted {succeeded_count} conversations to {output_jsonl_path}, "
+          f"{failed_count} failed (see {failed_validation_output_jsonl_path}).")
+    telemetry.report()
+
+elif __name__ == "__main__":
     # Process the conversations and extract information
-    extracted_data, failed_data = format_conversation(json_file_path)
+    if use_async:
+        extracted_data, failed_data = asyncio.run(format_conversation_async(
+            json_file_path,
+            max_concurrency=max_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute))
+    else:
+        extracted_data, failed_data = format_conversation(json_file_path)
     
     # Save the extracted information
     if extracted_data:
@@ -154,4 +392,6 @@ if __name__ == "__main__":
         save_json_file(failed_data, failed_validation_output_path)
         print(f"Saved {len(failed_data)} failed conversations to {failed_validation_output_path}")
     else:
-        print("No failed conversations were found.")
\ No newline at end of file
+        print("No failed conversations were found.")
+    telemetry.report()
+
@@ -0,0 +1,260 @@
+import json
+import os
+import re
+import time
+from typing import Dict, List, Optional
+import telemetry
+from llm_models import MODEL_REGISTRY, generate
+from main import (build_prompt, extraction_settings, parse_extraction, failed_extraction, append_jsonl, iter_json_records,
+                  load_completed_ids, open_for_append, json_file_path, output_jsonl_path, failed_validation_output_jsonl_path, resume)
+from field_scorers import max_possible_score
+from normalization import split_numbers
+from pre_extractor import extract_case_or_order_numbers
+from rate_limiter import estimate_tokens
+
+# --- Configuration (path)---
+# Model that answered each conversation and why cheaper models were passed over
+tiers_path = "src/data/cascade/cascade_tiers.jsonl"
+report_path = "src/data/cascade/cascade_report.json"
+
+# --- Configuration (cascade)---
+# Models tried in order, cheapest first (names in llm_models.MODEL_REGISTRY)
+cascade_models = ["gemini-1.5-flash-8b", "gemini-2.5-flash-lite", "gemini-2.5-flash"]
+# Besides unparseable and invalid answers, escalate answers that disagree with the rule-based pre-extraction
+escalate_on_inconsistency = True
+satisfaction_levels = {"Positive", "Neutral", "Negative"}
+# Answer size assumed for the strongest-model-only baseline until a run has parsed answers to average
+baseline_output_tokens = 120
+
+number_separator_regex = re.compile(r"[\s.\-#]")
+
+
+# --- Functions ---
+def consistency_problems(message: dict, record: dict) -> List[str]:
+    """
+    Fields of a valid answer that contradict the transcript or the high-precision number rule of pre_extractor.py:
+    a wrong conversation_id or satisfaction level, and order/case numbers that are not in the transcript or
+    that the answer missed. Products and stores are not checked: their rules can miss or misread a mention,
+    and a false alarm would send a correct answer to the most expensive model.
+    """
+    transcript = message.get("transcript") or ""
+    problems = []
+    if str(record.get("conversation_id")) != str(message.get("metadata", {}).get("conversation_id")):
+        problems.append("conversation_id")
+    if record.get("customer_satisfaction") not in satisfaction_levels:
+        problems.append("customer_satisfaction")
+
+    numbers = split_numbers(record.get("case_or_order_number"))
+    transcript_digits = number_separator_regex.sub("", transcript).upper()
+    if any(number not in transcript_digits for number in numbers):
+        problems.append("case_or_order_number_not_in_transcript")
+
+    if split_numbers(" or ".join(extract_case_or_order_numbers(transcript))) - numbers:
+        problems.append("case_or_order_number_missed")
+    return problems
+
+
+def estimated_cost(model_name: str, prompt: str, response_text: Optional[str]) -> float:
+    """USD cost of one call from the estimated tokens and the model's registry prices."""
+    prices = MODEL_REGISTRY.get(model_name, {}).get("prices", {})
+    output_tokens = estimate_tokens(response_text) if response_text else 0
+    return (estimate_tokens(prompt) * prices.get("input", 0.0) + output_tokens * prices.get("output", 0.0)) / 1_000_000
+
+
+class CascadeStats:
+    """Per-model attempts, accepted answers, escalation reasons, latency and estimated cost of a cascade run."""
+
+    def __init__(self, models: List[str]):
+        self.models = models
+        self.conversations = 0
+        self.failed = 0
+        self.attempts = {model: 0 for model in models}
+        self.accepted = {model: 0 for model in models}
+        self.escalations = {model: {} for model in models}
+        self.latencies = {model: [] for model in models}
+        self.cost = {model: 0.0 for model in models}
+        # Baseline (the same conversations with the last, strongest model only): its input cost for every prompt,
+        # the output cost is added in report() from the average answer size
+        self.single_model_input_cost = 0.0
+        self.answer_tokens = 0
+        self.answers = 0
+
+    def record_call(self, model: str, seconds: float, cost: float) -> None:
+        self.attempts[model] += 1
+        self.latencies[model].append(seconds)
+        self.cost[model] += cost
+
+    def record_answer(self, response_text: str) -> None:
+        self.answer_tokens += estimate_tokens(response_text)
+        self.answers += 1
+
+    def single_model_cost(self) -> float:
+        """
+        Estimated cost of the strongest model only: every prompt once at its input price, plus one answer per
+        conversation of the average size of this run's parsed answers (`baseline_output_tokens` without any).
+        """
+        prices = MODEL_REGISTRY.get(self.models[-1], {}).get("prices", {})
+        average_output = self.answer_tokens / self.answers if self.answers else baseline_output_tokens
+        return self.single_model_input_cost + self.conversations * average_output * prices.get("output", 0.0) / 1_000_000
+
+    def record_escalation(self, model: str, reason: str) -> None:
+        self.escalations[model][reason] = self.escalations[model].get(reason, 0) + 1
+
+    def report(self) -> dict:
+        tiers = {}
+        for model in self.models:
+            latencies = sorted(self.latencies[model])
+            tiers[model] = {
+                "attempts": self.attempts[model],
+                "accepted": self.accepted[model],
+                # Share of all conversations answered by this model, and of the ones that reached it
+                "hit_rate": round(self.accepted[model] / self.conversations, 4) if self.conversations else 0.0,
+                "acceptance_rate": round(self.accepted[model] / self.attempts[model], 4) if self.attempts[model] else 0.0,
+                "escalations": self.escalations[model],
+                "latency_p50_s": round(latencies[len(latencies) // 2], 4) if latencies else None,
+                "latency_p95_s": round(latencies[int(len(latencies) * 0.95)], 4) if latencies else None,
+                "cost_usd": round(self.cost[model], 6),
+            }
+        total_cost = sum(self.cost.values())
+        single_model_cost = self.single_model_cost()
+        return {
+            "conversations": self.conversations,
+            "failed": self.failed,
+            "tiers": tiers,
+            "cost_usd": round(total_cost, 6),
+            f"cost_usd_{self.models[-1]}_only": round(single_model_cost, 6),
+            "cost_saved_ratio": round(1 - total_cost / single_model_cost, 4) if single_model_cost else 0.0,
+        }
+
+
+def extract_with_cascade(message: dict, stats: CascadeStats, models: Optional[List[str]] = None) -> tuple[bool, dict, Optional[str], dict]:
+    """
+    Sends the conversation to each model in turn, cheapest first, until one gives a valid and consistent answer.
+    When no model does, the last valid (but inconsistent) answer is kept, else the last failure.
+
+    Returns:
+        tuple: (succeeded, extracted_info or failed extraction record, model that answered, escalation reasons per model)
+    """
+    models = models or stats.models
+    conversation_id = message.get("metadata", {}).get("conversation_id")
+    query = build_prompt(message)
+    settings = extraction_settings()
+    stats.conversations += 1
+    escalations = {}
+    fallback, result, response_text = None, None, None
+
+    for position, model in enumerate(models):
+        start = time.perf_counter()
+        try:
+            response_text = generate(query, model, settings=settings)
+        except Exception as e:
+            print(f"An unexpected error occurred for conversation {conversation_id} with {model}: {e}")
+            stats.record_call(model, time.perf_counter() - start, 0.0)
+            result, reasons = (False, failed_extraction(message, "N/A", "VALIDATION_ERROR", e), None), ["llm_error"]
+        else:
+            stats.record_call(model, time.perf_counter() - start, estimated_cost(model, query, response_text))
+            succeeded, record = parse_extraction(message, response_text)
+            if succeeded:
+                stats.record_answer(response_text)
+            if not succeeded:
+                result, reasons = (False, record, None), [record["error_type"].lower()]
+            else:
+                reasons = consistency_problems(message, record) if escalate_on_inconsistency else []
+                result = (True, record, model)
+                if not reasons:
+                    break
+                fallback = result
+
+        if position < len(models) - 1:
+            escalations[model] = reasons
+            for reason in reasons:
+                stats.record_escalation(model, reason)
+            print(f"Escalating conversation {conversation_id} from {model}: {', '.join(reasons)}")
+    else:
+        result = fallback or result
+
+    # Baseline: the same prompt with the strongest model only (output cost: see CascadeStats.single_model_cost)
+    stats.single_model_input_cost += estimated_cost(models[-1], query, None)
+    succeeded, record, model = result
+    if succeeded:
+        stats.accepted[model] += 1
+    else:
+        stats.failed += 1
+    return succeeded, record, model, escalations
+
+
+def cascade_to_jsonl(json_file_path: str = json_file_path, output_path: str = output_jsonl_path,
+                     failed_output_path: str = failed_validation_output_jsonl_path, tiers_path: str = tiers_path,
+                     models: Optional[List[str]] = None, resume: bool = resume) -> dict:
+    """
+    main.extract_to_jsonl with the model cascade: results are appended to the same JSONL outputs (and resumed
+    the same way), the answering model of every conversation to `tiers_path`. Returns the cascade report.
+    """
+    stats = CascadeStats(models or cascade_models)
+    for path in (output_path, failed_output_path, tiers_path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    completed_ids = load_completed_ids(output_path) if resume else set()
+    if completed_ids:
+        print(f"Resuming: skipping {len(completed_ids)} already extracted conversations.")
+    output_file = open_for_append(output_path) if resume else open(output_path, 'w', encoding='utf-8')
+    # Retried failures get a new tier line, the last line of a conversation wins (see accuracy_per_model)
+    tiers_file = open_for_append(tiers_path) if resume else open(tiers_path, 'w', encoding='utf-8')
+
+    # The failed file lists the failures of this run only, as in main.extract_to_jsonl
+    with output_file, open(failed_output_path, 'w', encoding='utf-8') as failed_file, tiers_file, \
+            telemetry.stage("extract") as stage:
+        for message in iter_json_records(json_file_path):
+            conversation_id = message.get("metadata", {}).get("conversation_id")
+            if str(conversation_id) in completed_ids:
+                continue
+            succeeded, record, model, escalations = extract_with_cascade(message, stats)
+            append_jsonl(record, output_file if succeeded else failed_file)
+            append_jsonl({"conversation_id": conversation_id, "model": model, "escalations": escalations}, tiers_file)
+        stage["items"] = stats.conversations
+    return stats.report()
+
+
+def save_report(report: dict, path: str = report_path) -> None:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Cascade report saved to {path}")
+
+
+def print_report(report: dict) -> None:
+    print(f"\nCascade over {report['conversations']} conversations ({report['failed']} failed):")
+    for model, tier in report["tiers"].items():
+        print(f"  {model:<24} hit rate {tier['hit_rate']:<7} acceptance {tier['acceptance_rate']:<7} "
+              f"p50 {tier['latency_p50_s']}s  cost ${tier['cost_usd']}  escalations {tier['escalations']}")
+    single_model_key = next(key for key in report if key.startswith("cost_usd_"))
+    print(f"  Estimated cost ${report['cost_usd']} vs ${report[single_model_key]} with {single_model_key[9:-5]} only "
+          f"({round(report['cost_saved_ratio'] * 100, 1)}% saved)")
+
+
+def accuracy_per_model(evaluation_path: str, tiers_path: str = tiers_path) -> Dict[str, dict]:
+    """
+    Splits evaluation_rag results (its output JSONL) by the model that answered each conversation,
+    to tune the cascade (models, escalation rules) against the accuracy of each tier.
+    """
+    model_by_id = {str(record["conversation_id"]): record["model"] for record in iter_json_records(tiers_path)}
+    results_by_model: Dict[str, list] = {}
+    for result in iter_json_records(evaluation_path):
+        model = model_by_id.get(str(result.get("conversation_id")), "unknown")
+        results_by_model.setdefault(model, []).append(result)
+
+    accuracy = {}
+    for model, results in results_by_model.items():
+        max_score = max_possible_score(results)
+        score = sum(result.get("total_score") or 0 for result in results)
+        accuracy[model] = {"conversations": len(results), "accuracy": round(score / max_score, 4) if max_score else 0.0}
+    print(f"Accuracy per cascade model: {accuracy}")
+    return accuracy
+
+
+if __name__ == "__main__":
+    cascade_report = cascade_to_jsonl()
+    print_report(cascade_report)
+    save_report(cascade_report)
+    telemetry.report()
@@ -0,0 +1,233 @@
+import hashlib
+import os
+import re
+import sys
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+import telemetry
+from main import iter_json_records, append_jsonl, output_jsonl_path
+from normalization import normalize_number
+from pre_extractor import known_stores, store_index
+from transcript_compaction import remove_boilerplate
+
+# --- Configuration (path)---
+input_path = "src/data/transformed_oscar_data.jsonl"
+# Input for main.py (point json_file_path to it): one conversation per cluster
+representatives_path = "src/data/dedup/representatives.jsonl"
+# {"conversation_id", "representative_id"} for every conversation that is not extracted itself
+members_path = "src/data/dedup/members.jsonl"
+# main.py output with a copy of the representative's result for every member
+expanded_output_path = "src/data/dedup/expanded_extractions.jsonl"
+
+# --- Configuration (MinHash/LSH)---
+# Estimated Jaccard similarity of the word shingles from which two transcripts count as duplicates
+similarity_threshold = 0.9
+num_permutations = 128
+shingle_size = 3
+# Only cluster transcripts whose customer/agent turns are identical after template removal (case and spacing aside):
+# near-duplicates then differ in system lines only (e.g. wait notices), so the copied answer fits every field.
+# Without it, one word ("a refund" / "a replacement") changes the answer while staying far above the threshold.
+require_identical_turns = True
+# Also require the same order/case numbers, uppercase (product) names and stores anywhere in the transcript
+require_same_key_tokens = True
+seed = 42
+
+token_regex = re.compile(r"[a-zåäöéü0-9]+")
+key_token_regex = re.compile(r"\d[\d.\- ]*\d|\b[A-ZÅÄÖ]{3,}\b")
+mersenne_prime = (1 << 31) - 1
+empty_hash = np.uint32(0xFFFFFFFF)
+
+
+# --- Functions ---
+def shingles(transcript: str, size: int = shingle_size) -> set:
+    """Word n-grams of the transcript without the template lines (wait notices, greetings) every chat shares."""
+    text = "\n".join(remove_boilerplate((transcript or "").splitlines()))
+    # The user type prefixes would make every transcript share shingles
+    words = token_regex.findall(re.sub(r"^\w+: ", "", text, flags=re.MULTILINE).lower())
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[index:index + size]) for index in range(len(words) - size + 1)}
+
+
+def key_tokens(transcript: str) -> str:
+    """Order/case numbers, uppercase names and known stores of the transcript, the part a near-duplicate must share exactly."""
+    text = "\n".join(remove_boilerplate((transcript or "").splitlines()))
+    # Numbers are compared without separators ('969. 691. 557' == '969691557')
+    tokens = {normalize_number(token) for token in key_token_regex.findall(text)}
+    tokens |= {known_stores[keyword] for _, _, keyword in store_index.find_all(text)}
+    return " ".join(sorted(tokens))
+
+
+def turns_digest(transcript: str) -> str:
+    """Digest of the customer/agent turns without the template lines, lowercased and with collapsed spacing."""
+    turns = [" ".join(line.lower().split()) for line in remove_boilerplate((transcript or "").splitlines())
+             if not line.startswith("system:")]
+    return hashlib.blake2b("\n".join(turns).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def cluster_key(transcript: str, identical_turns: bool = require_identical_turns,
+                same_key_tokens: bool = require_same_key_tokens) -> str:
+    """What two transcripts must share exactly to be clustered (part of every LSH band key)."""
+    parts = [turns_digest(transcript) if identical_turns else "", key_tokens(transcript) if same_key_tokens else ""]
+    return "\0".join(parts)
+
+
+def lsh_parameters(threshold: float, permutations: int) -> tuple[int, int]:
+    """
+    (bands, rows) with bands * rows == permutations whose S-curve 1 - (1 - s^rows)^bands
+    steps closest to `threshold`: pairs above it almost always share a band, pairs far below rarely do.
+    """
+    candidates = [(bands, permutations // bands) for bands in range(1, permutations + 1) if permutations % bands == 0]
+    return min(candidates, key=lambda parameters: abs((1 / parameters[0]) ** (1 / parameters[1]) - threshold))
+
+
+class MinHasher:
+    """MinHash signatures: the minimum of `permutations` universal hashes (a * x + b mod p) over the shingle hashes."""
+
+    def __init__(self, permutations: int = num_permutations, seed: Optional[int] = seed):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, mersenne_prime, permutations, dtype=np.uint64)
+        self.b = rng.integers(0, mersenne_prime, permutations, dtype=np.uint64)
+
+    def signature(self, shingle_set: set) -> np.ndarray:
+        if not shingle_set:
+            # Transcripts without content (e.g. disconnected in the queue) are all the same
+            return np.full(len(self.a), empty_hash, dtype=np.uint32)
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingle_set),
+                             dtype=np.uint64, count=len(shingle_set)) % np.uint64(mersenne_prime)
+        # a, x < 2^31, so a * x fits in 64 bits
+        permuted = (hashes[:, None] * self.a[None, :] % np.uint64(mersenne_prime) + self.b) % np.uint64(mersenne_prime)
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    """
+    Streaming near-duplicate clustering. Every transcript is compared (through the LSH bands) with the
+    cluster representatives seen so far only: it joins the most similar one above `threshold` or becomes
+    a new representative. Comparing with representatives instead of any member keeps clusters from drifting
+    (A ~ B ~ C while A !~ C), and only representatives are kept in memory.
+    """
+
+    def __init__(self, threshold: float = similarity_threshold, permutations: int = num_permutations,
+                 identical_turns: bool = require_identical_turns, same_key_tokens: bool = require_same_key_tokens):
+        self.threshold = threshold
+        self.identical_turns = identical_turns
+        self.same_key_tokens = same_key_tokens
+        self.bands, self.rows = lsh_parameters(threshold, permutations)
+        self.hasher = MinHasher(permutations)
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self.representative_ids: List[str] = []
+        self.signatures: List[np.ndarray] = []
+
+    def _band_keys(self, signature: np.ndarray, key: str) -> List[bytes]:
+        prefix = key.encode("utf-8") + b"\0"
+        return [prefix + signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, conversation_id: str, transcript: str) -> Optional[str]:
+        """Clusters one transcript. Returns the id of its representative, None if it is a new representative."""
+        signature = self.hasher.signature(shingles(transcript))
+        band_keys = self._band_keys(signature, cluster_key(transcript, self.identical_turns, self.same_key_tokens))
+        candidates = {index for band, band_key in enumerate(band_keys) for index in self.buckets[band].get(band_key, ())}
+        best, best_similarity = None, self.threshold
+        for index in candidates:
+            similarity = float(np.mean(self.signatures[index] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = index, similarity
+        if best is not None:
+            return self.representative_ids[best]
+
+        index = len(self.representative_ids)
+        self.representative_ids.append(str(conversation_id))
+        self.signatures.append(signature)
+        for band, band_key in enumerate(band_keys):
+            self.buckets[band].setdefault(band_key, []).append(index)
+        return None
+
+
+def conversation_id_of(message: dict) -> str:
+    return str(message.get("metadata", {}).get("conversation_id", message.get("conversation_id")))
+
+
+def cluster_conversations(messages: Iterable[dict], index: Optional[NearDuplicateIndex] = None) -> Iterator[tuple[dict, Optional[str]]]:
+    """Yields (conversation, representative_id or None if it is a representative itself) in input order."""
+    index = index or NearDuplicateIndex()
+    for message in messages:
+        yield message, index.add(conversation_id_of(message), message.get("transcript") or "")
+
+
+def dedup_jsonl(input_path: str = input_path, representatives_path: str = representatives_path,
+                members_path: str = members_path) -> dict:
+    """
+    Splits a transformed JSONL/JSON file into the representatives (to extract) and the members
+    mapped to their representative. Returns the clustering stats.
+    """
+    for path in (representatives_path, members_path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    conversations, representatives, cluster_sizes = 0, 0, {}
+    with open(representatives_path, 'w', encoding='utf-8') as representatives_file, \
+            open(members_path, 'w', encoding='utf-8') as members_file, telemetry.stage("dedup") as stage:
+        for message, representative_id in cluster_conversations(iter_json_records(input_path)):
+            conversations += 1
+            if representative_id is None:
+                append_jsonl(message, representatives_file)
+                representatives += 1
+            else:
+                append_jsonl({"conversation_id": conversation_id_of(message), "representative_id": representative_id}, members_file)
+                cluster_sizes[representative_id] = cluster_sizes.get(representative_id, 1) + 1
+        stage["items"] = conversations
+
+    stats = {
+        "conversations": conversations,
+        "representatives": representatives,
+        "clusters_with_duplicates": len(cluster_sizes),
+        "largest_cluster": max(cluster_sizes.values(), default=1),
+        "llm_calls_saved": conversations - representatives,
+        "saved_ratio": round((conversations - representatives) / conversations, 4) if conversations else 0.0,
+    }
+    print(f"Near-duplicate clustering: {stats}")
+    return stats
+
+
+def expand_extractions(extractions_path: str = output_jsonl_path, members_path: str = members_path,
+                       output_path: str = expanded_output_path) -> dict:
+    """
+    Writes every extraction of a representative followed by a copy for each member of its cluster,
+    with the member's own conversation_id. Members whose representative has no extraction (failed) are counted.
+    """
+    members: Dict[str, List[str]] = {}
+    for record in iter_json_records(members_path):
+        members.setdefault(str(record["representative_id"]), []).append(str(record["conversation_id"]))
+
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    extracted, copied, expanded_ids = 0, 0, set()
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for record in iter_json_records(extractions_path):
+            representative_id = str(record.get("conversation_id"))
+            append_jsonl(record, f)
+            extracted += 1
+            for member_id in members.get(representative_id, []):
+                append_jsonl({**record, "conversation_id": member_id}, f)
+                copied += 1
+            expanded_ids.add(representative_id)
+
+    stats = {
+        "extractions": extracted,
+        "copied_to_members": copied,
+        "members_without_result": sum(len(ids) for representative_id, ids in members.items() if representative_id not in expanded_ids),
+        "llm_calls_saved": copied,
+    }
+    print(f"Expanded {extracted} extractions to {extracted + copied} conversations in {output_path}: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    # python src/near_duplicates.py         -> cluster input_path, then run main.py on representatives_path
+    # python src/near_duplicates.py expand  -> copy main.py's results to the cluster members
+    if sys.argv[1:] == ["expand"]:
+        expand_extractions()
+    else:
+        dedup_jsonl()
+    telemetry.report()
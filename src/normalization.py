@@ -0,0 +1,40 @@
+import re
+from typing import List, Optional
+
+# An order/case number inside a value: digits with separators ('471. 515. 124'), optionally after an uppercase code ('CS-12345')
+number_token_regex = re.compile(r"(?:\b[A-Z]{1,4}-?)?\d(?:[\d.\- ]*\d)?")
+
+
+# --- Functions ---
+def normalize_number(number: str) -> str:
+    """Canonical form of an order/case number: no spaces, dots, dashes or leading '#', uppercase."""
+    return re.sub(r"[\s.\-#]", "", number).upper()
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lowercase, punctuation replaced by spaces, whitespace collapsed. None becomes ''."""
+    if text is None:
+        return ""
+    return " ".join(re.sub(r"[^\w\s]", " ", str(text).lower()).split())
+
+
+def split_alternatives(value: Optional[str]) -> List[str]:
+    """
+    Answer sheet values can hold several accepted answers separated by '/'.
+    The full value is accepted too (an output copying the whole answer is not wrong).
+    """
+    if value is None:
+        return [""]
+    alternatives = [alternative.strip() for alternative in str(value).split("/")]
+    return alternatives + [str(value)] if len(alternatives) > 1 else alternatives
+
+
+def split_numbers(value: Optional[str]) -> set:
+    """
+    Normalized order/case numbers in a value like '71235234 or 471212321'.
+    Labels and words around them are ignored ('Order number: 471212321' -> {'471212321'}).
+    """
+    if value is None:
+        return set()
+    parts = re.split(r"\s+or\s+|\s+and\s+|,|;", str(value), flags=re.IGNORECASE)
+    return {normalize_number(token) for part in parts for token in number_token_regex.findall(part)}
@@ -0,0 +1,333 @@
+import json
+import re
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+from main import (ConversationInfo, iter_json_records, save_json_file, parse_extraction, failed_extraction, prompt,
+                  get_extraction_response, json_file_path, output_path, failed_validation_output_path)
+from json_repair import parse_llm_json
+from normalization import normalize_number
+from rate_limiter import estimate_tokens
+
+# --- Configuration (dictionaries)---
+# IKEA product family names (as written in transcripts, uppercase) -> product category
+known_products = {
+    "BILLY": "Furniture", "KALLAX": "Storage", "HEMNES": "Furniture", "MALM": "Furniture", "PAX": "Storage",
+    "IVAR": "Storage", "BRIMNES": "Furniture", "EKTORP": "Furniture", "KIVIK": "Furniture", "FRIHETEN": "Furniture",
+    "POÄNG": "Furniture", "LACK": "Furniture", "LINNMON": "Furniture", "MICKE": "Furniture", "BEKANT": "Furniture",
+    "NORDLI": "Furniture", "TARVA": "Furniture", "SONGESAND": "Furniture", "IDANÄS": "Furniture",
+    "SOCKERBIT": "Storage", "SKUBB": "Storage", "SAMLA": "Storage", "TROFAST": "Storage", "RASKOG": "Storage",
+    "TRONES": "Storage", "ALGOT": "Storage", "BOAXEL": "Storage", "KUGGIS": "Storage", "HAVSTA": "Storage",
+    "VARIERA": "Kitchen", "KUNGSFORS": "Kitchen", "METOD": "Kitchen", "KNOXHULT": "Kitchen", "ENHET": "Kitchen",
+    "IKEA 365+": "Kitchen", "RINNIG": "Kitchen", "HEKTAR": "Lighting", "RANARP": "Lighting", "LERSTA": "Lighting",
+    "FADO": "Lighting", "TERTIAL": "Lighting", "FORSÅ": "Lighting", "STOCKHOLM": "Home Goods", "FEJKA": "Home Goods",
+    "STOENSE": "Textiles", "VINDUM": "Textiles", "MALA": "Home Goods", "GODMORGON": "Bathroom", "SKOGSVIK": "Bathroom",
+}
+# Lowercase store names -> store_location value (only the stores' own names: a city near a store is not the store)
+known_stores = {
+    "menlo": "Menlo", "menlo park": "Menlo", "east palo alto": "East Palo Alto", "emeryville": "Emeryville",
+    "schaumburg": "Schaumburg", "bolingbrook": "Bolingbrook", "brooklyn": "IKEA Brooklyn",
+    "burbank": "Burbank", "carson": "Carson", "costa mesa": "Costa Mesa", "covina": "Covina", "san diego": "San Diego",
+    "west sacramento": "West Sacramento", "tempe": "Tempe", "centennial": "Centennial", "round rock": "Round Rock",
+    "grand prairie": "Grand Prairie", "frisco": "Frisco", "houston": "Houston", "live oak": "Live Oak",
+    "atlanta": "Atlanta", "charlotte": "Charlotte", "elizabeth": "Elizabeth", "paramus": "Paramus",
+    "long island": "Long Island", "conshohocken": "Conshohocken",
+    "south philadelphia": "South Philadelphia", "woodbridge": "Woodbridge", "college park": "College Park",
+    "stoughton": "Stoughton", "new haven": "New Haven", "canton": "Canton", "renton": "Renton",
+    "portland": "Portland", "draper": "Draper", "st. louis": "St. Louis", "merriam": "Merriam",
+    "oak creek": "Oak Creek", "twin cities": "Twin Cities", "fishers": "Fishers",
+    "west chester": "West Chester", "columbus": "Columbus", "pittsburgh": "Pittsburgh", "jacksonville": "Jacksonville",
+    "orlando": "Orlando", "sunrise": "Sunrise", "miami": "Miami", "tampa": "Tampa", "norfolk": "Norfolk",
+}
+# Words that end a product description ("BILLY bookcase in white" -> "BILLY bookcase")
+product_description_stop_words = {
+    "in", "for", "from", "and", "or", "to", "is", "was", "are", "were", "that", "which", "the", "a", "an", "i",
+    "it", "but", "at", "on", "yesterday", "today", "please", "because", "has", "have", "had", "arrived",
+}
+
+# --- Compiled patterns ---
+case_or_order_pattern = re.compile(
+    r"\b(?:order|case|ticket|reference)\s*(?:number|no\.?|id|#)?\s*(?:is|was|:)?\s*:?\s*"
+    r"(#?[A-Z]{0,4}-?\d[\d.\- ]{4,}\d|#?[A-Z]{2,4}\d{5,})",
+    re.IGNORECASE)
+article_number_pattern = re.compile(r"\b\d{3}\.\d{3}\.\d{2}\b")
+product_description_pattern = re.compile(r"\s+([\w\-]+)")
+agent_line_pattern = re.compile(r"^agent:", re.MULTILINE)
+# Many store names are also first names or common words (Charlotte, Carson, Sunrise), so a store name only counts
+# right after "store/location ... in/at", after "IKEA", or before "store/location" ("the one in Burbank", "the Tempe store")
+store_context_before_pattern = re.compile(
+    r"(?:\b(?:store|location|warehouse)\b[^.?!]{0,25}\b(?:in|at|of)|\bikea)\s+$", re.IGNORECASE)
+store_context_after_pattern = re.compile(r"^\s+(?:ikea\s+)?(?:store|location|warehouse)\b", re.IGNORECASE)
+# A conversation without agent lines is only "disconnected in the queue" with a queue or disconnect notice and
+# no customer message besides the connection notices
+queue_marker_pattern = re.compile(
+    r"^(?:system|customer):.*\b(?:wait time|please hold|connecting you|queue|disconnected|left the chat)", re.IGNORECASE | re.MULTILINE)
+connection_notice_pattern = re.compile(r"^customer: Customer (?:connected|disconnected|left)\b", re.IGNORECASE)
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: finds every dictionary keyword in one pass over the text."""
+
+    def __init__(self, keywords: Iterable[str], case_sensitive: bool = True):
+        self.case_sensitive = case_sensitive
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[str]] = [[]]
+        for keyword in keywords:
+            self._add(keyword if case_sensitive else keyword.lower())
+        self._build_failure_links()
+
+    def _add(self, keyword: str) -> None:
+        node = 0
+        for char in keyword:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.output[node].append(keyword)
+
+    def _build_failure_links(self) -> None:
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find_all(self, text: str) -> List[tuple[int, int, str]]:
+        """Returns (start, end, keyword) for every whole-word occurrence, in text order."""
+        haystack = text if self.case_sensitive else text.lower()
+        matches = []
+        node = 0
+        for index, char in enumerate(haystack):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for keyword in self.output[node]:
+                start, end = index - len(keyword) + 1, index + 1
+                if (start == 0 or not haystack[start - 1].isalnum()) and (end == len(haystack) or not haystack[end].isalnum()):
+                    matches.append((start, end, keyword))
+        return matches
+
+
+product_index = AhoCorasick(known_products, case_sensitive=True)
+store_index = AhoCorasick(known_stores, case_sensitive=False)
+
+
+# --- Functions ---
+def extract_case_or_order_numbers(transcript: str) -> List[str]:
+    """Order/case numbers in transcript order, deduplicated on their normalized form."""
+    numbers, seen = [], set()
+    for match in case_or_order_pattern.finditer(transcript):
+        number = match.group(1).strip(" .-")
+        normalized = normalize_number(number)
+        if normalized not in seen:
+            seen.add(normalized)
+            numbers.append(number)
+    return numbers
+
+
+def extract_products(transcript: str) -> List[str]:
+    """Known product names (with the words that describe them) and IKEA article numbers (e.g. 805.219.30)."""
+    products, seen = [], set()
+    for start, end, keyword in product_index.find_all(transcript):
+        # Later mentions of the same product family are usually the same item ("the KALLAX unit")
+        if keyword in seen:
+            continue
+        seen.add(keyword)
+        words = [keyword]
+        position = end
+        # Keep up to 4 describing words after the product name ("SOCKERBIT Storage box with Lid")
+        while len(words) < 5:
+            match = product_description_pattern.match(transcript, position)
+            if not match or match.group(1).lower() in product_description_stop_words:
+                break
+            words.append(match.group(1))
+            position = match.end()
+        products.append(" ".join(words))
+    for match in article_number_pattern.finditer(transcript):
+        if match.group(0) not in seen:
+            seen.add(match.group(0))
+            products.append(match.group(0))
+    return products
+
+
+def in_store_context(line: str, start: int, end: int) -> bool:
+    return bool(store_context_before_pattern.search(line[max(start - 50, 0):start])
+                or store_context_after_pattern.match(line[end:end + 30]))
+
+
+def extract_store(transcript: str) -> Optional[str]:
+    """First known store mentioned as a store by the customer or agent (system lines are ignored)."""
+    for line in transcript.splitlines():
+        if line.startswith("system:"):
+            continue
+        matches = [match for match in store_index.find_all(line) if in_store_context(line, match[0], match[1])]
+        if matches:
+            # Prefer the longest alias at the first position ("menlo park" over "menlo")
+            first_start = min(start for start, _, _ in matches)
+            keyword = max((keyword for start, _, keyword in matches if start == first_start), key=len)
+            return known_stores[keyword]
+    return None
+
+
+def is_disconnected_in_queue(transcript: str) -> bool:
+    """No agent line, a queue/disconnect notice, and the customer wrote nothing but connection notices."""
+    if agent_line_pattern.search(transcript) or not queue_marker_pattern.search(transcript):
+        return False
+    return all(connection_notice_pattern.match(line) for line in transcript.splitlines() if line.startswith("customer:"))
+
+
+def pre_extract(transcript: str) -> dict:
+    """
+    Fills the ConversationInfo fields that rules can resolve with high precision, without an LLM.
+    Only resolved fields are returned. A conversation disconnected in the queue is fully resolved.
+    Products are never resolved here (the dictionary is not exhaustive), see product_hints.
+    """
+    resolved = {}
+    if is_disconnected_in_queue(transcript):
+        return {
+            "products": [],
+            "store_location": None,
+            "product_category": None,
+            "service_rendered": "Customer disconnected during queue",
+            "customer_satisfaction": "Neutral",
+            "case_or_order_number": None,
+        }
+
+    numbers = extract_case_or_order_numbers(transcript)
+    if numbers:
+        resolved["case_or_order_number"] = " or ".join(numbers)
+
+    store = extract_store(transcript)
+    if store:
+        resolved["store_location"] = store
+    return resolved
+
+
+def product_hints(transcript: str) -> List[str]:
+    """Known products and article numbers in the transcript, merged into the LLM's products (see merge_products)."""
+    return extract_products(transcript)
+
+
+def merge_products(llm_products: Optional[list], hints: List[str]) -> list:
+    """The LLM's products plus the hints it missed (a hint counts as found when its family name or number is in an answer)."""
+    products = list(llm_products or [])
+    answered = " ".join(str(product) for product in products).upper()
+    for hint in hints:
+        if hint.split(" ")[0].upper() not in answered:
+            products.append(hint)
+    return products
+
+
+def missing_fields(resolved: dict) -> List[str]:
+    return [name for name in ConversationInfo.model_fields if name != "conversation_id" and name not in resolved]
+
+
+def partial_prompt(transcript: str, metadata: dict, fields: List[str]) -> str:
+    """Like main.prompt, but only asks for the fields the pre-extractor could not resolve."""
+    schema = {"conversation_id": ConversationInfo.model_fields["conversation_id"].description}
+    schema.update({name: ConversationInfo.model_fields[name].description for name in fields})
+    query = f"""
+        You are an expert data analyst. Your task is to carefully read the following customer support conversation
+        and extract specific pieces of information.
+
+        Conversation Transcript:
+        ---
+        {transcript}
+        ---
+        {metadata}
+        ---
+
+        Based on the conversation, provide the requested information in a valid JSON format,
+        adhering to the following schema. Do not include any extra text or explanations outside of the JSON object.
+        Never lie or make up information, always base your answers on the information from the documents.
+
+        JSON Schema:
+        {json.dumps(schema, indent=4)}
+    """
+    return query
+
+
+def extract_with_pre_extraction(message: dict, llm_fn: Callable[[str], str] = get_extraction_response) -> tuple[bool, dict, int]:
+    """
+    Runs the rule-based pre-extractor and asks the LLM only for what is left (nothing if all fields are resolved).
+
+    Returns:
+        tuple: (succeeded, extracted_info or failed extraction record, estimated prompt tokens sent)
+    """
+    transcript = message.get("transcript") or ""
+    metadata = message.get("metadata", {})
+    conversation_id = metadata.get("conversation_id")
+    resolved = pre_extract(transcript)
+    fields = missing_fields(resolved)
+
+    if not fields:
+        extracted = {"conversation_id": conversation_id, **resolved}
+        try:
+            ConversationInfo(**extracted)
+        except Exception as e:
+            return False, failed_extraction(message, "N/A (pre-extracted)", "VALIDATION_ERROR", e), 0
+        print(f"Successfully processed conversation: {conversation_id} (pre-extracted, no LLM call)")
+        return True, extracted, 0
+
+    query = partial_prompt(transcript, metadata, fields)
+    try:
+        response_text = llm_fn(query)
+    except Exception as e:
+        print(f"An unexpected error occurred for conversation {conversation_id}: {e}")
+        return False, failed_extraction(message, "N/A", "VALIDATION_ERROR", e), estimate_tokens(query)
+
+    # Merge before validating: rule-resolved fields win over whatever the LLM added for them,
+    # known products the LLM left out are added to its list
+    try:
+        merged = {**parse_llm_json(response_text), **resolved}
+        merged["products"] = merge_products(merged.get("products"), product_hints(transcript))
+        response_text = json.dumps(merged)
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        pass
+    succeeded, record = parse_extraction(message, response_text)
+    return succeeded, record, estimate_tokens(query)
+
+
+def format_conversation_pre_extracted(json_file_path: str, llm_fn: Callable[[str], str] = get_extraction_response) -> tuple[List[dict], List[dict]]:
+    """main.format_conversation with the rule-based pre-extraction stage in front of the LLM.
+
+    Returns:
+        tuple: (successful_extractions, failed_extractions)
+    """
+    all_extracted_info = []
+    failed_extractions = []
+    skipped_calls, tokens_sent, tokens_full_prompt = 0, 0, 0
+
+    for message in iter_json_records(json_file_path):
+        succeeded, record, tokens = extract_with_pre_extraction(message, llm_fn)
+        (all_extracted_info if succeeded else failed_extractions).append(record)
+        skipped_calls += tokens == 0
+        tokens_sent += tokens
+        tokens_full_prompt += estimate_tokens(prompt(message.get("transcript"), message.get("metadata")))
+
+    print(f"Pre-extraction skipped {skipped_calls} LLM calls, sent ~{tokens_sent} prompt tokens "
+          f"instead of ~{tokens_full_prompt}.")
+    return all_extracted_info, failed_extractions
+
+
+if __name__ == "__main__":
+    extracted_data, failed_data = format_conversation_pre_extracted(json_file_path)
+
+    if extracted_data:
+        save_json_file(extracted_data, output_path)
+        print(f"Extracted and saved information for {len(extracted_data)} conversations.")
+    else:
+        print("No data was extracted.")
+
+    if failed_data:
+        save_json_file(failed_data, failed_validation_output_path)
+        print(f"Saved {len(failed_data)} failed conversations to {failed_validation_output_path}")
+    else:
+        print("No failed conversations were found.")
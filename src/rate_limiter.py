@@ -0,0 +1,91 @@
+import asyncio
+import time
+from typing import Optional
+
+
+# --- Functions ---
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate (~4 characters per token), good enough for pacing and packing.
+    """
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Token bucket that refills continuously at `rate_per_minute` up to `capacity`.
+    The bucket starts full so the first burst is not delayed.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute must be positive.")
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate_per_second)
+        self.last_refill = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill()
+        # Requests bigger than the bucket would never fit, cap them so they only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate_per_second
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter for LLM calls.
+    Either limit can be None (unlimited). Shared between concurrent asyncio tasks
+    through `acquire`, or used from a plain loop through `acquire_sync`.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = None
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.request_bucket:
+            wait = max(wait, self.request_bucket.wait_time(1))
+        if self.token_bucket:
+            wait = max(wait, self.token_bucket.wait_time(tokens))
+        return wait
+
+    def _consume(self, tokens: int) -> None:
+        if self.request_bucket:
+            self.request_bucket.consume(1)
+        if self.token_bucket:
+            self.token_bucket.consume(tokens)
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Waits until one request of `tokens` estimated tokens fits in both buckets."""
+        # Lock is created lazily so the limiter can be built outside of a running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            wait = self._wait_time(tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._wait_time(tokens)
+            self._consume(tokens)
+
+    def acquire_sync(self, tokens: int = 0) -> None:
+        """Blocking version of `acquire` for sequential loops."""
+        wait = self._wait_time(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._wait_time(tokens)
+        self._consume(tokens)
@@ -0,0 +1,244 @@
+import json
+import os
+import random
+from collections import Counter
+from typing import Dict, List, Optional
+import numpy as np
+import telemetry
+import evaluation_rag
+from evaluation_rag import align_by_conversation_id, iter_evaluation_results
+from field_scorers import CORRECT, scored_fields
+from json_io import append_jsonl, iter_json_records, load_json_data
+from rate_limiter import RateLimiter, estimate_tokens
+
+# --- Configuration (path)---
+facit_path = "src/data/evaluation/facit.json"
+# Transformed conversations, for the channel/country/length strata (conversations missing here are 'unknown')
+transformed_path = "src/data/transformed_oscar_data.jsonl"
+extractions_path = "src/data/test_data_gemini_2.5_flash.jsonl"
+results_path = "src/data/evaluation/sampled_evaluation.jsonl"
+report_path = "src/data/evaluation/sampled_evaluation_report.json"
+
+# --- Configuration (sampling)---
+# Length strata: estimated transcript tokens below each limit, the last stratum is everything longer
+length_limits = [500, 1500, 4000]
+# Pairs scored per step; after each step the intervals are checked
+sample_step = 50
+min_sample_size = 100
+# None = up to the whole answer sheet
+max_sample_size: Optional[int] = None
+# Stop when every field's interval half width (comparing two outputs: of the difference) is at most this.
+# Only the width decides: stopping as soon as a difference excludes 0 would be optional stopping
+# (re-tested every step, the real false-positive rate would be well above 1 - confidence_level).
+target_half_width = 0.03
+confidence_level = 0.95
+bootstrap_resamples = 1000
+use_judge = True
+seed = 42
+
+summary_columns = scored_fields + ["overall"]
+
+
+# --- Functions ---
+def length_stratum(transcript: Optional[str]) -> str:
+    if transcript is None:
+        return "unknown"
+    tokens = estimate_tokens(transcript)
+    for limit in length_limits:
+        if tokens < limit:
+            return f"<{limit}"
+    return f">={length_limits[-1]}"
+
+
+def load_strata_info(transformed_path: str, conversation_ids: set) -> Dict[str, tuple]:
+    """(channel, country, length stratum) of the answer sheet's conversations, read in one streaming pass."""
+    info = {}
+    if not os.path.exists(transformed_path):
+        print(f"{transformed_path} not found, stratifying by satisfaction label only.")
+        return info
+    for conversation in iter_json_records(transformed_path):
+        metadata = conversation.get("metadata") or {}
+        conversation_id = str(metadata.get("conversation_id", conversation.get("conversation_id")))
+        if conversation_id in conversation_ids:
+            info[conversation_id] = (str(metadata.get("channel")), str(metadata.get("country")),
+                                     length_stratum(conversation.get("transcript")))
+    return info
+
+
+def stratum_of(facit_conv: dict, strata_info: Dict[str, tuple]) -> str:
+    channel, country, length = strata_info.get(str(facit_conv.get("conversation_id")), ("unknown",) * 3)
+    return "|".join([channel, country, str(facit_conv.get("customer_satisfaction")), length])
+
+
+def stratified_order(strata: List[str], seed: Optional[int] = seed) -> List[int]:
+    """
+    Sampling order of the answer sheet in which every prefix is (close to) proportionally stratified:
+    the r-th of the n shuffled members of a stratum is placed at (r + offset) / n, with a random offset per stratum.
+    Taking the first k indexes is a stratified sample of size k, so the sample can grow step by step.
+    """
+    rng = random.Random(seed)
+    members: Dict[str, List[int]] = {}
+    for index, stratum in enumerate(strata):
+        members.setdefault(stratum, []).append(index)
+    keys = []
+    for stratum in sorted(members):
+        indexes = members[stratum]
+        rng.shuffle(indexes)
+        offset = rng.random()
+        keys += [((rank + offset) / len(indexes), rng.random(), index) for rank, index in enumerate(indexes)]
+    return [index for _, _, index in sorted(keys)]
+
+
+def field_outcomes(result: dict) -> List[float]:
+    """1.0 per correct field of an evaluation result (unusable judge answers count as all wrong), plus the overall share."""
+    outcomes = [1.0 if result.get(f"{field}_status") == CORRECT else 0.0 for field in scored_fields]
+    return outcomes + [sum(outcomes) / len(outcomes)]
+
+
+def bootstrap_means(outcomes: Dict[str, np.ndarray], strata: List[str], resamples: int = bootstrap_resamples,
+                    rng: Optional[np.random.Generator] = None) -> Dict[str, np.ndarray]:
+    """
+    (resamples x columns) bootstrap means of the outcome rows of every output, resampled within strata.
+    The same draws are used for every output, so differences between outputs are paired.
+    Strata sampled only once are pooled (a single row has no spread of its own).
+    """
+    rng = rng or np.random.default_rng(seed)
+    counts = Counter(strata)
+    groups = np.array([stratum if counts[stratum] > 1 else "pooled" for stratum in strata])
+    totals = {label: np.zeros((resamples, values.shape[1])) for label, values in outcomes.items()}
+    for group in sorted(set(groups)):
+        rows = np.flatnonzero(groups == group)
+        draws = rows[rng.integers(0, len(rows), (resamples, len(rows)))]
+        for label, values in outcomes.items():
+            totals[label] += values[draws].sum(axis=1)
+    return {label: total / len(strata) for label, total in totals.items()}
+
+
+def interval(means: np.ndarray, column: int, confidence: float = confidence_level) -> tuple[float, float]:
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means[:, column], [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def summarize(outcomes: Dict[str, np.ndarray], strata: List[str]) -> dict:
+    """Accuracy with bootstrap confidence interval per field and output, and the paired difference of two outputs."""
+    means = bootstrap_means(outcomes, strata)
+    summary = {}
+    for label, values in outcomes.items():
+        summary[label] = {}
+        for column, name in enumerate(summary_columns):
+            low, high = interval(means[label], column)
+            summary[label][name] = {"accuracy": round(float(values[:, column].mean()), 4),
+                                    "ci_low": round(low, 4), "ci_high": round(high, 4)}
+    if len(outcomes) == 2:
+        first, second = outcomes
+        difference = means[second] - means[first]
+        summary[f"{second} - {first}"] = {}
+        for column, name in enumerate(summary_columns):
+            low, high = interval(difference, column)
+            summary[f"{second} - {first}"][name] = {
+                "difference": round(float(outcomes[second][:, column].mean() - outcomes[first][:, column].mean()), 4),
+                "ci_low": round(low, 4), "ci_high": round(high, 4)}
+    return summary
+
+
+def precise_enough(summary: dict, labels: List[str]) -> bool:
+    """Every interval (when comparing two outputs: of the difference) is at most `target_half_width` wide on each side."""
+    keys = [f"{labels[1]} - {labels[0]}"] if len(labels) == 2 else labels
+    return all((entry["ci_high"] - entry["ci_low"]) / 2 <= target_half_width
+               for key in keys for entry in summary[key].values())
+
+
+def sampled_eval(facit_data_json: str = facit_path, new_data_jsons: Optional[Dict[str, str]] = None,
+                 transformed_path: str = transformed_path, results_path: str = results_path,
+                 use_judge: bool = use_judge) -> dict:
+    """
+    Sequential stratified evaluation: scores growing stratified samples of the answer sheet (by channel, country,
+    satisfaction label and transcript length) `sample_step` pairs at a time, and stops as soon as the bootstrap
+    intervals are narrow enough (see precise_enough) or `max_sample_size` is reached.
+    The intervals are computed as for a fixed sample: after stopping on them they are approximate (slightly
+    optimistic), so treat a difference whose interval barely excludes 0 as undecided.
+
+    Args:
+        new_data_jsons: {label: extraction output path}, one output, or two to compare (e.g. two models or prompts)
+                        on the same sample with paired intervals of their difference.
+
+    Returns:
+        dict: the report (sample size, judged pairs, accuracy and intervals per field)
+    """
+    new_data_jsons = new_data_jsons or {"extractions": extractions_path}
+    labels = list(new_data_jsons)
+    facit_data = load_json_data(facit_data_json)
+    outputs = {label: align_by_conversation_id(facit_data, load_json_data(path)) for label, path in new_data_jsons.items()}
+    strata_info = load_strata_info(transformed_path, {str(facit_conv.get("conversation_id")) for facit_conv in facit_data})
+    all_strata = [stratum_of(facit_conv, strata_info) for facit_conv in facit_data]
+    order = stratified_order(all_strata)
+    limit = min(max_sample_size or len(order), len(order))
+    rate_limiter = RateLimiter(evaluation_rag.judge_requests_per_minute, evaluation_rag.judge_tokens_per_minute)
+
+    rows = {label: [] for label in labels}
+    sampled, judged, summary, stopped_early = [], 0, {}, False
+    if os.path.dirname(results_path):
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    with open(results_path, 'w', encoding='utf-8') as f, telemetry.stage("evaluate.sampled") as stage:
+        while len(sampled) < limit:
+            step = order[len(sampled):min(len(sampled) + sample_step, limit)]
+            facit_step = [facit_data[index] for index in step]
+            for label in labels:
+                results = [None] * len(step)
+                for position, result, was_judged in iter_evaluation_results(
+                        facit_step, [outputs[label][index] for index in step], use_judge=use_judge, rate_limiter=rate_limiter):
+                    results[position] = result
+                    judged += was_judged
+                    append_jsonl({"output": label, **result}, f)
+                rows[label] += [field_outcomes(result) for result in results]
+            sampled += step
+
+            if len(sampled) >= min(min_sample_size, limit):
+                strata = [all_strata[index] for index in sampled]
+                summary = summarize({label: np.array(rows[label]) for label in labels}, strata)
+                print(f"Sample of {len(sampled)}/{len(order)}: overall "
+                      + ", ".join(f"{label} {summary[label]['overall']}" for label in labels))
+                if precise_enough(summary, labels) and len(sampled) < limit:
+                    stopped_early = True
+                    break
+        stage["items"] = len(sampled)
+
+    report = {
+        "population": len(order),
+        "sample_size": len(sampled),
+        "sample_fraction": round(len(sampled) / len(order), 4) if order else 0.0,
+        "strata": len(set(all_strata)),
+        "judged_pairs": judged,
+        "stopped_early": stopped_early,
+        "confidence_level": confidence_level,
+        # The sample size depended on the intervals, their coverage at the stopping time is approximate
+        "intervals_exact": not stopped_early,
+        "fields": summary,
+    }
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"\nSampled {report['sample_size']} of {report['population']} conversations ({report['strata']} strata), "
+          f"{report['judged_pairs']} judged by the LLM{', stopped early (intervals approximate)' if report['stopped_early'] else ''}:")
+    for label, fields in report["fields"].items():
+        print(f"  {label}")
+        for name, entry in fields.items():
+            value = entry.get("accuracy", entry.get("difference"))
+            print(f"    {name:<24} {value:<8} [{entry['ci_low']}, {entry['ci_high']}]")
+
+
+def save_report(report: dict, path: str = report_path) -> None:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+    print(f"Sampled evaluation report saved to {path}")
+
+
+if __name__ == "__main__":
+    sampled_report = sampled_eval()
+    print_report(sampled_report)
+    save_report(sampled_report)
+    telemetry.report()
@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+from rate_limiter import estimate_tokens
+
+# --- Configuration (telemetry)---
+# Off by default, set TELEMETRY=1 (or call enable()) to record. When off, every hook returns after one flag check.
+enabled = os.getenv("TELEMETRY") == "1"
+events_path = os.getenv("TELEMETRY_EVENTS_PATH", "src/data/telemetry/events.jsonl")
+metrics_path = os.getenv("TELEMETRY_METRICS_PATH", "src/data/telemetry/metrics.prom")
+# Upper bounds (s) of the LLM call latency histogram buckets
+latency_buckets = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+_lock = threading.Lock()
+# The LLM call in progress in this thread/task, the backend adds the usage metadata of the response to it
+_current_call: ContextVar[Optional[dict]] = ContextVar("current_llm_call", default=None)
+
+
+class Metrics:
+    """Counters of one run, keyed by label tuples. Only touched under _lock."""
+
+    def __init__(self):
+        self.run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+        self.llm_calls = {}           # (model, backend, status) -> calls
+        self.llm_latency = {}         # model -> [bucket counts..., +Inf count, sum]
+        self.llm_tokens = {}          # (model, direction) -> tokens
+        self.llm_cost = {}            # model -> USD
+        self.stage_seconds = {}       # stage -> seconds
+        self.stage_items = {}         # stage -> items
+        self.failures = {}            # (stage, error_type) -> count
+        self.retries = {}             # stage -> count
+        self.json_parses = {}         # outcome (clean, repaired, failed) -> count
+
+
+_metrics = Metrics()
+_events_file = None
+
+
+# --- Functions ---
+def enable(events_file_path: Optional[str] = None, metrics_file_path: Optional[str] = None) -> None:
+    global enabled, events_path, metrics_path
+    events_path = events_file_path or events_path
+    metrics_path = metrics_file_path or metrics_path
+    enabled = True
+
+
+def disable() -> None:
+    global enabled, _events_file
+    enabled = False
+    with _lock:
+        if _events_file is not None:
+            _events_file.close()
+            _events_file = None
+
+
+def reset() -> None:
+    """Starts a new run: clears all counters (the events file is kept and appended to)."""
+    global _metrics
+    with _lock:
+        _metrics = Metrics()
+
+
+def _add(counter: dict, key, value: float) -> None:
+    counter[key] = counter.get(key, 0) + value
+
+
+def emit(event_type: str, **fields) -> None:
+    """Appends one structured event to the JSONL events file."""
+    global _events_file
+    if not enabled:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "run_id": _metrics.run_id, "event": event_type, **fields},
+                      ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        if _events_file is None:
+            if os.path.dirname(events_path):
+                os.makedirs(os.path.dirname(events_path), exist_ok=True)
+            _events_file = open(events_path, "a", encoding="utf-8", buffering=1)
+        _events_file.write(line)
+
+
+def start_llm_call(model_name: str, backend_name: str, prompt: str, prices: Optional[dict] = None) -> Optional[dict]:
+    """Starts timing one LLM call. Returns None when telemetry is off, pass the result to end_llm_call."""
+    if not enabled:
+        return None
+    call = {"model": model_name, "backend": backend_name, "prompt": prompt, "prices": prices or {},
+            "input_tokens": None, "output_tokens": None, "start": time.perf_counter()}
+    call["context_token"] = _current_call.set(call)
+    return call
+
+
+def record_usage(input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+    """Called by backends with the token counts from the response usage metadata."""
+    call = _current_call.get()
+    if call is not None:
+        call["input_tokens"], call["output_tokens"] = input_tokens, output_tokens
+
+
+def end_llm_call(call: Optional[dict], response_text: Optional[str], cached: bool = False,
+                 error: Optional[Exception] = None) -> None:
+    """Records latency, tokens (estimated when the backend gave no usage metadata) and cost of a call."""
+    if call is None:
+        return
+    latency = time.perf_counter() - call["start"]
+    _current_call.reset(call["context_token"])
+
+    tokens_estimated = call["input_tokens"] is None
+    input_tokens = estimate_tokens(call["prompt"]) if tokens_estimated else call["input_tokens"]
+    output_tokens = call["output_tokens"]
+    if output_tokens is None:
+        output_tokens = estimate_tokens(response_text) if response_text is not None else 0
+    status = "error" if error is not None else "cached" if cached else "ok"
+    # Cached answers cost nothing
+    cost = 0.0 if cached else (input_tokens * call["prices"].get("input", 0.0)
+                               + output_tokens * call["prices"].get("output", 0.0)) / 1_000_000
+
+    model = call["model"]
+    with _lock:
+        _add(_metrics.llm_calls, (model, call["backend"], status), 1)
+        histogram = _metrics.llm_latency.setdefault(model, [0] * (len(latency_buckets) + 2))
+        histogram[bisect_left(latency_buckets, latency)] += 1
+        histogram[-1] += latency
+        if not cached:
+            _add(_metrics.llm_tokens, (model, "input"), input_tokens)
+            _add(_metrics.llm_tokens, (model, "output"), output_tokens)
+            _add(_metrics.llm_cost, model, cost)
+    emit("llm_call", model=model, backend=call["backend"], status=status, latency_s=round(latency, 4),
+         input_tokens=input_tokens, output_tokens=output_tokens, tokens_estimated=tokens_estimated,
+         cost_usd=round(cost, 8), error=str(error) if error is not None else None)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times a pipeline stage. Yields a dict, set "items" on it to report the number of records processed.
+    """
+    info = {"items": 0}
+    if not enabled:
+        yield info
+        return
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record_stage(name, time.perf_counter() - start, info["items"])
+
+
+def record_stage(name: str, seconds: float, items: int = 0) -> None:
+    """Records wall time of a stage measured elsewhere (e.g. data_processing.StageTimer)."""
+    if not enabled:
+        return
+    with _lock:
+        _add(_metrics.stage_seconds, name, seconds)
+        _add(_metrics.stage_items, name, items)
+    emit("stage", stage=name, seconds=round(seconds, 4), items=items)
+
+
+def record_failure(stage_name: str, error_type: str, conversation_id=None) -> None:
+    """Counts a parse/validation failure by type."""
+    if not enabled:
+        return
+    with _lock:
+        _add(_metrics.failures, (stage_name, error_type), 1)
+    emit("failure", stage=stage_name, error_type=error_type, conversation_id=conversation_id)
+
+
+def record_retry(stage_name: str, count: int = 1) -> None:
+    """Counts requests that were sent again (e.g. single-conversation fallbacks after a batch)."""
+    if not enabled or not count:
+        return
+    with _lock:
+        _add(_metrics.retries, stage_name, count)
+    emit("retry", stage=stage_name, count=count)
+
+
+def record_json_parse(outcome: str) -> None:
+    """Counts LLM answers by JSON parse outcome (clean, repaired locally, failed)."""
+    if not enabled:
+        return
+    with _lock:
+        _add(_metrics.json_parses, outcome, 1)
+    if outcome != "clean":
+        emit("json_parse", outcome=outcome)
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def prometheus_text() -> str:
+    """All counters of the run in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        metrics = _metrics
+        lines += ["# HELP llm_calls_total LLM calls by status (ok, error, cached).", "# TYPE llm_calls_total counter"]
+        lines += [f"llm_calls_total{_labels(model=m, backend=b, status=s)} {v}" for (m, b, s), v in sorted(metrics.llm_calls.items())]
+
+        lines += ["# HELP llm_call_latency_seconds LLM call wall time.", "# TYPE llm_call_latency_seconds histogram"]
+        for model, histogram in sorted(metrics.llm_latency.items()):
+            cumulative = 0
+            for bound, count in zip(latency_buckets + ["+Inf"], histogram[:-1]):
+                cumulative += count
+                lines.append(f"llm_call_latency_seconds_bucket{_labels(model=model, le=bound)} {cumulative}")
+            lines.append(f"llm_call_latency_seconds_sum{_labels(model=model)} {round(histogram[-1], 6)}")
+            lines.append(f"llm_call_latency_seconds_count{_labels(model=model)} {cumulative}")
+
+        lines += ["# HELP llm_tokens_total Tokens sent and received (not counting cache hits).", "# TYPE llm_tokens_total counter"]
+        lines += [f"llm_tokens_total{_labels(model=m, direction=d)} {v}" for (m, d), v in sorted(metrics.llm_tokens.items())]
+        lines += ["# HELP llm_cost_usd_total Estimated cost from the registry prices.", "# TYPE llm_cost_usd_total counter"]
+        lines += [f"llm_cost_usd_total{_labels(model=m)} {round(v, 6)}" for m, v in sorted(metrics.llm_cost.items())]
+
+        lines += ["# HELP pipeline_stage_seconds_total Wall time per pipeline stage.", "# TYPE pipeline_stage_seconds_total counter"]
+        lines += [f"pipeline_stage_seconds_total{_labels(stage=s)} {round(v, 6)}" for s, v in sorted(metrics.stage_seconds.items())]
+        lines += ["# HELP pipeline_stage_items_total Records processed per pipeline stage.", "# TYPE pipeline_stage_items_total counter"]
+        lines += [f"pipeline_stage_items_total{_labels(stage=s)} {v}" for s, v in sorted(metrics.stage_items.items())]
+        lines += ["# HELP pipeline_failures_total Parse/validation failures by type.", "# TYPE pipeline_failures_total counter"]
+        lines += [f"pipeline_failures_total{_labels(stage=s, error_type=e)} {v}" for (s, e), v in sorted(metrics.failures.items())]
+        lines += ["# HELP pipeline_retries_total Requests sent again.", "# TYPE pipeline_retries_total counter"]
+        lines += [f"pipeline_retries_total{_labels(stage=s)} {v}" for s, v in sorted(metrics.retries.items())]
+        lines += ["# HELP llm_json_parses_total LLM answers by JSON parse outcome.", "# TYPE llm_json_parses_total counter"]
+        lines += [f"llm_json_parses_total{_labels(outcome=o)} {v}" for o, v in sorted(metrics.json_parses.items())]
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> dict:
+    """Totals per model and stage, as printed by report()."""
+    with _lock:
+        metrics = _metrics
+        models = {}
+        for (model, _, status), calls in metrics.llm_calls.items():
+            entry = models.setdefault(model, {"calls": 0, "errors": 0, "cached": 0})
+            entry["calls"] += calls
+            if status == "error":
+                entry["errors"] += calls
+            elif status == "cached":
+                entry["cached"] += calls
+        for model, entry in models.items():
+            histogram = metrics.llm_latency.get(model)
+            entry["mean_latency_s"] = round(histogram[-1] / entry["calls"], 4) if histogram and entry["calls"] else 0.0
+            entry["input_tokens"] = metrics.llm_tokens.get((model, "input"), 0)
+            entry["output_tokens"] = metrics.llm_tokens.get((model, "output"), 0)
+            entry["cost_usd"] = round(metrics.llm_cost.get(model, 0.0), 6)
+        return {
+            "run_id": metrics.run_id,
+            "models": models,
+            "total_cost_usd": round(sum(metrics.llm_cost.values()), 6),
+            "stages": {name: {"seconds": round(seconds, 4), "items": metrics.stage_items.get(name, 0)}
+                       for name, seconds in metrics.stage_seconds.items()},
+            "failures": {f"{stage_name}/{error_type}": count for (stage_name, error_type), count in metrics.failures.items()},
+            "retries": dict(metrics.retries),
+            "json_parses": dict(metrics.json_parses),
+        }
+
+
+def report() -> Optional[dict]:
+    """
+    End of run: prints the summary, appends it as a "run_summary" event and writes the Prometheus text
+    file to metrics_path. Does nothing when telemetry is off.
+    """
+    if not enabled:
+        return None
+    run_summary = summary()
+    emit("run_summary", **run_summary)
+    if os.path.dirname(metrics_path):
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+    with open(metrics_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    print(f"Telemetry summary: {json.dumps(run_summary, indent=2)}")
+    print(f"Telemetry events in {events_path}, metrics in {metrics_path}")
+    return run_summary
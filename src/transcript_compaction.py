@@ -0,0 +1,151 @@
+import json
+import re
+from typing import Iterable, Iterator, List, Optional
+from json_io import iter_json_records
+from rate_limiter import estimate_tokens
+
+# --- Configuration (path)---
+input_path = "src/data/transformed_oscar_data.jsonl"
+output_path = "src/data/compacted_oscar_data.jsonl"
+
+# --- Configuration (compaction)---
+# Lines (text after "user_type: ") that carry nothing for the extraction, matched case-insensitively from the start of the text
+boilerplate_patterns = [
+    r"customer connected from live chat",
+    r"please hold, we're connecting you to ikea live chat",
+    r"your estimated wait time is",
+    r"we are currently busier than usual",
+    r"thank you for contacting ikea.*how (may|can) i (assist|help) you",
+    r"after this conversation, you will receive a short survey",
+    r"it was my pleasure chatting with you",
+    r"we are available from .* to .*",
+]
+# Agent filler that is only kept the first time it appears
+filler_messages = {"welcome", "welcome .", "welcome.", "you're welcome", "ok", "okay", "sure", "one moment please"}
+# Written instead of the removed lines when no customer/agent turn is left (the customer left in the queue),
+# so the conversation still reads as such (pre_extractor.is_disconnected_in_queue, the LLM)
+queue_only_marker = "system: customer disconnected in queue"
+# Max estimated tokens per transcript after cleaning (None = no truncation)
+token_budget: Optional[int] = 1500
+# Always keep this many lines from the start (the request) and the end (resolution and satisfaction)
+keep_head_lines = 4
+keep_tail_lines = 6
+
+boilerplate_regex = re.compile("|".join(f"(?:{pattern})" for pattern in boilerplate_patterns), re.IGNORECASE)
+important_line_regex = re.compile(r"\d{4,}|\b[A-ZÅÄÖ]{3,}\b|refund|deliver|assembl|return|cancel|store|damage", re.IGNORECASE)
+
+
+# --- Functions ---
+def split_line(line: str) -> tuple[str, str]:
+    user_type, _, text = line.partition(": ")
+    return user_type, text
+
+
+def remove_boilerplate(lines: List[str]) -> List[str]:
+    """Drops known template lines and repeated agent filler."""
+    kept, seen_filler = [], set()
+    for line in lines:
+        user_type, text = split_line(line)
+        if boilerplate_regex.match(text.strip()):
+            continue
+        filler = text.strip().lower()
+        if user_type == "agent" and filler in filler_messages:
+            if filler in seen_filler:
+                continue
+            seen_filler.add(filler)
+        kept.append(line)
+    return kept
+
+
+def line_priority(line: str) -> int:
+    """Higher is more useful for extraction: customer turns and lines with numbers, product names or service words."""
+    user_type, text = split_line(line)
+    priority = 1 if user_type == "customer" else 0
+    if important_line_regex.search(text):
+        priority += 2
+    return priority
+
+
+def truncate_to_budget(lines: List[str], budget: int) -> List[str]:
+    """
+    Keeps the head and tail of the conversation and fills the rest of the budget with the highest priority
+    lines, in their original order. Omitted stretches are replaced by a marker line.
+    """
+    line_tokens = [estimate_tokens(line) for line in lines]
+    if sum(line_tokens) <= budget:
+        return lines
+
+    keep = set(range(min(keep_head_lines, len(lines)))) | set(range(max(0, len(lines) - keep_tail_lines), len(lines)))
+    used = sum(line_tokens[index] for index in keep)
+    # Stable sort: equal priority lines closer to the start win
+    for index in sorted(range(len(lines)), key=lambda index: -line_priority(lines[index])):
+        if index not in keep and used + line_tokens[index] <= budget:
+            keep.add(index)
+            used += line_tokens[index]
+
+    truncated, omitted = [], 0
+    for index, line in enumerate(lines):
+        if index in keep:
+            if omitted:
+                truncated.append(f"system: [... {omitted} lines omitted ...]")
+                omitted = 0
+            truncated.append(line)
+        else:
+            omitted += 1
+    if omitted:
+        truncated.append(f"system: [... {omitted} lines omitted ...]")
+    return truncated
+
+
+def compact_transcript(transcript: str, budget: Optional[int] = token_budget) -> tuple[str, dict]:
+    """
+    Removes boilerplate, collapses filler and truncates to `budget` estimated tokens.
+    A transcript left without customer/agent turns (only queue notices) gets `queue_only_marker` instead.
+
+    Returns:
+        tuple: (compacted transcript, {"tokens_before", "tokens_after", "tokens_saved"})
+    """
+    lines = remove_boilerplate(transcript.splitlines())
+    if transcript.strip() and not any(split_line(line)[0] in ("customer", "agent") for line in lines):
+        lines = [queue_only_marker] + lines
+    if budget is not None:
+        lines = truncate_to_budget(lines, budget)
+    compacted = "\n".join(lines)
+    tokens_before, tokens_after = estimate_tokens(transcript), estimate_tokens(compacted)
+    return compacted, {"tokens_before": tokens_before, "tokens_after": tokens_after, "tokens_saved": tokens_before - tokens_after}
+
+
+def compact_conversations(messages: Iterable[dict], budget: Optional[int] = token_budget) -> Iterator[tuple[dict, dict]]:
+    """Yields (conversation with compacted transcript, savings stats) for each transformed conversation."""
+    for message in messages:
+        compacted, stats = compact_transcript(message.get("transcript") or "", budget)
+        yield {**message, "transcript": compacted}, {"conversation_id": message.get("conversation_id"), **stats}
+
+
+def compact_jsonl(input_path: str, output_path: str, budget: Optional[int] = token_budget) -> dict:
+    """
+    Compacts every conversation of a transformed JSONL/JSON file into a new JSONL file for main.py,
+    printing the token savings per conversation and in total.
+    """
+    total_before, total_after, count = 0, 0, 0
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for compacted, stats in compact_conversations(iter_json_records(input_path), budget):
+            f.write(json.dumps(compacted, ensure_ascii=False) + "\n")
+            print(f"Compacted conversation {stats['conversation_id']}: {stats['tokens_before']} -> {stats['tokens_after']} tokens")
+            total_before += stats["tokens_before"]
+            total_after += stats["tokens_after"]
+            count += 1
+
+    summary = {
+        "conversations": count,
+        "tokens_before": total_before,
+        "tokens_after": total_after,
+        "tokens_saved": total_before - total_after,
+        "saved_ratio": round((total_before - total_after) / total_before, 4) if total_before else 0.0,
+    }
+    print(f"Compaction summary: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    compact_jsonl(input_path, output_path)
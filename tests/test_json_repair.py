@@ -0,0 +1,28 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from json_repair import parse_llm_json
+
+
+def test_truncated_top_level_array_keeps_complete_elements():
+    text = '[{"conversation_id":"1","products":["A"]},{"conversation_id":"2","products":["B'
+    assert parse_llm_json(text) == [{"conversation_id": "1", "products": ["A"]}]
+
+
+def test_truncated_nested_array_of_arrays():
+    assert parse_llm_json('[[1, 2], [3, 4], [5, ') == [[1, 2], [3, 4]]
+
+
+def test_truncated_object_is_rejected():
+    with pytest.raises(json.JSONDecodeError):
+        parse_llm_json('{"conversation_id": "1", "products": ["A", "B')
+
+
+def test_common_mistakes_are_repaired():
+    text = "```json\n{conversation_id: '1', 'products': ['A',], customer_satisfaction: None,}\n```"
+    assert parse_llm_json(text) == {"conversation_id": "1", "products": ["A"], "customer_satisfaction": None}
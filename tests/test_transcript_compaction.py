@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from pre_extractor import pre_extract
+from transcript_compaction import compact_transcript
+
+queue_only_transcript = "\n".join([
+    "customer: Customer connected from Live Chat",
+    "system: Please hold, we're connecting you to IKEA live chat",
+    "system: Your estimated wait time is more than 30 minutes",
+    "system: We are currently busier than usual at the moment and are experiencing extended wait times.",
+])
+
+
+def test_queue_only_transcript_stays_disconnected_after_compaction():
+    assert pre_extract(queue_only_transcript)["service_rendered"] == "Customer disconnected during queue"
+    compacted, _ = compact_transcript(queue_only_transcript)
+    assert compacted
+    assert pre_extract(compacted)["service_rendered"] == "Customer disconnected during queue"
+
+
+def test_conversation_with_turns_gets_no_queue_marker():
+    transcript = queue_only_transcript + "\nagent: Hi, how can I help?\ncustomer: Where is my order?"
+    compacted, _ = compact_transcript(transcript)
+    assert "disconnected in queue" not in compacted
+    assert "service_rendered" not in pre_extract(compacted)